@@ -0,0 +1,104 @@
+import argparse
+import json
+import time
+from user_variables import *
+from simulation import run_simulations
+
+#########################################################################################################
+# Convergence benchmark: random pairing against smart pairing
+#########################################################################################################
+# Measures how many comparisons each pairing strategy needs to recover a known ranking, using the synthetic
+# judge from simulation.py. Every strategy runs through the real run_iterations loop:
+# - 'random': the elo_old approach of Swiss-like random rounds for the whole session (phase 1 never ends).
+# - 'smart': the elo_current approach of random rounds until every item has n comparisons, then closest pairs.
+# - 'information_gain': random rounds until every item has n comparisons, then the pairs with the highest
+#   expected information gain (PAIRING_STRATEGY = 'information_gain').
+# - 'top_k_focus': as 'smart', but items confidently outside the top --top-k are frozen (FOCUS_TOP_K).
+# Replicate r gives every strategy the same hidden strengths, so the curves differ only by pairing strategy.
+
+STRATEGIES = ['random', 'smart', 'information_gain', 'top_k_focus']
+
+def build_tasks(strategies, num_replicates, num_items, max_comparisons, checkpoint_every, seed, k_factor, batch_size, n,
+                draw_probability, noise_sd, strength_spread, top_k):
+    """
+    Builds one simulation task per strategy and replicate.
+    """
+    return [{'k_factor': k_factor, 'batch_size': batch_size, 'n': float('inf') if strategy == 'random' else n,
+             'replicate': replicate, 'combination': STRATEGIES.index(strategy), 'num_items': num_items,
+             'max_comparisons': max_comparisons, 'seed': seed, 'draw_probability': draw_probability, 'noise_sd': noise_sd,
+             'strength_spread': strength_spread, 'checkpoint_every': checkpoint_every, 'top_k': top_k,
+             'pairing_strategy': 'information_gain' if strategy == 'information_gain' else 'closest',
+             'focus_top_k': top_k if strategy == 'top_k_focus' else None}
+            for strategy in strategies for replicate in range(num_replicates)]
+
+def summarise_convergence(checkpoints):
+    """
+    Averages Kendall's tau and top-k precision over the replicates at each checkpoint.
+
+    :return: A DataFrame with one row per number of comparisons and one column per strategy and metric.
+    """
+    checkpoints = checkpoints.assign(strategy=[STRATEGIES[c] for c in checkpoints['combination']])
+    curves = checkpoints.groupby(['comparisons', 'strategy'])[['kendall_tau', 'top_k_precision']].mean().unstack('strategy')
+    curves.columns = [f'{strategy}_{metric}' for metric, strategy in curves.columns]
+    return curves.reset_index()
+
+def comparisons_to_reach(curves, strategies, targets, metric='kendall_tau'):
+    """
+    Returns the first checkpoint at which each strategy's average metric reaches each target (None if it never does).
+    """
+    budgets = {}
+    for strategy in strategies:
+        column = curves[f'{strategy}_{metric}']
+        budgets[strategy] = {target: (int(curves['comparisons'][column >= target].iloc[0]) if (column >= target).any() else None)
+                             for target in targets}
+    return budgets
+
+def print_convergence(curves, budgets, strategies, top_k):
+    """
+    Prints the accuracy curves and the comparisons each strategy needs to reach each Kendall's tau target.
+    """
+    print(curves.to_string(index=False, float_format='{:.3f}'.format))
+    print(f"\n(top-k precision uses k = {top_k})\n\nComparisons needed for an average Kendall's tau of:")
+    for target in next(iter(budgets.values())):
+        needed = ', '.join(f"{strategy} {budgets[strategy][target] if budgets[strategy][target] is not None else 'not reached'}" for strategy in strategies)
+        print(f"    {target:.2f}: {needed}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare how quickly random, smart, information gain and top-K focus pairing recover a known ranking.")
+    parser.add_argument('--strategies', nargs='+', default=STRATEGIES, choices=STRATEGIES, help="Pairing strategies to compare.")
+    parser.add_argument('--items', type=int, default=100, help="Number of items in each simulated catalogue.")
+    parser.add_argument('--comparisons', type=int, default=2000, help="Comparisons made in each simulated session.")
+    parser.add_argument('--checkpoint-every', type=int, default=100, help="Record accuracy every this many comparisons.")
+    parser.add_argument('--replicates', type=int, default=20, help="Simulated sessions per strategy.")
+    parser.add_argument('--k-factor', type=float, default=K_FACTOR, help="K-factor used by every strategy.")
+    parser.add_argument('--batch-size', type=int, default=10, help="Batch size of the smart and information gain pairing phase.")
+    parser.add_argument('--n', type=int, default=2, help="Phase 1 minimum comparisons per item for smart and information gain pairing.")
+    parser.add_argument('--draw-probability', type=float, default=0.0, help="Probability that the judge calls a draw.")
+    parser.add_argument('--noise-sd', type=float, default=0.0, help="Standard deviation of the judge's error in perceiving strength gaps.")
+    parser.add_argument('--strength-spread', type=float, default=200, help="Standard deviation of the hidden true strengths.")
+    parser.add_argument('--top-k', type=int, default=10, help="k used for top-k precision and by top-K focus pairing.")
+    parser.add_argument('--targets', type=float, nargs='+', default=[0.5, 0.6, 0.7, 0.8, 0.9], help="Kendall's tau targets to report budgets for.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed all simulations are derived from.")
+    parser.add_argument('--processes', type=int, default=None, help="Worker processes (defaults to every core).")
+    parser.add_argument('--output', default=None, help="JSON file to save the settings, curves and budgets to.")
+    args = parser.parse_args()
+
+    tasks = build_tasks(args.strategies, args.replicates, args.items, args.comparisons, args.checkpoint_every, args.seed, args.k_factor,
+                        args.batch_size, args.n, args.draw_probability, args.noise_sd, args.strength_spread, args.top_k)
+    print(f"Running {len(tasks)} simulations ({len(args.strategies)} strategies x {args.replicates} replicates)...")
+    start = time.perf_counter()
+    _, checkpoints = run_simulations(tasks, args.processes)
+    print(f"Finished in {time.perf_counter() - start:.1f}s.\n")
+
+    curves = summarise_convergence(checkpoints)
+    budgets = comparisons_to_reach(curves, args.strategies, args.targets)
+    print_convergence(curves, budgets, args.strategies, args.top_k)
+
+    if args.output:
+        settings = {key: value for key, value in vars(args).items() if key != 'output'}
+        with open(args.output, 'w') as output_file:
+            json.dump({'settings': settings, 'curves': curves.to_dict(orient='list'),
+                       'comparisons_to_reach_kendall_tau': budgets}, output_file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from user_variables import *
+from elo_scores import expected_score, build_expected_score_matrix
+
+#########################################################################################################
+# Expected score matrix builder benchmark
+#########################################################################################################
+
+def legacy_expected_score_loop(df, expected_score_matrix, rows=None):
+    """
+    The double Python loop previously used by calculate_expected_scores_from_elo, kept for comparison.
+    Only the first 'rows' rows are looped over if rows is given, so large catalogues can be timed on a sample.
+    """
+    elo_items = list(df[ELO_COLUMN].items())
+    for i, film_1_elo in elo_items[:rows]:
+        for j, film_2_elo in elo_items:
+            if i != j:
+                expected_film_1_vs_film_2, _ = expected_score(film_1_elo, film_2_elo)
+                expected_score_matrix[i, j] = expected_film_1_vs_film_2
+                expected_score_matrix[j, i] = 1 - expected_film_1_vs_film_2
+
+def time_call(function, *args, **kwargs):
+    """
+    Returns the result of a call and the wall time it took in seconds.
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def benchmark_size(num_items, loop_sample_rows, block_size, dtypes, rng):
+    """
+    Times the legacy loop against the vectorised builder for one catalogue size.
+    The legacy loop runs in full up to loop_sample_rows items and is extrapolated from that many rows above it.
+    """
+    elo_scores = rng.uniform(1000, 2000, num_items)
+    df = pd.DataFrame({ELO_COLUMN: elo_scores})
+
+    # np.zeros only commits the pages the loop actually touches, so the sampled run stays small for large n
+    sample_rows = min(num_items, loop_sample_rows)
+    legacy_matrix = np.zeros((num_items, num_items))
+    _, legacy_time = time_call(legacy_expected_score_loop, df, legacy_matrix, rows=sample_rows)
+    legacy_rows = np.array(legacy_matrix[:sample_rows])
+    del legacy_matrix
+
+    results = {
+        'n': num_items,
+        'legacy_loop_s': legacy_time * num_items / sample_rows,
+        'legacy_extrapolated': sample_rows < num_items,
+    }
+    for dtype in dtypes:
+        matrix, build_time = time_call(build_expected_score_matrix, elo_scores, dtype=dtype, block_size=block_size)
+        results[f'{dtype}_s'] = build_time
+        results[f'{dtype}_mb'] = matrix.nbytes / 1e6
+        # Compare the rows the legacy loop filled in against the vectorised matrix
+        results[f'{dtype}_max_error'] = float(np.abs(matrix[:sample_rows].astype(np.float64) - legacy_rows).max())
+        del matrix
+    return results
+
+def print_results(results):
+    """
+    Prints one line per catalogue size with the timings, speed-ups and agreement with the legacy loop.
+    """
+    for result in results:
+        legacy_note = ' (extrapolated)' if result['legacy_extrapolated'] else ''
+        print(f"n = {result['n']}: legacy loop {result['legacy_loop_s']:.2f}s{legacy_note}")
+        for dtype in ('float64', 'float32'):
+            if f'{dtype}_s' in result:
+                speed_up = result['legacy_loop_s'] / result[f'{dtype}_s']
+                print(f"    {dtype}: {result[f'{dtype}_s']:.3f}s ({speed_up:,.0f}x faster), "
+                      f"{result[f'{dtype}_mb']:,.0f} MB, max difference {result[f'{dtype}_max_error']:.1e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the vectorised expected score matrix builder against the legacy double loop.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000], help="Catalogue sizes to benchmark.")
+    parser.add_argument('--loop-sample-rows', type=int, default=1000, help="Rows timed for the legacy loop before extrapolating.")
+    parser.add_argument('--block-size', type=int, default=EXPECTED_SCORE_BLOCK_SIZE, help="Rows per block for the vectorised builder.")
+    parser.add_argument('--dtypes', nargs='+', default=['float64', 'float32'], choices=['float64', 'float32'], help="Matrix data types to time.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the synthetic Elo scores.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = [benchmark_size(num_items, args.loop_sample_rows, args.block_size, args.dtypes, rng) for num_items in args.sizes]
+    print_results(results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+import pandas as pd
+from user_variables import *
+from state_manager import StateManager
+from expected_scores import DenseExpectedScores
+from elo_scores import build_expected_score_matrix, apply_results_to_state, calculate_rank_and_elo_changes
+from file_handling import initialise_dataframe, initialise_item_state, calculate_expected_scores_from_elo, save_to_csv
+from popup_architecture import select_closest_pairs, update_score
+from leaderboard import Leaderboard
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+#########################################################################################################
+# Pipeline scaling benchmark
+#########################################################################################################
+# Times every stage of a session on synthetic catalogues of increasing size, recording wall time and memory.
+# Each stage runs in a freshly spawned process, so its peak RSS is not inflated by the stages before it (it does
+# include the stage's own setup, such as building the state it runs on). The traced peak (tracemalloc, which
+# includes NumPy arrays) only counts memory allocated while the stage itself runs.
+
+STAGES = ['initialise_dataframe', 'calculate_expected_scores_from_elo', 'select_closest_pairs', 'update_score',
+          'calculate_rank_and_elo_changes', 'save_to_csv', 'load_matrix', 'load_matrix_mmap']
+CATALOGUE_FILE = 'catalogue.csv'
+MATRIX_FILE = 'benchmark_matrix.npy'
+PROFILES = {
+    'quick': {'sizes': [100, 1000, 5000], 'repeats': 50},
+    'full': {'sizes': [100, 1000, 10000, 100000], 'repeats': 200},
+}
+
+class _StubRoot:
+    """
+    Stands in for the Tkinter window that update_score closes after each comparison.
+    """
+    def destroy(self):
+        pass
+
+def _peak_rss_mb():
+    """
+    Returns the peak resident memory of this process in MB, or None where it cannot be read.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3  # Bytes on macOS, kilobytes on Linux
+
+def write_synthetic_catalogue(directory, num_items, rng):
+    """
+    Writes a catalogue of num_items uniquely named items with ratings.
+
+    :return: Path of the catalogue CSV.
+    """
+    file_path = os.path.join(directory, CATALOGUE_FILE)
+    pd.DataFrame({NAME_COLUMN: [f"Item {i}" for i in range(num_items)], RATING_COLUMN: rng.uniform(1, 10, num_items).round(1)}).to_csv(file_path, index=False)
+    return file_path
+
+def _prepare_state(catalogue_file, backend, with_expected_scores=True):
+    """
+    Loads the catalogue into a DataFrame and StateManager ready for the stages after loading.
+    """
+    df = initialise_dataframe(catalogue_file).reset_index(drop=True)
+    state_manager = StateManager(expected_score_backend=backend, verbose=False)
+    initialise_item_state(df, state_manager)
+    if with_expected_scores:
+        state_manager.set_expected_scores_from_elo(state_manager.ratings.elo)
+    return df, state_manager
+
+def _random_results(num_items, num_results, rng):
+    """
+    Draws random (item_1, item_2, item_1_score) results between distinct items.
+    """
+    item_1_indices = rng.integers(0, num_items, num_results)
+    item_2_indices = (item_1_indices + rng.integers(1, num_items, num_results)) % num_items
+    return item_1_indices, item_2_indices, rng.choice([0.0, 0.5, 1.0], num_results)
+
+def run_stage(stage, catalogue_file, backend, repeats, seed):
+    """
+    Sets up and times one stage. Setup is not timed or traced.
+
+    :return: Dictionary with the stage's wall time (per call for repeated stages) and memory use.
+    """
+    rng = np.random.default_rng(seed)
+    directory = os.path.dirname(catalogue_file)
+    matrix_file = os.path.join(directory, MATRIX_FILE)
+    calls = 1
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if stage == 'initialise_dataframe':
+            run = lambda: initialise_dataframe(catalogue_file)
+        elif stage == 'calculate_expected_scores_from_elo':
+            df, state_manager = _prepare_state(catalogue_file, backend, with_expected_scores=False)
+            run = lambda: calculate_expected_scores_from_elo(df, state_manager)
+        elif stage == 'select_closest_pairs':
+            df, state_manager = _prepare_state(catalogue_file, backend)
+            calls = repeats
+            run = lambda: [select_closest_pairs(df, state_manager, batch_size=10) for _ in range(calls)]
+        elif stage == 'update_score':
+            df, state_manager = _prepare_state(catalogue_file, backend)
+            names = df[NAME_COLUMN].to_numpy()
+            item_1_indices, item_2_indices, item_1_scores = _random_results(len(df), repeats, rng)
+            calls = repeats
+            root = _StubRoot()
+            run = lambda: [update_score(names[i], names[j], s, 1 - s, root, df, state_manager)
+                           for i, j, s in zip(item_1_indices, item_2_indices, item_1_scores)]
+        elif stage == 'calculate_rank_and_elo_changes':
+            df, state_manager = _prepare_state(catalogue_file, backend)
+            leaderboard = Leaderboard(state_manager)
+            apply_results_to_state(state_manager, *_random_results(len(df), repeats, rng))
+            run = lambda: calculate_rank_and_elo_changes(df, ratings=state_manager.ratings, leaderboard=leaderboard)
+        elif stage == 'save_to_csv':
+            df, state_manager = _prepare_state(catalogue_file, backend)
+            run = lambda: save_to_csv(df, state_manager, os.path.join(directory, 'snapshots'))
+        elif stage in ('load_matrix', 'load_matrix_mmap'):
+            if not os.path.exists(matrix_file):
+                return {'skipped': 'the expected score matrix is not stored for this size'}
+            mmap_mode = EXPECTED_SCORE_MMAP_MODE if stage == 'load_matrix_mmap' else None
+            run = lambda: DenseExpectedScores.load(matrix_file, mmap_mode=mmap_mode)
+        else:
+            raise ValueError(f"Unknown stage '{stage}', expected one of {STAGES}.")
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        run()
+        wall_time = time.perf_counter() - start
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'wall_s': wall_time,
+        'calls': calls,
+        'per_call_s': wall_time / calls,
+        'traced_peak_mb': traced_peak / 1e6,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+def run_stage_isolated(stage, catalogue_file, backend, repeats, seed, isolate=True):
+    """
+    Runs one stage in a freshly spawned process (or in this process if isolate is False).
+    """
+    if not isolate:
+        return run_stage(stage, catalogue_file, backend, repeats, seed)
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(run_stage, stage, catalogue_file, backend, repeats, seed).result()
+
+def benchmark_size(num_items, stages, repeats, max_dense_items, seed, isolate=True):
+    """
+    Times every stage for one catalogue size. Catalogues above max_dense_items use the implicit expected
+    score backend, because the dense matrix would not fit in memory.
+    """
+    backend = 'dense' if num_items <= max_dense_items else 'implicit'
+    results = {'n': num_items, 'backend': backend, 'stages': {}}
+    with tempfile.TemporaryDirectory() as directory:
+        catalogue_file = write_synthetic_catalogue(directory, num_items, np.random.default_rng(seed))
+        if backend == 'dense':
+            # Write a matrix of the right size for the load stages to read
+            elo_scores = np.random.default_rng(seed).uniform(1000, 2000, num_items)
+            np.save(os.path.join(directory, MATRIX_FILE), build_expected_score_matrix(elo_scores))
+
+        for stage in stages:
+            result = run_stage_isolated(stage, catalogue_file, backend, repeats, seed, isolate)
+            results['stages'][stage] = result
+            if 'skipped' in result:
+                print(f"n = {num_items}: {stage} skipped ({result['skipped']})")
+            else:
+                per_call = f" ({result['per_call_s'] * 1e3:.3f} ms per call)" if result['calls'] > 1 else ''
+                rss = f", peak RSS {result['peak_rss_mb']:,.0f} MB" if result['peak_rss_mb'] is not None else ''
+                print(f"n = {num_items}: {stage} {result['wall_s']:.4f}s{per_call}, traced peak {result['traced_peak_mb']:,.1f} MB{rss}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every pipeline stage on synthetic catalogues of increasing size.")
+    parser.add_argument('--quick', action='store_true', help="Run the quick profile (small catalogues, finishes in under a minute).")
+    parser.add_argument('--sizes', type=int, nargs='+', default=None, help="Catalogue sizes, overriding the profile.")
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES, help="Stages to time.")
+    parser.add_argument('--repeats', type=int, default=None, help="Calls timed for the per-comparison stages, overriding the profile.")
+    parser.add_argument('--max-dense-items', type=int, default=10000, help="Largest catalogue that stores the dense expected score matrix.")
+    parser.add_argument('--no-isolate', action='store_true', help="Run every stage in this process (faster, but peak RSS accumulates).")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the synthetic catalogues and results.")
+    parser.add_argument('--output', default='benchmark_pipeline.json', help="JSON file to write the results to.")
+    args = parser.parse_args()
+
+    profile = PROFILES['quick' if args.quick else 'full']
+    sizes = args.sizes or profile['sizes']
+    repeats = args.repeats or profile['repeats']
+
+    start = time.perf_counter()
+    results = [benchmark_size(num_items, args.stages, repeats, args.max_dense_items, args.seed, not args.no_isolate) for num_items in sizes]
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'profile': 'quick' if args.quick else 'full',
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'repeats': repeats,
+        'total_s': time.perf_counter() - start,
+        'results': results,
+    }
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Finished in {report['total_s']:.1f}s. Results saved to {args.output}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import random
+import tempfile
+import time
+import numpy as np
+from user_variables import *
+from state_manager import StateManager
+from file_handling import initialise_item_state
+from simulation import make_simulated_items
+from web_server import JudgingServer, serve
+
+#########################################################################################################
+# Web judging server load test
+#########################################################################################################
+# Starts the judging server in a separate process on a synthetic catalogue, then runs many concurrent judges
+# against it. Each judge asks for a pair and sends back a random result as fast as it can, over one kept-alive
+# connection, and the judgments per second and round trip latencies are reported.
+
+def run_server(num_items, port, n, seed, ready):
+    """
+    Runs a judging server on a synthetic catalogue (in its own process).
+    """
+    df, _ = make_simulated_items(num_items, np.random.default_rng(seed))
+    state_manager = StateManager(verbose=False)
+    initialise_item_state(df, state_manager)
+    state_manager.set_expected_scores_from_elo(state_manager.ratings.elo)
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+        server = JudgingServer(df, state_manager, directory, n)
+        loop = asyncio.new_event_loop()
+        loop.call_soon(ready.set)
+        loop.run_until_complete(serve(server, '127.0.0.1', port))
+
+async def request(reader, writer, method, path, payload=None):
+    """
+    Sends one HTTP request over a kept-alive connection and returns the status and decoded JSON body.
+    """
+    body = json.dumps(payload).encode() if payload is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, json.loads(await reader.readexactly(int(headers['content-length'])))
+
+async def judge(port, judge_id, deadline, latencies, errors, rng):
+    """
+    Judges pairs as fast as possible until the deadline, recording the round trip time of each judgment.
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status, pair = await request(reader, writer, 'GET', f'/pair?judge={judge_id}')
+            if status != 200:
+                errors.append(status)
+                await asyncio.sleep(0.01)  # Every item is leased, so wait for another judge to answer
+                continue
+            status, _ = await request(reader, writer, 'POST', '/result', {'pair_id': pair['pair_id'], 'winner': rng.choice(['item_1', 'item_2', 'draw'])})
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+async def run_load(port, num_judges, duration, seed):
+    """
+    Runs num_judges concurrent judges for duration seconds and returns the results of the load test.
+    """
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(judge(port, i, deadline, latencies, errors, random.Random(seed + i)) for i in range(num_judges)))
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    _, stats = await request(reader, writer, 'GET', '/stats')
+    writer.close()
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'judges': num_judges,
+        'judgments': len(latencies),
+        'judgments_per_second': len(latencies) / elapsed,
+        'latency_ms_p50': float(np.percentile(latencies_ms, 50)),
+        'latency_ms_p95': float(np.percentile(latencies_ms, 95)),
+        'latency_ms_p99': float(np.percentile(latencies_ms, 99)),
+        'errors': len(errors),
+        'server_results_applied': stats['results_applied'],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the web judging server with many concurrent judges.")
+    parser.add_argument('--items', type=int, default=1000, help="Number of items in the synthetic catalogue.")
+    parser.add_argument('--judges', type=int, nargs='+', default=[1, 10, 100], help="Numbers of concurrent judges to test.")
+    parser.add_argument('--duration', type=float, default=5, help="Seconds each load level runs for.")
+    parser.add_argument('--port', type=int, default=8765, help="Port for the test server.")
+    parser.add_argument('--n', type=int, default=2, help="Minimum comparisons per item from random pairs first.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the catalogue and the judges.")
+    args = parser.parse_args()
+
+    ready = multiprocessing.Event()
+    server_process = multiprocessing.Process(target=run_server, args=(args.items, args.port, args.n, args.seed, ready), daemon=True)
+    server_process.start()
+    ready.wait()
+    time.sleep(0.2)  # Give the server a moment to start listening
+    try:
+        for num_judges in args.judges:
+            result = asyncio.run(run_load(args.port, num_judges, args.duration, args.seed))
+            print(f"{num_judges} judges: {result['judgments_per_second']:,.0f} judgments/s, latency p50 {result['latency_ms_p50']:.1f} ms, "
+                  f"p95 {result['latency_ms_p95']:.1f} ms, p99 {result['latency_ms_p99']:.1f} ms, {result['errors']} errors "
+                  f"({result['server_results_applied']} results applied in total)")
+    finally:
+        server_process.terminate()
+
+if __name__ == "__main__":
+    main()
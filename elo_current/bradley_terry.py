@@ -0,0 +1,252 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from user_variables import *
+from elo_scores import calculate_rank_and_elo_changes
+from file_handling import load_or_initialise_data, save_to_csv
+from comparison_journal import JOURNAL_FILE
+from ingest_results import map_names_to_indices
+from state_manager import StateManager
+from leaderboard import Leaderboard
+
+#########################################################################################################
+# Offline Bradley-Terry refit
+#########################################################################################################
+# Sequential Elo depends on the order of the comparisons and keeps moving by up to K_FACTOR, so for published
+# rankings the whole comparison history is refitted at once. Under the Bradley-Terry model item i beats item j
+# with probability p_i / (p_i + p_j), which is the Elo expected score when p = 10 ** (elo / 400), so the fitted
+# strengths go straight back onto the Elo scale.
+#
+# The history is reduced to one entry per pair that has been compared: how many games it played and the total
+# score of its lower indexed item (a draw counts half to each item). The log-likelihood is then maximised with
+# Newton's method on the log strengths. Its Hessian is the graph Laplacian of the compared pairs weighted by
+# n_ij * p_ij * (1 - p_ij), so each Newton step is solved with preconditioned conjugate gradients, whose
+# matrix-vector products are a gather and two bincounts over the pair arrays. Every step therefore costs time
+# proportional to the number of distinct pairs, and the number of steps barely grows with the catalogue, unlike
+# MM iterations, which crawl when items are only compared with their Elo neighbours.
+# Every item also plays BRADLEY_TERRY_PRIOR_GAMES virtual drawn games against an average item, which keeps items
+# that never won or never lost finite and ties together parts of the catalogue never compared with each other.
+
+ELO_SCALE = np.log(10) / 400
+MAX_STEP_ELO = 200  # Largest Elo change of any item in one Newton iteration
+
+def build_win_counts(item_1_indices, item_2_indices, item_1_scores, num_items):
+    """
+    Reduces a list of results to one entry per pair of items.
+
+    :param item_1_indices: Row positions of the first item of each result.
+    :param item_2_indices: Row positions of the second item of each result.
+    :param item_1_scores: Score of the first item of each result (1 win, 0.5 draw, 0 loss).
+    :param num_items: Number of items in the catalogue.
+    :return: (lower, higher, games, lower_scores) arrays with one entry per compared pair, where lower_scores
+             is the total score of the lower indexed item against the higher one.
+    """
+    item_1_indices = np.asarray(item_1_indices, dtype=np.int64)
+    item_2_indices = np.asarray(item_2_indices, dtype=np.int64)
+    item_1_scores = np.asarray(item_1_scores, dtype=np.float64)
+
+    lower = np.minimum(item_1_indices, item_2_indices)
+    higher = np.maximum(item_1_indices, item_2_indices)
+    lower_scores = np.where(item_1_indices == lower, item_1_scores, 1 - item_1_scores)
+
+    pair_codes, pair_positions = np.unique(lower * num_items + higher, return_inverse=True)
+    games = np.bincount(pair_positions, minlength=len(pair_codes)).astype(np.float64)
+    return pair_codes // num_items, pair_codes % num_items, games, np.bincount(pair_positions, weights=lower_scores, minlength=len(pair_codes))
+
+def _pair_laplacian_product(vector, lower, higher, pair_weights, diagonal):
+    """
+    Multiplies a vector by the weighted graph Laplacian of the compared pairs plus the prior, given its diagonal.
+    """
+    num_items = len(vector)
+    return (diagonal * vector - np.bincount(lower, weights=pair_weights * vector[higher], minlength=num_items)
+            - np.bincount(higher, weights=pair_weights * vector[lower], minlength=num_items))
+
+def _solve_newton_step(gradient, lower, higher, pair_weights, diagonal, relative_tolerance=1e-6, max_iterations=1000):
+    """
+    Solves Hessian * step = -gradient with conjugate gradients, preconditioned by the Hessian's diagonal, until
+    the residual is relative_tolerance times the gradient.
+    """
+    stop_norm = relative_tolerance * np.linalg.norm(gradient)
+    step = np.zeros_like(gradient)
+    residual = -gradient
+    preconditioned = residual / diagonal
+    direction = preconditioned.copy()
+    residual_dot = residual @ preconditioned
+    for _ in range(max_iterations):
+        if np.linalg.norm(residual) <= stop_norm:
+            break
+        product = _pair_laplacian_product(direction, lower, higher, pair_weights, diagonal)
+        curvature = direction @ product
+        if curvature <= 0:
+            break  # Rounding has used up the precision of the solve
+        step_size = residual_dot / curvature
+        step += step_size * direction
+        residual -= step_size * product
+        preconditioned = residual / diagonal
+        new_residual_dot = residual @ preconditioned
+        direction = preconditioned + (new_residual_dot / residual_dot) * direction
+        residual_dot = new_residual_dot
+    return step
+
+def _negative_log_likelihood(log_strengths, lower, higher, games, lower_scores, prior_games):
+    """
+    Returns the negative log-likelihood of the win counts, including the virtual games against an average item.
+    """
+    gaps = log_strengths[lower] - log_strengths[higher]
+    # -log(p) = log(1 + exp(-gap)) for the lower item winning, written with logaddexp so large gaps cannot overflow
+    pair_terms = lower_scores * np.logaddexp(0, -gaps) + (games - lower_scores) * np.logaddexp(0, gaps)
+    prior_terms = prior_games / 2 * (np.logaddexp(0, -log_strengths) + np.logaddexp(0, log_strengths))
+    return pair_terms.sum() + prior_terms.sum()
+
+def fit_bradley_terry(lower, higher, games, lower_scores, initial_elo, prior_games=BRADLEY_TERRY_PRIOR_GAMES,
+                      max_iterations=BRADLEY_TERRY_MAX_ITERATIONS, tolerance=BRADLEY_TERRY_TOLERANCE):
+    """
+    Fits Bradley-Terry strengths to the win counts with Newton iterations, starting from the current Elo scores.
+
+    :param lower: Lower row position of each compared pair, as returned by build_win_counts.
+    :param higher: Higher row position of each compared pair.
+    :param games: Number of games each pair played.
+    :param lower_scores: Total score of the lower item of each pair.
+    :param initial_elo: Current Elo scores of all items, used as the starting point and to place the fit on the Elo scale.
+    :param prior_games: Virtual drawn games each item plays against an average item.
+    :param max_iterations: Largest number of Newton iterations.
+    :param tolerance: Stop once a Newton step moves no item's Elo score by more than this.
+    :return: (elo, iterations, converged) where elo holds the fitted Elo scores of all items. Items with no
+             comparisons keep their current Elo score, and the compared items keep their average Elo score.
+    """
+    initial_elo = np.asarray(initial_elo, dtype=np.float64)
+    num_items = len(initial_elo)
+    compared = (np.bincount(lower, weights=games, minlength=num_items) + np.bincount(higher, weights=games, minlength=num_items)) > 0
+    if not compared.any():
+        return initial_elo.copy(), 0, True
+
+    # Work with natural log strengths relative to the average compared item, which the virtual games are played against
+    anchor = initial_elo[compared].mean()
+    log_strengths = ELO_SCALE * (initial_elo - anchor)
+    log_strengths[~compared] = 0
+    objective = _negative_log_likelihood(log_strengths, lower, higher, games, lower_scores, prior_games)
+    iterations = 0
+    converged = False
+    while iterations < max_iterations and not converged:
+        # Gradient and Hessian of the negative log-likelihood
+        lower_win_probabilities = 1 / (1 + np.exp(log_strengths[higher] - log_strengths[lower]))
+        pair_gradients = games * lower_win_probabilities - lower_scores
+        prior_win_probabilities = 1 / (1 + np.exp(-log_strengths))
+        gradient = (np.bincount(lower, weights=pair_gradients, minlength=num_items) - np.bincount(higher, weights=pair_gradients, minlength=num_items)
+                    + prior_games * (prior_win_probabilities - 0.5))
+        pair_weights = games * lower_win_probabilities * (1 - lower_win_probabilities)
+        diagonal = (np.bincount(lower, weights=pair_weights, minlength=num_items) + np.bincount(higher, weights=pair_weights, minlength=num_items)
+                    + prior_games * prior_win_probabilities * (1 - prior_win_probabilities))
+
+        step = _solve_newton_step(gradient, lower, higher, pair_weights, diagonal)
+
+        # Far from the fit the Hessian of lopsided pairs is nearly zero and the Newton step can be huge, so no item
+        # moves more than MAX_STEP_ELO at once, and the step is halved until the likelihood improves
+        step_size = min(1.0, MAX_STEP_ELO * ELO_SCALE / np.abs(step).max()) if step.any() else 1.0
+        while True:
+            new_log_strengths = log_strengths + step_size * step
+            new_objective = _negative_log_likelihood(new_log_strengths, lower, higher, games, lower_scores, prior_games)
+            if new_objective <= objective or step_size < 1e-6:
+                break
+            step_size /= 2
+        converged = np.abs(step_size * step).max() / ELO_SCALE <= tolerance
+        log_strengths, objective = new_log_strengths, new_objective
+        iterations += 1
+
+    elo = initial_elo.copy()
+    fitted = log_strengths[compared] / ELO_SCALE
+    elo[compared] = anchor + fitted - fitted.mean()
+    return elo, iterations, converged
+
+def read_journal_results(journal_path, state_manager, chunksize=1_000_000):
+    """
+    Reads every result in the comparison journal as row positions and scores, skipping items no longer in the rankings.
+
+    :return: (item_1_indices, item_2_indices, item_1_scores, skipped).
+    """
+    return read_results(journal_path, state_manager, 'item_1', 'item_2', 'item_1_score', chunksize)
+
+def read_results(results_file, state_manager, item_a_column='item_a', item_b_column='item_b', score_column='score_a', chunksize=1_000_000):
+    """
+    Reads a CSV of results in chunks as row positions and scores, skipping unknown items, self-comparisons,
+    scores outside 0 to 1 and rows cut off by a crash.
+
+    :return: (item_a_indices, item_b_indices, item_a_scores, skipped).
+    """
+    item_a_parts, item_b_parts, score_parts = [], [], []
+    skipped = 0
+    for chunk in pd.read_csv(results_file, usecols=[item_a_column, item_b_column, score_column], chunksize=chunksize):
+        item_a_indices = map_names_to_indices(chunk[item_a_column], state_manager)
+        item_b_indices = map_names_to_indices(chunk[item_b_column], state_manager)
+        item_a_scores = pd.to_numeric(chunk[score_column], errors='coerce').to_numpy(dtype=np.float64)
+        valid = (item_a_indices >= 0) & (item_b_indices >= 0) & (item_a_indices != item_b_indices) & (item_a_scores >= 0) & (item_a_scores <= 1)
+        item_a_parts.append(item_a_indices[valid])
+        item_b_parts.append(item_b_indices[valid])
+        score_parts.append(item_a_scores[valid])
+        skipped += int((~valid).sum())
+    if not item_a_parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0), skipped
+    return np.concatenate(item_a_parts), np.concatenate(item_b_parts), np.concatenate(score_parts), skipped
+
+def refit_rankings(directory=DIRECTORY, initial_csv_file=INITIAL_CSV_FILE, results_files=(), prior_games=BRADLEY_TERRY_PRIOR_GAMES,
+                   max_iterations=BRADLEY_TERRY_MAX_ITERATIONS, tolerance=BRADLEY_TERRY_TOLERANCE):
+    """
+    Refits the latest rankings to the whole comparison history and saves them as a new snapshot.
+
+    :param directory: Directory holding the saved rankings and the comparison journal, as in main.py.
+    :param initial_csv_file: Initial item file used when there are no saved rankings yet.
+    :param results_files: Extra results files in the ingest_results.py format, such as results that were ingested
+                          (ingested results are not written to the journal).
+    :return: The refitted DataFrame.
+    """
+    state_manager = StateManager()
+    df = load_or_initialise_data(directory, state_manager, initial_csv_file)
+    leaderboard = Leaderboard(state_manager)
+    ratings = state_manager.ratings
+    start = time.perf_counter()
+
+    # Gather every result in the history
+    sources = [read_journal_results(os.path.join(directory, JOURNAL_FILE), state_manager)] if os.path.exists(os.path.join(directory, JOURNAL_FILE)) else []
+    sources += [read_results(results_file, state_manager) for results_file in results_files]
+    item_1_indices = np.concatenate([source[0] for source in sources]) if sources else np.empty(0, dtype=np.int64)
+    item_2_indices = np.concatenate([source[1] for source in sources]) if sources else np.empty(0, dtype=np.int64)
+    item_1_scores = np.concatenate([source[2] for source in sources]) if sources else np.empty(0)
+    skipped = sum(source[3] for source in sources)
+    read_time = time.perf_counter() - start
+
+    # Fit, then write the fitted scores back to the rating store
+    fit_start = time.perf_counter()
+    lower, higher, games, lower_scores = build_win_counts(item_1_indices, item_2_indices, item_1_scores, len(ratings))
+    elo, iterations, converged = fit_bradley_terry(lower, higher, games, lower_scores, ratings.elo, prior_games, max_iterations, tolerance)
+    fit_time = time.perf_counter() - fit_start
+    ratings.elo_change = elo - ratings.elo
+    ratings.elo = elo
+    state_manager.set_expected_scores_from_elo(ratings.elo)
+    state_manager.build_elo_index(ratings.elo)
+
+    print(f"Refitted {len(ratings)} items to {len(item_1_scores)} results ({len(lower)} distinct pairs, {skipped} skipped) in "
+          f"{iterations} iterations{'' if converged else ' without converging'}: read in {read_time:.2f}s, fitted in {fit_time:.2f}s.")
+
+    # Save the refit as its own snapshot rather than replacing the sequential Elo snapshot it started from
+    df = calculate_rank_and_elo_changes(df, ratings=ratings, leaderboard=leaderboard)
+    state_manager.comparison_count += 1
+    save_to_csv(df, state_manager, directory)
+    state_manager.close_journal()
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description="Refit the latest rankings to the whole comparison history with a Bradley-Terry model.")
+    parser.add_argument('--directory', default=DIRECTORY, help="Directory holding the saved rankings and the comparison journal.")
+    parser.add_argument('--initial-csv-file', default=INITIAL_CSV_FILE, help="Initial item file used if there are no saved rankings.")
+    parser.add_argument('--results-files', nargs='*', default=[], help="Extra results files in the ingest_results.py format.")
+    parser.add_argument('--prior-games', type=float, default=BRADLEY_TERRY_PRIOR_GAMES, help="Virtual drawn games each item plays against an average item.")
+    parser.add_argument('--max-iterations', type=int, default=BRADLEY_TERRY_MAX_ITERATIONS, help="Largest number of Newton iterations.")
+    parser.add_argument('--tolerance', type=float, default=BRADLEY_TERRY_TOLERANCE, help="Stop once no Elo score moves by more than this.")
+    args = parser.parse_args()
+
+    refit_rankings(args.directory, args.initial_csv_file, args.results_files, args.prior_games, args.max_iterations, args.tolerance)
+
+if __name__ == "__main__":
+    main()
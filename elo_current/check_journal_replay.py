@@ -0,0 +1,100 @@
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import numpy as np
+from user_variables import *
+from state_manager import StateManager
+from file_handling import load_or_initialise_data, save_to_csv
+from simulation import make_simulated_items, SimulatedJudge
+from popup_architecture import run_iterations
+
+#########################################################################################################
+# Journal replay check
+#########################################################################################################
+# Runs a saved session, then a second session that crashes part way through Phase 1 (its journal is left on
+# disk but nothing is saved), then loads the rankings again so the journal is replayed. The replayed Elo
+# scores, comparison counts, pair outcomes and comparison count must be exactly those the crashed session
+# held in memory, otherwise resuming after a crash would not continue the session it interrupted.
+
+def run_session(directory, catalogue_file, true_strengths, rng, max_comparisons, n, save=True):
+    """
+    Loads the rankings and judges random Phase 1 pairs until max_comparisons have been made in total, saving
+    the rankings afterwards unless save is False (a crash, which leaves the journal behind).
+
+    :return: The DataFrame and StateManager as they were at the end of the session.
+    """
+    state_manager = StateManager(verbose=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        df = load_or_initialise_data(directory, state_manager, catalogue_file)
+        judge = SimulatedJudge(true_strengths[df[NAME_COLUMN].str[5:].astype(int).to_numpy()], rng, max_comparisons)
+        df = run_iterations(df, state_manager, n=n, popup=judge)
+        if save:
+            save_to_csv(df, state_manager, directory)
+    state_manager.close_journal()
+    return df, state_manager
+
+def item_state(df, state_manager):
+    """
+    Returns the Elo scores and comparison counts in item name order, and the pair outcomes keyed by item names.
+    """
+    names = df[NAME_COLUMN].to_numpy()
+    order = np.argsort(names)
+    ratings = state_manager.ratings
+    lower, higher, lower_wins, higher_wins, draws = state_manager.pair_outcomes.to_arrays()
+    outcomes = {}
+    for i, j, wins_i, wins_j, pair_draws in zip(lower.tolist(), higher.tolist(), lower_wins.tolist(), higher_wins.tolist(), draws.tolist()):
+        (name_i, counts_i), (name_j, counts_j) = sorted([(names[i], wins_i), (names[j], wins_j)])
+        outcomes[(name_i, name_j)] = (counts_i, counts_j, pair_draws)
+    return names[order], ratings.elo[order], ratings.comparisons[order], outcomes
+
+def run_check(num_items, saved_comparisons, crashed_comparisons, seed):
+    """
+    Crashes a session in Phase 1 after crashed_comparisons more comparisons than the saved ones, replays its
+    journal and checks the replayed state against the crashed session's.
+
+    :return: A dictionary of the comparison counts involved.
+    """
+    rng = np.random.default_rng(seed)
+    random.seed(seed)  # Phase 1 pairings use the random module
+    df, true_strengths = make_simulated_items(num_items, rng)
+    n = saved_comparisons + crashed_comparisons  # Far more than any item reaches, so both sessions stay in Phase 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        catalogue_file = os.path.join(directory, 'catalogue.csv')
+        df[[NAME_COLUMN]].to_csv(catalogue_file, index=False)
+
+        saved_df, saved_state = run_session(directory, catalogue_file, true_strengths, rng, saved_comparisons, n)
+        crashed_df, crashed_state = run_session(directory, catalogue_file, true_strengths, rng, saved_comparisons + crashed_comparisons, n, save=False)
+        replay_state = StateManager(verbose=False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            replay_df = load_or_initialise_data(directory, replay_state, catalogue_file)
+        replay_state.close_journal()
+
+        crashed_names, crashed_elo, crashed_counts, crashed_outcomes = item_state(crashed_df, crashed_state)
+        replay_names, replay_elo, replay_counts, replay_outcomes = item_state(replay_df, replay_state)
+        assert (crashed_names == replay_names).all(), "the replayed items differ"
+        assert replay_state.comparison_count == crashed_state.comparison_count, "the comparison count differs after the replay"
+        assert (replay_counts == crashed_counts).all(), "the replayed comparison counts differ from the crashed session's"
+        assert (crashed_counts.sum() - saved_state.ratings.comparisons.sum()) == 2 * crashed_comparisons, "a comparison was not counted once for each item"
+        assert (replay_elo == crashed_elo).all(), "the replayed Elo scores differ from the crashed session's"
+        assert replay_outcomes == crashed_outcomes, "the replayed pair outcomes differ from the crashed session's"
+
+    return {'saved': saved_comparisons, 'replayed': crashed_comparisons}
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that replaying the journal of a session that crashed in Phase 1 restores it exactly.")
+    parser.add_argument('--items', type=int, default=50, help="Number of items in the synthetic catalogue.")
+    parser.add_argument('--saved', type=int, default=40, help="Comparisons made and saved before the crashed session.")
+    parser.add_argument('--crashed', type=int, default=30, help="Comparisons made in the crashed session before the crash.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the catalogue, the pairings and the judge.")
+    args = parser.parse_args()
+
+    result = run_check(args.items, args.saved, args.crashed, args.seed)
+    print(f"Replayed {result['replayed']} Phase 1 comparisons on top of {result['saved']} saved ones: Elo scores, comparison counts "
+          f"and pair outcomes match the crashed session.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import csv
+import os
+import time
+from user_variables import *
+
+#########################################################################################################
+# Append-only comparison journal
+#########################################################################################################
+# Every comparison is appended to the journal as soon as it is made, so a crash or a killed popup only
+# loses the comparisons since the last fsync rather than the whole session. Each record is numbered with
+# the comparison count it brings the session to, which is how records newer than a saved snapshot are found.
+
+JOURNAL_FILE = 'comparison_journal.csv'
+JOURNAL_FIELDS = ['comparison', 'timestamp', 'item_1', 'item_2', 'item_1_score', 'item_2_score',
+                  'item_1_elo_before', 'item_2_elo_before', 'item_1_elo_after', 'item_2_elo_after']
+
+class ComparisonJournal:
+    """
+    Appends one CSV row per comparison. Each row is flushed to the operating system straight away and the
+    file is fsynced every fsync_every rows, so a killed process loses nothing and a power cut loses at most
+    fsync_every comparisons.
+    """
+    def __init__(self, file_path, fsync_every=JOURNAL_FSYNC_EVERY):
+        """
+        :param file_path: Path of the journal file, created with a header row if it does not exist.
+        :param fsync_every: Number of rows written between fsync calls.
+        """
+        self.file_path = file_path
+        self.fsync_every = fsync_every
+        self.unsynced_rows = 0
+        if os.path.exists(file_path):
+            _truncate_partial_row(file_path)  # Drop a row cut off by a crash so it cannot merge with the next one
+        is_new = not os.path.exists(file_path) or os.path.getsize(file_path) == 0
+        self.file = open(file_path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        if is_new:
+            self.writer.writerow(JOURNAL_FIELDS)
+            self.sync()
+
+    def record(self, comparison, item_1, item_2, item_1_score, item_2_score, elos_before, elos_after):
+        """
+        Appends one comparison to the journal.
+
+        :param comparison: The comparison count this comparison brings the session to.
+        :param elos_before: (item_1, item_2) Elo scores before the comparison.
+        :param elos_after: (item_1, item_2) Elo scores after the comparison.
+        """
+        self.writer.writerow([comparison, round(time.time(), 3), item_1, item_2, item_1_score, item_2_score,
+                              elos_before[0], elos_before[1], elos_after[0], elos_after[1]])
+        self.file.flush()
+        self.unsynced_rows += 1
+        if self.unsynced_rows >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        """
+        Forces all written rows onto disk.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced_rows = 0
+
+    def close(self):
+        """
+        Syncs and closes the journal file.
+        """
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+def _truncate_partial_row(file_path, chunk_size=4096):
+    """
+    Cuts a file back to its last newline, removing a last row that was only partly written.
+    """
+    with open(file_path, 'rb+') as journal_file:
+        end = journal_file.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - chunk_size)
+            journal_file.seek(start)
+            newline = journal_file.read(position - start).rfind(b'\n')
+            if newline != -1:
+                if start + newline + 1 != end:
+                    journal_file.truncate(start + newline + 1)
+                return
+            position = start
+        journal_file.truncate(0)
+
+def _complete_lines(journal_file):
+    """
+    Yields the lines of a file, leaving out a last line without a newline (a row cut off by a crash).
+    """
+    for line in journal_file:
+        if line.endswith('\n'):
+            yield line
+
+def read_journal(file_path, after_comparison=-1, offset=0):
+    """
+    Yields the journal records numbered after after_comparison, with numeric fields converted.
+    Rows that were only partly written (from a crash mid-write) are skipped.
+
+    :param offset: Byte position to start reading from, such as the journal size recorded when the latest
+                   snapshot was saved. Ignored if the journal is now shorter than that.
+    """
+    with open(file_path, newline='', encoding='utf-8') as journal_file:
+        if 0 < offset <= os.path.getsize(file_path):
+            journal_file.seek(offset)
+            reader = csv.DictReader(_complete_lines(journal_file), fieldnames=JOURNAL_FIELDS)
+        else:
+            reader = csv.DictReader(_complete_lines(journal_file))
+        for row in reader:
+            try:
+                record = {
+                    'comparison': int(row['comparison']),
+                    'timestamp': float(row['timestamp']),
+                    'item_1': row['item_1'],
+                    'item_2': row['item_2'],
+                    'item_1_score': float(row['item_1_score']),
+                    'item_2_score': float(row['item_2_score']),
+                    'item_1_elo_before': float(row['item_1_elo_before']),
+                    'item_2_elo_before': float(row['item_2_elo_before']),
+                    'item_1_elo_after': float(row['item_1_elo_after']),
+                    'item_2_elo_after': float(row['item_2_elo_after']),
+                }
+            except (TypeError, ValueError):
+                continue
+            if record['comparison'] > after_comparison:
+                yield record
+
+def replay_journal(file_path, state_manager, offset=0):
+    """
+    Re-applies journal records newer than the loaded snapshot to the StateManager's rating store, then
+    updates the expected scores and sorted Elo index of every item they touched.
+
+    :param file_path: Path of the journal file.
+    :param state_manager: Instance of StateManager whose comparison_count is the loaded snapshot's count.
+    :param offset: Byte position in the journal where the rows after the loaded snapshot start, if known.
+    :return: The number of records replayed.
+    """
+    if not os.path.exists(file_path):
+        return 0
+
+    ratings = state_manager.ratings
+    touched_items = set()
+    replayed = 0
+    skipped = 0
+    for record in read_journal(file_path, after_comparison=state_manager.comparison_count, offset=offset):
+        item_1_index = state_manager.name_index.get(record['item_1'])
+        item_2_index = state_manager.name_index.get(record['item_2'])
+        if item_1_index is None or item_2_index is None:
+            skipped += 1
+            continue
+
+        # Apply the journalled Elo scores directly, so the replay matches the original session exactly
+        ratings.elo[item_1_index] = record['item_1_elo_after']
+        ratings.elo[item_2_index] = record['item_2_elo_after']
+        ratings.elo_change[item_1_index] = record['item_1_elo_after'] - record['item_1_elo_before']
+        ratings.elo_change[item_2_index] = record['item_2_elo_after'] - record['item_2_elo_before']
+        ratings.comparisons[item_1_index] += 1
+        ratings.comparisons[item_2_index] += 1
+        state_manager.pair_outcomes.record(item_1_index, item_2_index, record['item_1_score'])
+
+        touched_items.update((item_1_index, item_2_index))
+        state_manager.comparison_count = record['comparison']
+        replayed += 1
+
+    # Bring the expected scores and sorted Elo index up to date once for all touched items
+    state_manager.refresh_items(touched_items)
+
+    if replayed or skipped:
+        print(f"Replayed {replayed} comparisons from the journal made after the latest save" + (f" (skipped {skipped} with unknown items)." if skipped else "."))
+    return replayed
@@ -0,0 +1,342 @@
+from bisect import bisect_left, bisect_right, insort
+import heapq
+from itertools import chain, islice
+
+#########################################################################################################
+# Bucketed sorted list
+#########################################################################################################
+# A flat Python list keeps its entries sorted with bisect, but every insert or delete shifts all the entries
+# after it, so moving one item in a catalogue of a million items copies about a million pointers. Here the
+# sorted entries are split into buckets of about BUCKET_SIZE entries (the layout sortedcontainers uses), with
+# the largest entry of each bucket in `maxes` to find the right bucket by bisection. An insert or delete only
+# shifts entries within one bucket. A Fenwick tree over the bucket lengths turns a bucket into the position
+# of its first entry and back in O(log n), so positions and ranks still come from one search. Buckets are
+# split once they double in size and merged with a neighbour once they halve, and the Fenwick tree is only
+# rebuilt then, so adding or removing an entry costs amortised O(log n) plus a copy of at most
+# 2 * BUCKET_SIZE pointers, whatever the number of entries.
+
+BUCKET_SIZE = 512  # Target number of entries in each bucket
+
+class BucketedSortedList:
+    """
+    A sorted list that supports add, remove, bisect and indexing by position in O(log n), split into buckets.
+    """
+    def __init__(self, values=(), bucket_size=BUCKET_SIZE):
+        """
+        :param values: Entries to start with, in any order.
+        :param bucket_size: Target number of entries in each bucket.
+        """
+        self.bucket_size = bucket_size
+        values = sorted(values)
+        self.buckets = [values[start:start + bucket_size] for start in range(0, len(values), bucket_size)]
+        self._rebuild()
+
+    def _rebuild(self):
+        """
+        Recalculates the bucket maxima, the length and the Fenwick tree of bucket lengths after buckets change.
+        """
+        self.maxes = [bucket[-1] for bucket in self.buckets]
+        self.length = sum(len(bucket) for bucket in self.buckets)
+        tree = [0] + [len(bucket) for bucket in self.buckets]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.tree_step = 1 << (len(tree) - 1).bit_length() >> 1  # Largest power of two no larger than the number of buckets
+
+    def _tree_add(self, bucket_index, delta):
+        tree = self.tree
+        size = len(tree)
+        i = bucket_index + 1
+        while i < size:
+            tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, bucket_index):
+        """
+        Returns the number of entries in the buckets before bucket_index.
+        """
+        tree = self.tree
+        total = 0
+        i = bucket_index
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, position):
+        """
+        Returns the (bucket index, position within the bucket) of a position in the whole list.
+        """
+        tree = self.tree
+        size = len(tree)
+        bucket_index = 0
+        step = self.tree_step
+        while step:
+            next_index = bucket_index + step
+            if next_index < size and tree[next_index] <= position:
+                bucket_index = next_index
+                position -= tree[next_index]
+            step >>= 1
+        return bucket_index, position
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return chain.from_iterable(self.buckets)
+
+    def __reversed__(self):
+        return chain.from_iterable(reversed(bucket) for bucket in reversed(self.buckets))
+
+    def __getitem__(self, position):
+        """
+        Returns the entry at a position (negative positions count from the end), or a list for a slice.
+        """
+        if isinstance(position, slice):
+            start, stop, step = position.indices(self.length)
+            if step != 1:
+                return list(self)[position]
+            if start >= stop:
+                return []
+            bucket_index, offset = self._locate(start)
+            return list(islice(chain(self.buckets[bucket_index][offset:], chain.from_iterable(self.buckets[bucket_index + 1:])), stop - start))
+        if position < 0:
+            position += self.length
+        if not 0 <= position < self.length:
+            raise IndexError("BucketedSortedList index out of range")
+        bucket_index, offset = self._locate(position)
+        return self.buckets[bucket_index][offset]
+
+    def bisect_left(self, value):
+        """
+        Returns the position of the first entry not less than value.
+        """
+        bucket_index = bisect_left(self.maxes, value)
+        if bucket_index == len(self.maxes):
+            return self.length
+        return self._prefix(bucket_index) + bisect_left(self.buckets[bucket_index], value)
+
+    def bisect_right(self, value):
+        """
+        Returns the position after the last entry not greater than value.
+        """
+        bucket_index = bisect_right(self.maxes, value)
+        if bucket_index == len(self.maxes):
+            return self.length
+        return self._prefix(bucket_index) + bisect_right(self.buckets[bucket_index], value)
+
+    def add(self, value):
+        """
+        Inserts an entry in sorted order, splitting its bucket once it holds twice the bucket size.
+        """
+        if not self.buckets:
+            self.buckets.append([value])
+            self._rebuild()
+            return
+        bucket_index = min(bisect_left(self.maxes, value), len(self.maxes) - 1)
+        bucket = self.buckets[bucket_index]
+        insort(bucket, value)
+        self.maxes[bucket_index] = bucket[-1]
+        self.length += 1
+        if len(bucket) > 2 * self.bucket_size:
+            self.buckets[bucket_index:bucket_index + 1] = [bucket[:self.bucket_size], bucket[self.bucket_size:]]
+            self._rebuild()
+        else:
+            self._tree_add(bucket_index, 1)
+
+    def remove(self, value):
+        """
+        Removes an entry, merging its bucket with a neighbour once it holds less than half the bucket size.
+        Raises ValueError if the entry is not in the list.
+        """
+        bucket_index = bisect_left(self.maxes, value)
+        bucket = self.buckets[bucket_index] if bucket_index < len(self.buckets) else []
+        offset = bisect_left(bucket, value)
+        if offset == len(bucket) or bucket[offset] != value:
+            raise ValueError(f"{value!r} is not in the list")
+        del bucket[offset]
+        self.length -= 1
+
+        if len(bucket) < self.bucket_size // 2 and len(self.buckets) > 1:
+            # Merge with a neighbour, splitting the merged bucket again if it is now too large
+            left = bucket_index - 1 if bucket_index > 0 else bucket_index
+            merged = self.buckets[left] + self.buckets[left + 1]
+            halves = [merged] if len(merged) <= 2 * self.bucket_size else [merged[:len(merged) // 2], merged[len(merged) // 2:]]
+            self.buckets[left:left + 2] = halves
+            self._rebuild()
+        elif not bucket:
+            del self.buckets[bucket_index]
+            self._rebuild()
+        else:
+            self.maxes[bucket_index] = bucket[-1]
+            self._tree_add(bucket_index, -1)
+
+#########################################################################################################
+# Sorted Elo neighbour index
+#########################################################################################################
+# The expected score of a pair moves away from 0.5 as the gap between their Elo scores grows, so the pairs
+# closest to 0.5 are the pairs with the smallest Elo gaps. Keeping the items sorted by Elo score, along with
+# the gaps between neighbours, means the closest pairs can be found without looking at the whole matrix.
+# The sorted keys are also an order-statistics structure: an item's rank is one binary search away.
+
+class SortedEloIndex:
+    """
+    Keeps item indices sorted by Elo score, along with a sorted list of the gaps between Elo neighbours.
+
+    - `keys`: BucketedSortedList of (elo, item_index) entries.
+    - `gaps`: BucketedSortedList of (elo_gap, lower_item_index, higher_item_index) entries for each pair of neighbours.
+    Moving an item removes and adds two keys and up to six gaps, each in amortised O(log n).
+    """
+    def __init__(self, elo_scores=()):
+        """
+        :param elo_scores: Elo scores of all items, in DataFrame row order.
+        """
+        self.elo_by_item = {item_index: float(elo) for item_index, elo in enumerate(elo_scores)}
+        keys = sorted((elo, item_index) for item_index, elo in self.elo_by_item.items())
+        self.keys = BucketedSortedList(keys)
+        self.gaps = BucketedSortedList(self._gap(keys[p], keys[p + 1]) for p in range(len(keys) - 1))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, item_index):
+        return item_index in self.elo_by_item
+
+    @staticmethod
+    def _gap(left_key, right_key):
+        """
+        Builds the gap entry for two neighbouring keys, ordering the item indices so ties sort like the matrix scan.
+        """
+        return (right_key[0] - left_key[0], min(left_key[1], right_key[1]), max(left_key[1], right_key[1]))
+
+    def pair_key(self, item_1_index, item_2_index):
+        """
+        Returns the (elo_gap, lower_item_index, higher_item_index) entry of any two items, which is how
+        closest_pairs orders pairs.
+        """
+        elo_gap = abs(self.elo_by_item[item_1_index] - self.elo_by_item[item_2_index])
+        return (elo_gap, min(item_1_index, item_2_index), max(item_1_index, item_2_index))
+
+    def pairs_near(self, item_index, max_gap):
+        """
+        Returns the pair entries of an item with every other item whose Elo score is within max_gap of its own.
+        """
+        elo = self.elo_by_item[item_index]
+        margin = max_gap * (1 + 1e-12) + 1e-9  # Widen the search slightly so rounding cannot drop a pair exactly max_gap away
+        start = self.keys.bisect_left((elo - margin, -1))
+        stop = self.keys.bisect_right((elo + margin, float('inf')))
+        return [self.pair_key(item_index, other_index) for _, other_index in self.keys[start:stop]
+                if other_index != item_index and abs(self.elo_by_item[other_index] - elo) <= max_gap]
+
+    def _remove_gap(self, left_key, right_key):
+        self.gaps.remove(self._gap(left_key, right_key))
+
+    def _position(self, item_index):
+        """
+        Returns the position of an item in the sorted keys.
+        """
+        return self.keys.bisect_left((self.elo_by_item[item_index], item_index))
+
+    def insert(self, item_index, elo):
+        """
+        Adds an item to the index, replacing the gap between its new neighbours with two new gaps.
+        """
+        key = (float(elo), item_index)
+        position = self.keys.bisect_left(key)
+        left_key = self.keys[position - 1] if position > 0 else None
+        right_key = self.keys[position] if position < len(self.keys) else None
+
+        if left_key is not None and right_key is not None:
+            self._remove_gap(left_key, right_key)
+        if left_key is not None:
+            self.gaps.add(self._gap(left_key, key))
+        if right_key is not None:
+            self.gaps.add(self._gap(key, right_key))
+
+        self.keys.add(key)
+        self.elo_by_item[item_index] = key[0]
+
+    def remove(self, item_index):
+        """
+        Removes an item from the index, joining its two neighbours with a single gap.
+        """
+        position = self._position(item_index)
+        key = self.keys[position]
+        left_key = self.keys[position - 1] if position > 0 else None
+        right_key = self.keys[position + 1] if position + 1 < len(self.keys) else None
+
+        if left_key is not None:
+            self._remove_gap(left_key, key)
+        if right_key is not None:
+            self._remove_gap(key, right_key)
+        if left_key is not None and right_key is not None:
+            self.gaps.add(self._gap(left_key, right_key))
+
+        self.keys.remove(key)
+        del self.elo_by_item[item_index]
+
+    def update(self, item_index, elo):
+        """
+        Moves an item to its new position after its Elo score has changed.
+        """
+        self.remove(item_index)
+        self.insert(item_index, elo)
+
+    def rank(self, item_index):
+        """
+        Returns the rank of an item, 1 for the highest Elo score. Tied items are ranked higher row position first.
+        """
+        return len(self.keys) - self._position(item_index)
+
+    def top(self, num_items):
+        """
+        Returns the item indices of the num_items highest Elo scores, highest first.
+        """
+        return [item_index for _, item_index in reversed(self.keys[max(len(self.keys) - num_items, 0):])]
+
+    def ranking(self):
+        """
+        Returns every item index, highest Elo score first.
+        """
+        return [item_index for _, item_index in reversed(self.keys)]
+
+    def closest_pairs(self, num_pairs):
+        """
+        Returns the num_pairs pairs with the smallest Elo gaps, smallest first, as (lower_index, higher_index) tuples.
+        """
+        return list(islice(self.iter_closest_pairs(), num_pairs))
+
+    def iter_closest_pairs(self):
+        """
+        Yields every pair in order of Elo gap, smallest first, as (lower_index, higher_index) tuples. The index
+        must not change while the pairs are being read.
+
+        Every pair of positions (p, q) has a gap at least as large as each neighbour gap between them, so the
+        neighbour gaps are taken in sorted order and each one opens a run (p, p + 2), (p, p + 3), ... on a heap.
+        Reading the first k pairs costs O(k log n) and never looks at pairs that cannot be among them.
+        """
+        heap = []  # Entries of (gap, lower_index, higher_index, left_position, right_position)
+        next_gap = 0
+
+        while True:
+            stream_entry = self.gaps[next_gap] if next_gap < len(self.gaps) else None
+            if heap and (stream_entry is None or heap[0][:3] < stream_entry):
+                # The next pair extends a run that has already been opened
+                gap, lower_index, higher_index, left_position, right_position = heapq.heappop(heap)
+            elif stream_entry is not None:
+                # The next pair is a pair of neighbours, which opens a new run from its left position
+                gap, lower_index, higher_index = stream_entry
+                next_gap += 1
+                left_position = min(self._position(lower_index), self._position(higher_index))
+                right_position = left_position + 1
+            else:
+                return  # Every pair has been returned
+
+            yield (lower_index, higher_index)
+
+            # Queue the next pair in this run, one position further to the right
+            if right_position + 1 < len(self.keys):
+                left_key, right_key = self.keys[left_position], self.keys[right_position + 1]
+                heapq.heappush(heap, self._gap(left_key, right_key) + (left_position, right_position + 1))
@@ -1,5 +1,5 @@
 from user_variables import *
-import pandas as pd
+import numpy as np
 
 #########################################################################################################
 # Elo Calculation Functions
@@ -13,16 +13,166 @@ def expected_score(rating_1, rating_2):
     exp_score_2 = 1 / (1 + 10 ** ((rating_1 - rating_2) / 400))
     return exp_score_1, exp_score_2
 
+def expected_score_block(row_elos, column_elos, out=None, dtype=EXPECTED_SCORE_DTYPE):
+    """
+    Calculate the expected score of every row item against every column item in one NumPy broadcast.
+    Uses 10 ** x = exp(x * ln(10)) and in-place operations so no temporary arrays are created.
+    
+    :param row_elos: Elo scores of the items forming the rows of the block.
+    :param column_elos: Elo scores of the items forming the columns of the block.
+    :param out: Optional preallocated (len(row_elos), len(column_elos)) array to write the block into.
+    :param dtype: Data type of the block if out is not given.
+    :return: The block of expected scores.
+    """
+    row_elos = np.asarray(row_elos, dtype=np.float64)
+    column_elos = np.asarray(column_elos, dtype=np.float64)
+    if out is None:
+        out = np.empty((len(row_elos), len(column_elos)), dtype=dtype)
+
+    with np.errstate(over='ignore'):  # Very large Elo gaps overflow to inf, which correctly gives an expected score of 0
+        np.subtract(column_elos[np.newaxis, :], row_elos[:, np.newaxis], out=out)
+        np.multiply(out, np.log(10) / 400, out=out)
+        np.exp(out, out=out)
+        np.add(out, 1, out=out)
+        np.reciprocal(out, out=out)
+    return out
+
+def build_expected_score_matrix(elo_scores, dtype=EXPECTED_SCORE_DTYPE, block_size=EXPECTED_SCORE_BLOCK_SIZE):
+    """
+    Build the full expected score matrix from a vector of Elo scores, block_size rows at a time.
+    Entry [i, j] is the expected score of item i against item j and the diagonal is left at 0.
+    
+    :param elo_scores: Elo scores of all items, in DataFrame row order.
+    :param dtype: Data type of the matrix ('float64' or 'float32').
+    :param block_size: Number of rows calculated per block, which bounds the working set of each step.
+    :return: The (n, n) expected score matrix.
+    """
+    elo_scores = np.asarray(elo_scores, dtype=np.float64)
+    num_items = len(elo_scores)
+    expected_score_matrix = np.empty((num_items, num_items), dtype=dtype)
+
+    for start in range(0, num_items, block_size):
+        stop = min(start + block_size, num_items)
+        expected_score_block(elo_scores[start:stop], elo_scores, out=expected_score_matrix[start:stop])
+
+    np.fill_diagonal(expected_score_matrix, 0)  # An item is never compared against itself
+    return expected_score_matrix
+
 def update_individual_elo(old_rating, expected_score, actual_score, k_factor=K_FACTOR):
     """
     Update Elo score based on the expected score and actual result.
     """
     return old_rating + k_factor * (actual_score - expected_score)
 
-def calculate_rank_and_elo_changes(df, previous_df):
+def apply_sequential_results(elo_scores, item_1_indices, item_2_indices, item_1_scores, k_factor=K_FACTOR, elo_changes=None):
+    """
+    Applies a sequence of results one at a time, in order, with the same Elo rules as update_score:
+    each result is scored against the ratings left by the results before it.
+    
+    :param elo_scores: Elo scores of all items, updated in place.
+    :param item_1_indices: Row positions of the first item in each result.
+    :param item_2_indices: Row positions of the second item in each result.
+    :param item_1_scores: Actual score of the first item in each result (1, 0.5 or 0); the second item scores 1 minus this.
+    :param k_factor: The K-factor to control the magnitude of Elo change.
+    :param elo_changes: Optional array of each item's latest Elo change, updated in place.
+    :return: The updated Elo scores.
+    """
+    # Plain Python lists are much faster than NumPy arrays for one element at a time
+    elos = elo_scores.tolist()
+    changes = elo_changes.tolist() if elo_changes is not None else None
+    for item_1_index, item_2_index, item_1_score in zip(np.asarray(item_1_indices).tolist(), np.asarray(item_2_indices).tolist(), np.asarray(item_1_scores).tolist()):
+        item_1_elo = elos[item_1_index]
+        item_2_elo = elos[item_2_index]
+        expected_item_1_score = 1 / (1 + 10 ** ((item_2_elo - item_1_elo) / 400))
+        elos[item_1_index] = update_individual_elo(item_1_elo, expected_item_1_score, item_1_score, k_factor)
+        elos[item_2_index] = update_individual_elo(item_2_elo, 1 - expected_item_1_score, 1 - item_1_score, k_factor)
+        if changes is not None:
+            changes[item_1_index] = elos[item_1_index] - item_1_elo
+            changes[item_2_index] = elos[item_2_index] - item_2_elo
+
+    elo_scores[:] = elos
+    if changes is not None:
+        elo_changes[:] = changes
+    return elo_scores
+
+def apply_rating_period(elo_scores, item_1_indices, item_2_indices, item_1_scores, k_factor=K_FACTOR, elo_changes=None):
+    """
+    Applies a batch of results with rating period semantics: every result is scored against the ratings at the
+    start of the period, the Elo deltas of each item are summed, and all ratings are updated at once.
+    The order of results within the period makes no difference.
+    
+    :param elo_scores: Elo scores of all items, updated in place.
+    :param item_1_indices: Row positions of the first item in each result.
+    :param item_2_indices: Row positions of the second item in each result.
+    :param item_1_scores: Actual score of the first item in each result (1, 0.5 or 0); the second item scores 1 minus this.
+    :param k_factor: The K-factor to control the magnitude of Elo change.
+    :param elo_changes: Optional array of each item's latest Elo change, set to its total change over the period.
+    :return: The updated Elo scores.
+    """
+    item_1_indices = np.asarray(item_1_indices, dtype=np.int64)
+    item_2_indices = np.asarray(item_2_indices, dtype=np.int64)
+    item_1_scores = np.asarray(item_1_scores, dtype=np.float64)
+
+    # Score every result against the ratings at the start of the period
+    expected_item_1_scores = 1 / (1 + 10 ** ((elo_scores[item_2_indices] - elo_scores[item_1_indices]) / 400))
+    item_1_deltas = update_individual_elo(0, expected_item_1_scores, item_1_scores, k_factor)
+
+    # Accumulate the deltas of every item; the second item always gains what the first item loses
+    deltas = np.zeros(len(elo_scores))
+    np.add.at(deltas, item_1_indices, item_1_deltas)
+    np.add.at(deltas, item_2_indices, -item_1_deltas)
+    elo_scores += deltas
+
+    if elo_changes is not None:
+        compared = np.union1d(item_1_indices, item_2_indices)
+        elo_changes[compared] = deltas[compared]
+    return elo_scores
+
+RATING_SEMANTICS = {
+    'sequential': apply_sequential_results,
+    'period': apply_rating_period,
+}
+
+def apply_results_to_state(state_manager, item_1_indices, item_2_indices, item_1_scores, semantics='sequential', refresh=True):
+    """
+    Applies a batch of results to the StateManager's rating store and comparison counts, then updates the
+    expected scores and sorted Elo index of every compared item in one step.
+    
+    :param semantics: 'sequential' applies results one at a time in order, like repeated popup comparisons;
+                      'period' scores them all against the ratings at the start of the batch.
+    :param refresh: Set to False to leave the expected scores for the caller to refresh later.
+    :return: The row positions of the compared items.
+    """
+    if semantics not in RATING_SEMANTICS:
+        raise ValueError(f"Unknown rating semantics '{semantics}', expected one of {list(RATING_SEMANTICS)}.")
+    ratings = state_manager.ratings
+    RATING_SEMANTICS[semantics](ratings.elo, item_1_indices, item_2_indices, item_1_scores, state_manager.k_factor, ratings.elo_change)
+    np.add.at(ratings.comparisons, item_1_indices, 1)
+    np.add.at(ratings.comparisons, item_2_indices, 1)
+    state_manager.pair_outcomes.record_many(item_1_indices, item_2_indices, item_1_scores)
+
+    compared = np.union1d(item_1_indices, item_2_indices)
+    if refresh:
+        state_manager.refresh_items(compared)
+    return compared
+
+def calculate_rank_and_elo_changes(df, previous_df=None, ratings=None, leaderboard=None):
     """
     Compares the current and previous rankings to compute rank and Elo changes for each item.
+    If the in-session rating store is given, the current Elo scores and comparison counts are taken from it.
+    If a Leaderboard started at the beginning of the session is given, the changes are read from it in one
+    pass over the sorted Elo index, and previous_df is not needed.
     """
+    if ratings is not None:
+        df = ratings.to_dataframe(df)
+
+    if leaderboard is not None:
+        rank_changes, elo_changes = leaderboard.changes()
+        df = df.drop(columns=[RANK_CHANGE_COLUMN, ELO_CHANGE_COLUMN], errors='ignore')
+        df[RANK_CHANGE_COLUMN] = rank_changes
+        df[ELO_CHANGE_COLUMN] = elo_changes
+        return df
+
     # Initialise the new columns if required
     if previous_df is None:
         df[RANK_CHANGE_COLUMN] = '='
@@ -37,6 +187,8 @@ def calculate_rank_and_elo_changes(df, previous_df):
     current_ranks = df[[NAME_COLUMN, ELO_COLUMN]].sort_values(by=ELO_COLUMN, ascending=False)
     current_ranks[RANK_COLUMN] = range(1, len(current_ranks) + 1)
 
+    import pandas as pd  # Only this slow path needs pandas itself, so importing elo_scores stays quick
+
     # Merges the two dataframes together by the names, adding new '_current' and '_previous' suffixes to the duplicated RANK_COLUMN and ELO_COLUMN columns
     merged_ranks = pd.merge(current_ranks, previous_ranks[[NAME_COLUMN, RANK_COLUMN, ELO_COLUMN]], on=NAME_COLUMN, suffixes=('_current', '_previous'))
 
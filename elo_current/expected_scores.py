@@ -0,0 +1,262 @@
+import os
+import numpy as np
+from user_variables import *
+from elo_scores import expected_score_block, build_expected_score_matrix
+
+#########################################################################################################
+# Expected score backends
+#########################################################################################################
+# Both backends answer the same questions (a single cell, a row or a block of expected scores) so the
+# comparison loop does not need to know whether the n x n matrix is actually stored.
+
+def _as_indices(selection, num_items):
+    """
+    Converts a slice, list or array of item indices into an integer index array.
+    """
+    return np.arange(num_items)[selection]
+
+class DenseExpectedScores:
+    """
+    Stores the full n x n expected score matrix, where entry [i, j] is the expected score of item i against item j.
+    Lookups are a single array read but memory grows quadratically with the number of items.
+    """
+    stores_matrix = True
+
+    def __init__(self, matrix):
+        """
+        :param matrix: The (n, n) expected score matrix to wrap.
+        """
+        self.matrix = matrix
+
+    @classmethod
+    def from_elo(cls, elo_scores):
+        """
+        Builds the matrix from a vector of Elo scores.
+        """
+        return cls(build_expected_score_matrix(elo_scores))
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def score(self, item_1_index, item_2_index):
+        """
+        Returns the expected score of item_1 against item_2.
+        """
+        return float(self.matrix[item_1_index, item_2_index])
+
+    def row(self, item_index):
+        """
+        Returns the expected scores of one item against every item.
+        """
+        return self.matrix[item_index]
+
+    def block(self, rows, columns):
+        """
+        Returns the expected scores of the selected row items against the selected column items.
+
+        :param rows: Slice or array of row item indices.
+        :param columns: Slice or array of column item indices.
+        """
+        if isinstance(rows, slice) and isinstance(columns, slice):
+            return self.matrix[rows, columns]
+        return self.matrix[np.ix_(_as_indices(rows, len(self)), _as_indices(columns, len(self)))]
+
+    def update_items(self, item_indices, elo_scores, columns=None):
+        """
+        Recalculates the rows and columns of the given items after their Elo scores have changed.
+
+        :param item_indices: Indices of the items whose Elo scores changed.
+        :param elo_scores: Current Elo scores of all items.
+        :param columns: Optional indices of the only items to recalculate the expected scores against, such as
+                        the items still in play in top-K focus mode. Must include the changed items.
+        """
+        elo_scores = np.asarray(elo_scores, dtype=np.float64)
+        item_indices = np.asarray(list(item_indices), dtype=np.int64)
+        columns = None if columns is None else np.asarray(columns, dtype=np.int64)
+
+        # Recalculate the rows of all changed items together, a block of items at a time
+        for start in range(0, len(item_indices), EXPECTED_SCORE_BLOCK_SIZE):
+            block_indices = item_indices[start:start + EXPECTED_SCORE_BLOCK_SIZE]
+            if columns is None:
+                item_rows = expected_score_block(elo_scores[block_indices], elo_scores, dtype=self.matrix.dtype)
+                self.matrix[block_indices, :] = item_rows
+                self.matrix[:, block_indices] = 1 - item_rows.T  # The expected score is reciprocal
+            else:
+                item_rows = expected_score_block(elo_scores[block_indices], elo_scores[columns], dtype=self.matrix.dtype)
+                self.matrix[block_indices[:, np.newaxis], columns] = item_rows
+                self.matrix[columns[:, np.newaxis], block_indices] = 1 - item_rows.T
+            self.matrix[block_indices, block_indices] = 0
+
+    def add_items(self, elo_scores):
+        """
+        Grows the matrix to include items appended to the end of the Elo scores.
+
+        :param elo_scores: Elo scores of all items, including the new ones at the end.
+        """
+        num_old_items = len(self.matrix)
+        num_items = len(elo_scores)
+        matrix = np.zeros((num_items, num_items), dtype=self.matrix.dtype)
+        matrix[:num_old_items, :num_old_items] = self.matrix
+        self.matrix = matrix
+        self.update_items(range(num_old_items, num_items), elo_scores)
+
+    def to_array(self):
+        """
+        Returns the stored matrix.
+        """
+        return self.matrix
+
+    @classmethod
+    def load(cls, file_path, mmap_mode=EXPECTED_SCORE_MMAP_MODE):
+        """
+        Loads the matrix from a binary .npy file, memory-mapped so rows are only read from disk when used,
+        or from a legacy CSV file.
+
+        :param file_path: Path of the .npy or .csv matrix file.
+        :param mmap_mode: NumPy memory-map mode for .npy files ('c' keeps in-session changes in memory only, None reads the whole file).
+        """
+        if file_path.endswith('.npy'):
+            return cls(np.load(file_path, mmap_mode=mmap_mode))
+        return cls(np.loadtxt(file_path, delimiter=','))
+
+    def save(self, file_path, order=None, block_size=EXPECTED_SCORE_BLOCK_SIZE):
+        """
+        Save the expected score matrix to a binary .npy file, or a CSV file if the path ends in .csv.
+        The .npy file is written block by block to a temporary file which then replaces the old one, so a
+        memory-mapped copy of the old file stays valid until the new one is complete.
+
+        :param file_path: Path of the matrix file.
+        :param order: Optional row positions giving the order of the items in the saved rankings, so the
+                      saved matrix rows line up with the saved CSV rows.
+        :param block_size: Number of rows copied at once when writing the .npy file.
+        """
+        matrix = self.matrix
+        if not file_path.endswith('.npy'):
+            np.savetxt(file_path, matrix if order is None else matrix[np.ix_(order, order)], delimiter=',')
+            return
+
+        temp_path = file_path + '.tmp'
+        saved_matrix = np.lib.format.open_memmap(temp_path, mode='w+', dtype=matrix.dtype, shape=matrix.shape)
+        for start in range(0, len(matrix), block_size):
+            stop = min(start + block_size, len(matrix))
+            if order is None:
+                saved_matrix[start:stop] = matrix[start:stop]
+            else:
+                saved_matrix[start:stop] = matrix[order[start:stop]][:, order]
+        saved_matrix.flush()
+        del saved_matrix, matrix  # Drop the local alias too, so self.matrix is the only reference to a memory-mapped old file
+
+        try:
+            os.replace(temp_path, file_path)
+        except PermissionError:
+            # Windows cannot replace a file that is still memory-mapped, so read the old matrix into memory first
+            self.matrix = np.array(self.matrix)
+            os.replace(temp_path, file_path)
+
+class ImplicitExpectedScores:
+    """
+    Keeps only the vector of Elo scores and calculates expected scores on demand.
+    Memory grows linearly with the number of items, at the cost of recalculating each lookup.
+    """
+    stores_matrix = False
+
+    def __init__(self, elo_scores, dtype=EXPECTED_SCORE_DTYPE):
+        """
+        :param elo_scores: Elo scores of all items, in DataFrame row order.
+        :param dtype: Data type of the rows and blocks returned.
+        """
+        self.elo_scores = np.array(elo_scores, dtype=np.float64)
+        self.dtype = dtype
+
+    @classmethod
+    def from_elo(cls, elo_scores):
+        """
+        Builds the backend from a vector of Elo scores.
+        """
+        return cls(elo_scores)
+
+    def __len__(self):
+        return len(self.elo_scores)
+
+    def score(self, item_1_index, item_2_index):
+        """
+        Returns the expected score of item_1 against item_2.
+        """
+        if item_1_index == item_2_index:
+            return 0.0
+        return 1 / (1 + 10 ** ((self.elo_scores[item_2_index] - self.elo_scores[item_1_index]) / 400))
+
+    def row(self, item_index):
+        """
+        Returns the expected scores of one item against every item.
+        """
+        item_row = expected_score_block(self.elo_scores[[item_index]], self.elo_scores, dtype=self.dtype)[0]
+        item_row[item_index] = 0
+        return item_row
+
+    def block(self, rows, columns):
+        """
+        Returns the expected scores of the selected row items against the selected column items.
+
+        :param rows: Slice or array of row item indices.
+        :param columns: Slice or array of column item indices.
+        """
+        row_indices = _as_indices(rows, len(self))
+        column_indices = _as_indices(columns, len(self))
+        block = expected_score_block(self.elo_scores[row_indices], self.elo_scores[column_indices], dtype=self.dtype)
+        block[row_indices[:, np.newaxis] == column_indices[np.newaxis, :]] = 0  # Match the zero diagonal of the dense matrix
+        return block
+
+    def update_items(self, item_indices, elo_scores, columns=None):
+        """
+        Copies the new Elo scores of the given items; nothing else needs recalculating.
+
+        :param item_indices: Indices of the items whose Elo scores changed.
+        :param elo_scores: Current Elo scores of all items.
+        :param columns: Ignored, since expected scores against every item are always calculated on demand.
+        """
+        item_indices = list(item_indices)
+        self.elo_scores[item_indices] = np.asarray(elo_scores, dtype=np.float64)[item_indices]
+
+    def add_items(self, elo_scores):
+        """
+        Extends the stored Elo scores with items appended to the end.
+
+        :param elo_scores: Elo scores of all items, including the new ones at the end.
+        """
+        self.elo_scores = np.array(elo_scores, dtype=np.float64)
+
+    def to_array(self):
+        """
+        Builds and returns the full matrix. Only use this for small catalogues.
+        """
+        return build_expected_score_matrix(self.elo_scores, dtype=self.dtype)
+
+    def save(self, file_path, order=None):
+        """
+        Nothing is saved because the expected scores are recalculated from the saved Elo scores.
+        """
+        pass
+
+def expected_scores_match_elo(expected_scores, elo_scores, num_samples=64, tolerance=1e-4, seed=0):
+    """
+    Spot-checks a sample of off-diagonal cells against the Elo formula, to catch a saved matrix whose rows
+    do not line up with the loaded items. Only num_samples cells are read, so memory-mapped files stay cheap.
+    """
+    num_items = len(elo_scores)
+    if len(expected_scores) != num_items:
+        return False
+    if num_items < 2:
+        return True
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, num_items, num_samples)
+    columns = (rows + rng.integers(1, num_items, num_samples)) % num_items  # Never on the diagonal
+    elo_scores = np.asarray(elo_scores, dtype=np.float64)
+    expected = 1 / (1 + 10 ** ((elo_scores[columns] - elo_scores[rows]) / 400))
+    stored = np.array([expected_scores.score(row, column) for row, column in zip(rows, columns)])
+    return bool(np.abs(stored - expected).max() <= tolerance)
+
+EXPECTED_SCORE_BACKENDS = {
+    'dense': DenseExpectedScores,
+    'implicit': ImplicitExpectedScores,
+}
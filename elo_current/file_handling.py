@@ -2,10 +2,22 @@
 # Input
 #########################################################################################################
 import os
+import json
+import time
+import zipfile
 import pandas as pd
 import numpy as np
 from user_variables import *
-from elo_scores import expected_score
+from rating_store import RatingStore
+from expected_scores import expected_scores_match_elo
+from comparison_journal import ComparisonJournal, replay_journal, JOURNAL_FILE
+from pair_outcomes import PairOutcomeStore, PAIR_OUTCOMES_FILE
+from startup_timing import mark_startup
+
+EXPECTED_MATRIX_FILE = 'expected_score_matrix.npy'
+LEGACY_EXPECTED_MATRIX_FILE = 'expected_score_matrix.csv'
+MANIFEST_FILE = 'manifest.json'
+SNAPSHOT_ARCHIVE_FILE = 'film_scores_archive.zip'
 
 def scale_initial_rating(rating, min_rating, max_rating, min_elo=1000, max_elo=2000):
     return min_elo + (rating - min_rating) * (max_elo - min_elo) / (max_rating - min_rating)
@@ -42,66 +54,290 @@ def initialise_dataframe(file_name):
     print(f"DataFrame initialised with {len(df)} entries and columns: {list(df.columns)}")
     return df
 
-def initialise_or_load_expected_score_matrix(df, directory, state_manager):
+def migrate_expected_score_matrix(csv_file, npy_file):
+    """
+    One-time conversion of a text expected score matrix into the binary .npy format.
+    The CSV file is left in place and can be deleted once the .npy file has been checked.
+    """
+    print(f"Migrating expected score matrix from {csv_file} to {npy_file}...")
+    start = time.perf_counter()
+    matrix = np.loadtxt(csv_file, delimiter=',', ndmin=2)
+    loaded = time.perf_counter()
+    np.save(npy_file, matrix)
+    print(f"Migrated expected score matrix in {time.perf_counter() - start:.2f}s (text load {loaded - start:.2f}s).")
+
+def initialise_or_load_expected_score_matrix(df, directory, state_manager, matrix_file_name=EXPECTED_MATRIX_FILE):
     """
     Load the expected score matrix from the previous run if it exists; otherwise, create a new one based on Elo scores.
+    A matrix saved as CSV by older versions is migrated to the binary .npy format the first time it is found.
     """
-    expected_matrix_file = os.path.join(directory, 'expected_score_matrix.csv')
+    expected_matrix_file = os.path.join(directory, matrix_file_name)
+    legacy_matrix_file = os.path.join(directory, LEGACY_EXPECTED_MATRIX_FILE)
+    if state_manager.expected_score_backend == 'implicit':
+        # Nothing to load: expected scores are calculated on demand from the Elo scores
+        print("Using implicit expected scores calculated on demand from Elo scores.")
+        calculate_expected_scores_from_elo(df, state_manager)
+        return
+
+    if not os.path.exists(expected_matrix_file) and os.path.exists(legacy_matrix_file):
+        migrate_expected_score_matrix(legacy_matrix_file, expected_matrix_file)
+
     if os.path.exists(expected_matrix_file):
         print("Loading expected score matrix from previous run.")
+        start = time.perf_counter()
         state_manager.load_expected_score_matrix(expected_matrix_file)
+        print(f"Loaded expected score matrix ({len(state_manager.expected_scores)} items) in {time.perf_counter() - start:.2f}s.")
+        if not expected_scores_match_elo(state_manager.expected_scores, df[ELO_COLUMN].to_numpy()):
+            # Failsafe: The saved matrix does not match the items, so rebuild it from the Elo scores
+            print(f"Expected score matrix does not match the Elo scores of the {len(df)} loaded items. Recalculating from Elo scores.")
+            calculate_expected_scores_from_elo(df, state_manager)
     else:
         # Failsafe: Create a new expected score matrix if it doesn't exist
         print(f"Expected score matrix not found. Creating a new one based on Elo scores.")
         calculate_expected_scores_from_elo(df, state_manager)
 
+def load_pair_outcomes(directory, state_manager, num_items, snapshot_file, outcomes_file_name=None):
+    """
+    Loads the win, loss and draw counts saved with a snapshot, if there are any.
+
+    :param outcomes_file_name: File named in the manifest for the snapshot. Without a manifest the snapshot's own
+                               pair_outcomes_N.npz is used, or the single file written by older versions.
+    """
+    if outcomes_file_name is None:
+        outcomes_file_name = pair_outcomes_file_name(snapshot_file)
+        if not os.path.exists(os.path.join(directory, outcomes_file_name)):
+            outcomes_file_name = PAIR_OUTCOMES_FILE
+    outcomes_file = os.path.join(directory, outcomes_file_name)
+    if not os.path.exists(outcomes_file):
+        return
+    pair_outcomes = PairOutcomeStore.load(outcomes_file, num_items, snapshot_file)
+    if pair_outcomes is None:
+        # Failsafe: The saved counts were written with a different snapshot, so their pairs refer to other rows. Start counting again
+        print(f"Pair outcomes in {outcomes_file_name} were not saved with {snapshot_file}. Starting with no pair outcomes.")
+        return
+    state_manager.pair_outcomes = pair_outcomes
+    print(f"Loaded outcomes of {len(pair_outcomes)} compared pairs.")
+
 def calculate_expected_scores_from_elo(df, state_manager):
     """
-    Calculate the expected score matrix based on current Elo scores and store it in state_manager.
+    Calculate the expected scores based on current Elo scores and store them in state_manager using its configured backend.
+    """
+    state_manager.set_expected_scores_from_elo(df[ELO_COLUMN].to_numpy())
+
+def initialise_item_state(df, state_manager):
+    """
+    Builds the in-session item state in the StateManager from a DataFrame indexed by row position:
+    the name index (rejecting duplicate names), the rating store and the sorted Elo index.
+    """
+    # Map each item name to its row position, rejecting duplicate names before any comparisons are made
+    state_manager.build_name_index(df[NAME_COLUMN])
+
+    # Copy the Elo scores and comparison counts into arrays that are updated during the session
+    state_manager.ratings = RatingStore.from_dataframe(df)
+
+    # Sort the items by Elo score for closest pair selection
+    state_manager.build_elo_index(state_manager.ratings.elo)
+
+def add_items(df, names, state_manager, initial_df=None):
+    """
+    Appends new items and extends the name index, expected scores and sorted Elo index in the StateManager to include them.
+    
+    :param df: DataFrame containing the item data, indexed by row position.
+    :param names: Names of the new items.
+    :param state_manager: Instance of StateManager holding the indices to extend.
+    :param initial_df: Optional DataFrame from initialise_dataframe holding the new items. Their rows are taken from it,
+                       with the Elo scores scaled from the Rating column and the KEEP_COLUMNS, as if the rankings had
+                       started with them. Without it the new items get the standard Elo score and no comparisons.
+    :return: The DataFrame with the new items appended.
+    """
+    new_positions = state_manager.add_item_names(names)  # Rejects duplicate names before anything is changed
+    if initial_df is not None:
+        new_rows = initial_df.set_index(NAME_COLUMN, drop=False).loc[list(names)].reset_index(drop=True)
+    else:
+        new_rows = pd.DataFrame({NAME_COLUMN: list(names), ELO_COLUMN: STANDARD_ELO, COMPARISONS_COLUMN: 0})
+    df = pd.concat([df, new_rows], ignore_index=True)
+    new_elo = new_rows[ELO_COLUMN].to_numpy(dtype=np.float64)
+
+    if state_manager.ratings is not None:
+        state_manager.ratings.add_items(len(new_positions), new_elo, new_rows[COMPARISONS_COLUMN].to_numpy())
+    if state_manager.expected_scores is not None:
+        state_manager.expected_scores.add_items(df[ELO_COLUMN].to_numpy())
+    if state_manager.elo_index is not None:
+        for position, elo in zip(new_positions, new_elo.tolist()):
+            state_manager.elo_index.insert(position, elo)
+
+    if initial_df is not None:
+        print(f"Added {len(new_positions)} new items from the initial CSV.")
+    else:
+        print(f"Added {len(new_positions)} new items with the standard Elo score of {STANDARD_ELO}.")
+    return df
+
+def read_manifest(directory):
+    """
+    Reads the manifest naming the latest snapshot, or returns None if there is no readable manifest.
+    """
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    try:
+        with open(manifest_path, encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+def write_manifest(directory, manifest):
+    """
+    Writes the manifest to a temporary file and swaps it into place, so a crash never leaves a half-written manifest.
+    """
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+        manifest_file.flush()
+        os.fsync(manifest_file.fileno())
+    os.replace(temp_path, manifest_path)
+
+def list_snapshot_files(directory):
+    """
+    Lists the film_scores_N.csv snapshots in a directory, oldest first. Only used when there is no manifest yet.
     """
-    num_films = len(df)
-    state_manager.expected_score_matrix = np.zeros((num_films, num_films))
-    for i, film_1_elo in df[ELO_COLUMN].items():
-        for j, film_2_elo in df[ELO_COLUMN].items():
-            if i != j:
-                expected_film_1_vs_film_2, _ = expected_score(film_1_elo, film_2_elo)
-                state_manager.expected_score_matrix[i, j] = expected_film_1_vs_film_2
-                state_manager.expected_score_matrix[j, i] = 1 - expected_film_1_vs_film_2
+    snapshots = [f for f in os.listdir(directory) if f.startswith('film_scores_') and f.endswith('.csv') and f[12:-4].isdigit()]
+    return sorted(snapshots, key=lambda f: int(f[12:-4]))
+
+def pair_outcomes_file_name(snapshot_file):
+    """
+    Returns the name of the pair outcomes file saved with a film_scores_N.csv snapshot.
+    """
+    return f'pair_outcomes_{snapshot_file[12:-4]}.npz'
+
+def apply_snapshot_retention(directory, snapshots, retention=SNAPSHOT_RETENTION, mode=SNAPSHOT_RETENTION_MODE):
+    """
+    Keeps the newest 'retention' snapshots in the directory, with their pair outcomes. Older ones are deleted, or
+    with mode 'archive' they are compacted into a single zip file first.
+
+    :param snapshots: Snapshot file names recorded in the manifest, oldest first.
+    :return: The snapshot file names still in the directory.
+    """
+    if retention is None or len(snapshots) <= retention:
+        return snapshots
+    expired, kept = snapshots[:-retention], snapshots[-retention:]
+    expired_files = [file_name for snapshot in expired for file_name in (snapshot, pair_outcomes_file_name(snapshot))]
+
+    if mode == 'archive':
+        with zipfile.ZipFile(os.path.join(directory, SNAPSHOT_ARCHIVE_FILE), 'a', compression=zipfile.ZIP_DEFLATED) as archive:
+            archived = set(archive.namelist())
+            for file_name in expired_files:
+                if file_name not in archived and os.path.exists(os.path.join(directory, file_name)):
+                    archive.write(os.path.join(directory, file_name), arcname=file_name)
+    for file_name in expired_files:
+        if os.path.exists(os.path.join(directory, file_name)):
+            os.remove(os.path.join(directory, file_name))
+
+    print(f"{'Archived' if mode == 'archive' else 'Deleted'} {len(expired)} old snapshots, keeping the latest {retention}.")
+    return kept
 
 def load_or_initialise_data(directory, state_manager, initial_csv_file):
     """
     Load the latest CSV with film scores or initialize a new DataFrame.
     """
     print("Loading latest CSV file...")
-    csv_files = [f for f in os.listdir(directory) if f.startswith('film_scores_') and f.endswith('.csv')]
-    if csv_files:
-        comparison_counts = [int(f.split('_')[2].split('.')[0]) for f in csv_files]
-        latest_file = f'film_scores_{max(comparison_counts)}.csv'
-        state_manager.comparison_count = max(comparison_counts)
+    # The manifest names the latest snapshot directly; only list the directory if there is no usable manifest
+    manifest = read_manifest(directory)
+    if manifest is not None and os.path.exists(os.path.join(directory, manifest['latest_snapshot'])):
+        latest_file = manifest['latest_snapshot']
+        state_manager.comparison_count = manifest['comparison_count']
+    else:
+        manifest = None
+        csv_files = list_snapshot_files(directory) if os.path.isdir(directory) else []
+        latest_file = csv_files[-1] if csv_files else None
+        if latest_file:
+            state_manager.comparison_count = int(latest_file[12:-4])
+
+    if latest_file:
         df = pd.read_csv(os.path.join(directory, latest_file))
         print(f"Loaded {latest_file}.")
     else:
         print(f"No existing CSV files found. Initialising a new DataFrame from {initial_csv_file}.")
         df = initialise_dataframe(initial_csv_file)
+
+    # Use row positions as the index so they match the name index and the expected score matrix
+    df = df.reset_index(drop=True)
+
+    # Build the name index, rating store and sorted Elo index used during comparisons
+    initialise_item_state(df, state_manager)
+    mark_startup(state_manager, 'data load')
     
     # Initialise or load the expected score matrix
-    initialise_or_load_expected_score_matrix(df, directory, state_manager)
+    matrix_file_name = (manifest or {}).get('expected_score_matrix') or EXPECTED_MATRIX_FILE
+    initialise_or_load_expected_score_matrix(df, directory, state_manager, matrix_file_name)
+    mark_startup(state_manager, 'matrix load')
+
+    # Load the pair outcomes saved with the snapshot, whose pairs refer to its rows
+    if latest_file:
+        load_pair_outcomes(directory, state_manager, len(df), latest_file, (manifest or {}).get('pair_outcomes'))
+
+    # Pick up any items added to the initial CSV since the latest save, if ADD_NEW_ITEMS is switched on
+    if ADD_NEW_ITEMS and latest_file and os.path.exists(initial_csv_file):
+        initial_df = initialise_dataframe(initial_csv_file)
+        new_names = [name for name in initial_df[NAME_COLUMN] if name not in state_manager.name_index]
+        if new_names:
+            df = add_items(df, new_names, state_manager, initial_df)
+
+    # Recover any comparisons made after the latest save (for example before a crash) and keep journalling this session
+    journal_file = os.path.join(directory, JOURNAL_FILE)
+    replay_journal(journal_file, state_manager, offset=(manifest or {}).get('journal_offset', 0))
+    state_manager.journal = ComparisonJournal(journal_file)
+    mark_startup(state_manager, 'pair outcomes, new items and journal replay')
     
     return df
 
 #########################################################################################################
 # Output
 #########################################################################################################
+def update_manifest(directory, state_manager, snapshot_file, matrix_file, outcomes_file=None):
+    """
+    Points the manifest at a newly saved snapshot, recording how far the journal had got so the next load
+    only replays the rows after it, and applies the snapshot retention policy.
+    """
+    manifest = read_manifest(directory)
+    snapshots = manifest['snapshots'] if manifest is not None else list_snapshot_files(directory)
+    snapshots = [f for f in snapshots if f != snapshot_file] + [snapshot_file]
+
+    # Flush the journal so its size covers every comparison in this snapshot
+    journal_path = os.path.join(directory, JOURNAL_FILE)
+    if state_manager.journal is not None:
+        state_manager.journal.sync()
+    journal_offset = os.path.getsize(journal_path) if os.path.exists(journal_path) else 0
+
+    write_manifest(directory, {
+        'latest_snapshot': snapshot_file,
+        'comparison_count': state_manager.comparison_count,
+        'expected_score_matrix': matrix_file,
+        'pair_outcomes': outcomes_file,
+        'journal_offset': journal_offset,
+        'snapshots': snapshots,
+    })
+
+    # Prune old snapshots only after the manifest points at the new one
+    kept = apply_snapshot_retention(directory, snapshots)
+    if kept != snapshots:
+        write_manifest(directory, {**read_manifest(directory), 'snapshots': kept})
+
 def save_to_csv(df, state_manager, directory):
     """
     Saves the film data to a CSV file, sorted by Elo score, and uses the comparison count from the StateManager.
-    Also saves the expected score matrix to a separate CSV file in the same directory.
+    Also saves the expected score matrix to a separate .npy file in the same directory, with its rows in the same order as the CSV.
     """
     # Ensure the directory exists
     os.makedirs(directory, exist_ok=True)
 
-    # Sort the DataFrame by Elo score
-    sorted_df = df.sort_values(by=ELO_COLUMN, ascending=False)
+    # Build the DataFrame from the in-session ratings, keeping the session-wide Elo changes calculate_rank_and_elo_changes added
+    if state_manager.ratings is not None:
+        df = state_manager.ratings.to_dataframe(df, include_elo_change=ELO_CHANGE_COLUMN not in df.columns)
+
+    # Order the DataFrame by Elo score, reading the order from the sorted Elo index (kept in step with the rating store) rather than sorting
+    if state_manager.ratings is not None and state_manager.elo_index is not None and len(state_manager.elo_index) == len(df):
+        sorted_df = df.take(state_manager.elo_index.ranking())
+    else:
+        sorted_df = df.sort_values(by=ELO_COLUMN, ascending=False)
     
     # Round the Elo scores and Elo change to 2 decimal places
     sorted_df[ELO_COLUMN] = sorted_df[ELO_COLUMN].round(2)
@@ -113,7 +349,7 @@ def save_to_csv(df, state_manager, directory):
     
     # Create the file name with the comparison count
     file_name = f'film_scores_{comparison_count}.csv'
-    matrix_file_name = 'expected_score_matrix.csv'  # Name for the matrix file
+    matrix_file_name = EXPECTED_MATRIX_FILE  # Name for the matrix file
     
     # Full path for saving the film data and the matrix
     full_path = os.path.join(directory, file_name)
@@ -122,12 +358,22 @@ def save_to_csv(df, state_manager, directory):
     # Save the sorted DataFrame to the specified directory
     sorted_df.to_csv(full_path, index=False)
     
-    # Save the expected score matrix as a CSV file
-    np.savetxt(matrix_full_path, state_manager.expected_score_matrix, delimiter=',')
+    # Save the expected score matrix in the same row order as the CSV (only the dense backend stores one)
+    start = time.perf_counter()
+    state_manager.save_expected_score_matrix(matrix_full_path, sorted_df.index.to_numpy())
+    matrix_save_time = time.perf_counter() - start
+
+    # Save the pair outcomes next to the snapshot, with their pairs renumbered to its rows
+    outcomes_file_name = pair_outcomes_file_name(file_name)
+    state_manager.pair_outcomes.save(os.path.join(directory, outcomes_file_name), sorted_df.index.to_numpy(), len(sorted_df), file_name)
+    
+    # Record the new snapshot in the manifest, so the next load does not need to list the directory
+    update_manifest(directory, state_manager, file_name, matrix_file_name if state_manager.expected_scores.stores_matrix else None, outcomes_file_name)
     
     # Increment the comparison count in the StateManager for the next save
     state_manager.comparison_count += 1
     
     # Print confirmation of saving
     print(f"Saved Elo rankings to {full_path}.")
-    print(f"Saved expected score matrix to {matrix_full_path}.")
+    if state_manager.expected_scores.stores_matrix:
+        print(f"Saved expected score matrix to {matrix_full_path} in {matrix_save_time:.2f}s.")
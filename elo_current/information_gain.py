@@ -0,0 +1,119 @@
+import numpy as np
+from user_variables import *
+
+#########################################################################################################
+# Information gain pair selection
+#########################################################################################################
+# Closest pair selection only looks at how close a pair's expected score is to 0.5, so it keeps comparing
+# well-settled neighbours. Here each candidate pair is scored by how much one more comparison is expected
+# to tell us about the gap between the two items:
+# - Closeness: a comparison between items with expected score p carries information p * (1 - p), which is
+#   largest for evenly matched pairs.
+# - Uncertainty: each item's rating has a variance that starts at ELO_PRIOR_SD ** 2 and shrinks with every
+#   comparison it has been in, so items with few comparisons are worth more.
+# - Recency: a pair judged recently is discounted, recovering half its value every PAIR_RECENCY_HALF_LIFE
+#   comparisons, so the same pair is not asked again and again.
+# The gain is 0.5 * log(1 + q^2 * p * (1 - p) * (var_1 + var_2)) with q = ln(10) / 400, the reduction in
+# entropy of the gap for a Gaussian rating approximation, times the recency discount. Candidates are each
+# item's INFORMATION_GAIN_WINDOW nearest Elo neighbours on either side, since the gain falls quickly with the
+# Elo gap, and every candidate is scored in one NumPy pass.
+
+PAIRING_STRATEGIES = ('closest', 'information_gain')
+ELO_SCALE = np.log(10) / 400
+
+def item_variances(comparisons, prior_sd=ELO_PRIOR_SD):
+    """
+    Approximates the variance of each item's rating from its number of comparisons, counting each
+    comparison as an evenly matched one (information q^2 / 4).
+    """
+    return 1 / (1 / prior_sd ** 2 + np.asarray(comparisons, dtype=np.float64) * ELO_SCALE ** 2 / 4)
+
+def candidate_pairs(elo_scores, window=INFORMATION_GAIN_WINDOW):
+    """
+    Returns each item paired with its window nearest neighbours above it in Elo order, as arrays of
+    lower and higher row positions, so every pair within window positions of each other appears once.
+    """
+    order = np.argsort(elo_scores, kind='stable')
+    firsts = [order[:-offset] for offset in range(1, min(window, len(order) - 1) + 1)]
+    seconds = [order[offset:] for offset in range(1, min(window, len(order) - 1) + 1)]
+    if not firsts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    firsts, seconds = np.concatenate(firsts), np.concatenate(seconds)
+    return np.minimum(firsts, seconds), np.maximum(firsts, seconds)
+
+def recency_discounts(lower, higher, recent_pairs, comparison_count, half_life=PAIR_RECENCY_HALF_LIFE):
+    """
+    Returns the recency discount of each candidate pair: 1 for pairs not judged recently, falling to 0 for
+    a pair judged in the latest comparison.
+
+    :param recent_pairs: (comparison_number, lower_index, higher_index) of recent comparisons, oldest first.
+    """
+    discounts = np.ones(len(lower))
+    if not recent_pairs or len(lower) == 0:
+        return discounts
+    history = np.array(recent_pairs, dtype=np.int64)
+    num_items = max(int(history[:, 1:].max()), int(higher.max())) + 1
+    # Keep only the latest comparison of each pair, reading the history newest first
+    history_codes, latest = np.unique(history[::-1, 1] * num_items + history[::-1, 2], return_index=True)
+    ages = comparison_count - history[::-1, 0][latest]
+
+    candidate_codes = lower.astype(np.int64) * num_items + higher
+    positions = np.minimum(np.searchsorted(history_codes, candidate_codes), len(history_codes) - 1)
+    judged = history_codes[positions] == candidate_codes
+    discounts[judged] = 1 - 0.5 ** (ages[positions[judged]] / half_life)
+    return discounts
+
+def pair_information_gains(elo_scores, comparisons, lower, higher, discounts=None, prior_sd=ELO_PRIOR_SD):
+    """
+    Returns the expected information gain of comparing each candidate pair.
+    """
+    expected = 1 / (1 + np.exp(ELO_SCALE * (elo_scores[higher] - elo_scores[lower])))
+    variances = item_variances(comparisons, prior_sd)
+    gains = 0.5 * np.log1p(ELO_SCALE ** 2 * expected * (1 - expected) * (variances[lower] + variances[higher]))
+    return gains if discounts is None else gains * discounts
+
+def information_gain_pairs(state_manager, batch_size=10, window=INFORMATION_GAIN_WINDOW, half_life=PAIR_RECENCY_HALF_LIFE,
+                           prior_sd=ELO_PRIOR_SD, item_indices=None):
+    """
+    Selects the batch_size pairs with the highest expected information gain, with no item in two pairs of
+    the batch (its uncertainty changes once it has been compared).
+
+    :param state_manager: Instance of StateManager, containing the rating store and the recent pairs.
+    :param item_indices: Optional sorted row positions of the only items to pair, such as the items still in play
+                         in top-K focus mode, so the candidates scale with them rather than the whole catalogue.
+    :return: List of (lower_index, higher_index) pairs, highest gain first.
+    """
+    ratings = state_manager.ratings
+    with state_manager.lock:
+        if item_indices is None:
+            lower, higher = candidate_pairs(ratings.elo, window)
+        else:
+            # Positions in the sorted item_indices keep their order, so lower stays below higher once mapped back
+            lower, higher = candidate_pairs(ratings.elo[item_indices], window)
+            lower, higher = item_indices[lower], item_indices[higher]
+        discounts = recency_discounts(lower, higher, state_manager.recent_pairs, state_manager.comparison_count, half_life)
+        gains = pair_information_gains(ratings.elo, ratings.comparisons, lower, higher, discounts, prior_sd)
+
+    # Sort only the best few candidates, and fall back to sorting them all if overlaps leave the batch short
+    num_sorted = min(len(gains), 8 * batch_size)
+    best = np.argpartition(-gains, num_sorted - 1)[:num_sorted] if 0 < num_sorted < len(gains) else np.arange(len(gains))
+    pairs = _disjoint_pairs(lower, higher, best[np.argsort(-gains[best], kind='stable')], batch_size)
+    if len(pairs) < batch_size and num_sorted < len(gains):
+        pairs = _disjoint_pairs(lower, higher, np.argsort(-gains, kind='stable'), batch_size)
+    return pairs
+
+def _disjoint_pairs(lower, higher, candidates, batch_size):
+    """
+    Takes pairs in the order of candidates, skipping any pair with an item already taken.
+    """
+    pairs = []
+    used_items = set()
+    for candidate in candidates:
+        item_1, item_2 = int(lower[candidate]), int(higher[candidate])
+        if item_1 in used_items or item_2 in used_items:
+            continue
+        pairs.append((item_1, item_2))
+        used_items.update((item_1, item_2))
+        if len(pairs) == batch_size:
+            break
+    return pairs
@@ -0,0 +1,119 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from user_variables import *
+from elo_scores import apply_results_to_state, calculate_rank_and_elo_changes
+from file_handling import load_or_initialise_data, add_items, save_to_csv
+from state_manager import StateManager
+from leaderboard import Leaderboard
+
+#########################################################################################################
+# Headless bulk results ingestion
+#########################################################################################################
+# Applies judgments collected outside the GUI (spreadsheets, form exports) without any popups. The results
+# file is streamed in chunks, each chunk is applied with the same Elo rules as update_score, and a single
+# snapshot is saved at the end.
+
+def map_names_to_indices(names, state_manager):
+    """
+    Maps a column of item names to row positions with the StateManager's name index (-1 for unknown names).
+    """
+    return names.map(state_manager.name_index).fillna(-1).to_numpy(dtype=np.int64)
+
+def prepare_chunk(chunk, df, state_manager, item_a_column, item_b_column, score_column, add_unknown):
+    """
+    Converts one chunk of results into row positions and scores, dropping rows that cannot be applied.
+
+    :return: The (possibly extended) DataFrame, the item_a and item_b positions, the item_a scores and the number of rows skipped.
+    """
+    if add_unknown:
+        known = state_manager.name_index
+        unknown = pd.unique(pd.concat([chunk[item_a_column], chunk[item_b_column]]).dropna())
+        new_names = [name for name in unknown if name not in known]
+        if new_names:
+            df = add_items(df, new_names, state_manager)
+
+    item_a_indices = map_names_to_indices(chunk[item_a_column], state_manager)
+    item_b_indices = map_names_to_indices(chunk[item_b_column], state_manager)
+    item_a_scores = pd.to_numeric(chunk[score_column], errors='coerce').to_numpy(dtype=np.float64)
+
+    # Skip unknown items, self-comparisons and scores outside 0 to 1
+    valid = (item_a_indices >= 0) & (item_b_indices >= 0) & (item_a_indices != item_b_indices) & (item_a_scores >= 0) & (item_a_scores <= 1)
+    return df, item_a_indices[valid], item_b_indices[valid], item_a_scores[valid], int((~valid).sum())
+
+def ingest_results(results_file, directory=DIRECTORY, initial_csv_file=INITIAL_CSV_FILE, item_a_column='item_a', item_b_column='item_b',
+                   score_column='score_a', chunksize=100_000, add_unknown=False, semantics='sequential'):
+    """
+    Streams a results file of (item_a, item_b, score_a) rows into the latest rankings and saves one new snapshot.
+
+    :param results_file: CSV file with one result per row; score_a is 1 if item_a won, 0.5 for a draw and 0 if item_b won.
+    :param directory: Directory holding the saved rankings, as in main.py.
+    :param initial_csv_file: Initial item file used when there are no saved rankings yet.
+    :param chunksize: Number of result rows read and applied at a time.
+    :param add_unknown: Add items that are not in the rankings yet, instead of skipping their results.
+    :param semantics: 'sequential' applies results one at a time in file order; 'period' treats each chunk as a
+                      rating period scored against the ratings at the start of the chunk.
+    :return: The updated DataFrame.
+    """
+    state_manager = StateManager()
+    df = load_or_initialise_data(directory, state_manager, initial_csv_file)
+    leaderboard = Leaderboard(state_manager)
+    ratings = state_manager.ratings
+
+    applied = 0
+    skipped = 0
+    apply_time = 0.0
+    touched_items = np.zeros(len(ratings), dtype=bool)
+    start = time.perf_counter()
+
+    print(f"Ingesting results from {results_file} in chunks of {chunksize} rows with {semantics} updates...")
+    for chunk in pd.read_csv(results_file, usecols=[item_a_column, item_b_column, score_column], chunksize=chunksize):
+        df, item_a_indices, item_b_indices, item_a_scores, chunk_skipped = prepare_chunk(
+            chunk, df, state_manager, item_a_column, item_b_column, score_column, add_unknown)
+        skipped += chunk_skipped
+        if len(touched_items) < len(ratings):
+            touched_items = np.append(touched_items, np.zeros(len(ratings) - len(touched_items), dtype=bool))
+
+        # Only the rating store changes per row; the expected scores are brought up to date once at the end
+        apply_start = time.perf_counter()
+        apply_results_to_state(state_manager, item_a_indices, item_b_indices, item_a_scores, semantics, refresh=False)
+        apply_time += time.perf_counter() - apply_start
+
+        touched_items[item_a_indices] = True
+        touched_items[item_b_indices] = True
+        applied += len(item_a_indices)
+        print(f"Applied {applied} results ({skipped} skipped)...")
+
+    # Update the expected scores and sorted Elo index for every item that was compared
+    state_manager.refresh_items(np.flatnonzero(touched_items))
+    state_manager.comparison_count += applied
+    elapsed = time.perf_counter() - start
+
+    df = calculate_rank_and_elo_changes(df, ratings=ratings, leaderboard=leaderboard)
+    save_to_csv(df, state_manager, directory)
+    state_manager.close_journal()
+
+    print(f"Ingested {applied} results ({skipped} skipped) in {elapsed:.2f}s: {(applied + skipped) / max(elapsed, 1e-9):,.0f} rows/s overall, "
+          f"{applied / max(apply_time, 1e-9):,.0f} rows/s applying Elo updates.")
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply a file of pairwise results to the latest Elo rankings without the GUI.")
+    parser.add_argument('results_file', help="CSV file with one result per row.")
+    parser.add_argument('--directory', default=DIRECTORY, help="Directory holding the saved rankings.")
+    parser.add_argument('--initial-csv-file', default=INITIAL_CSV_FILE, help="Initial item file used if there are no saved rankings.")
+    parser.add_argument('--item-a-column', default='item_a', help="Column with the first item's name.")
+    parser.add_argument('--item-b-column', default='item_b', help="Column with the second item's name.")
+    parser.add_argument('--score-column', default='score_a', help="Column with the first item's score (1 win, 0.5 draw, 0 loss).")
+    parser.add_argument('--chunksize', type=int, default=100_000, help="Rows read and applied at a time.")
+    parser.add_argument('--semantics', choices=['sequential', 'period'], default='sequential',
+                        help="'sequential' applies results in file order; 'period' scores each chunk against the ratings at its start.")
+    parser.add_argument('--add-unknown', action='store_true', help="Add unknown items with the standard Elo score instead of skipping their results.")
+    args = parser.parse_args()
+
+    ingest_results(args.results_file, args.directory, args.initial_csv_file, args.item_a_column, args.item_b_column,
+                   args.score_column, args.chunksize, args.add_unknown, args.semantics)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import numpy as np
+from user_variables import *
+
+#########################################################################################################
+# Order-statistics leaderboard
+#########################################################################################################
+# The sorted Elo index keeps every item in Elo order and is moved in amortised O(log n) by every comparison,
+# so an item's current rank is its distance from the top of the sorted keys. A Leaderboard remembers each
+# item's rank and Elo score when it was started (normally when the session starts), so rank changes, Elo
+# changes and the top of the table are read from the index instead of sorting and merging DataFrames.
+# Items frozen by top-K focus mode are out of the index until the focus ends, so they have no rank meanwhile.
+
+class Leaderboard:
+    """
+    Current ranks, top-k slices and rank changes since the leaderboard was started, read from the
+    StateManager's sorted Elo index. Ranks start at 1 for the highest Elo score.
+    """
+    def __init__(self, state_manager):
+        """
+        :param state_manager: Instance of StateManager, containing the rating store and sorted Elo index.
+        """
+        if state_manager.elo_index is None:
+            state_manager.build_elo_index(state_manager.ratings.elo)
+        self.state_manager = state_manager
+        self.start_ranks = self.ranks()
+        self.start_elo = state_manager.ratings.elo.copy()
+
+    def rank(self, item_index):
+        """
+        Returns the current rank of an item.
+        """
+        return self.state_manager.elo_index.rank(item_index)
+
+    def rank_change(self, item_index):
+        """
+        Returns how many places an item has moved up since the leaderboard was started (negative if it
+        moved down), or None for an item added since.
+        """
+        if item_index >= len(self.start_ranks):
+            return None
+        return int(self.start_ranks[item_index]) - self.rank(item_index)
+
+    def top(self, num_items):
+        """
+        Returns the num_items highest ranked items as (item_index, rank, rank_change) tuples, highest first.
+        """
+        return [(item_index, rank, self.rank_change(item_index))
+                for rank, item_index in enumerate(self.state_manager.elo_index.top(num_items), start=1)]
+
+    def ranks(self):
+        """
+        Returns the current rank of every item, in row order.
+        """
+        ranking = np.array(self.state_manager.elo_index.ranking(), dtype=np.int64)
+        ranks = np.empty(len(ranking), dtype=np.int64)
+        ranks[ranking] = np.arange(1, len(ranking) + 1)
+        return ranks
+
+    def changes(self):
+        """
+        Returns the rank changes (places moved up) and Elo changes of every item since the leaderboard was
+        started, in row order. Items added since have NaN changes.
+        """
+        ranks = self.ranks()
+        elo = self.state_manager.ratings.elo
+        num_started = len(self.start_ranks)
+        if len(ranks) == num_started:
+            return self.start_ranks - ranks, elo - self.start_elo
+        rank_changes = np.full(len(ranks), np.nan)
+        elo_changes = np.full(len(ranks), np.nan)
+        rank_changes[:num_started] = self.start_ranks - ranks[:num_started]
+        elo_changes[:num_started] = elo[:num_started] - self.start_elo
+        return rank_changes, elo_changes
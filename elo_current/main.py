@@ -1,34 +1,61 @@
-from file_handling import load_or_initialise_data, save_to_csv
-from elo_scores import calculate_rank_and_elo_changes
-from popup_architecture import run_iterations
-from visualisation import plot_elo_rankings
-from user_variables import INITIAL_CSV_FILE, DIRECTORY, KEEP_COLUMNS
+import time
+STARTUP = time.perf_counter()  # Taken before any other import so the startup report covers them
+
+from user_variables import INITIAL_CSV_FILE, DIRECTORY, PLOT_OUTPUT, PROFILE_STAGES
 from state_manager import StateManager
+from leaderboard import Leaderboard
+from startup_timing import StartupTimer
+from stage_profiler import StageProfiler, profile_stage
 
-import os
+# Heavy modules are imported inside main() by the step that first needs them: pandas with the data loading,
+# tkinter with the comparison window and matplotlib only once the session is over and the rankings are plotted.
 
 def main():
+    startup_timer = StartupTimer(STARTUP)
+    startup_timer.mark('imports')
+
     # Step 1: Initialize StateManager with minimal setup (comparison count and stop flag)
     state_manager = StateManager()
+    state_manager.startup_timer = startup_timer
+    state_manager.profiler = StageProfiler() if PROFILE_STAGES else None
 
     # Step 2: Load the latest CSV file or initialize a new DataFrame, and handle the expected score matrix
-    df = load_or_initialise_data(DIRECTORY, state_manager, INITIAL_CSV_FILE)
+    with profile_stage(state_manager, 'main: load data'):
+        from file_handling import load_or_initialise_data, save_to_csv
+        startup_timer.mark('imports')
+        df = load_or_initialise_data(DIRECTORY, state_manager, INITIAL_CSV_FILE)
+
+    # Step 3: Remember every item's rank and Elo score before any comparisons
+    leaderboard = Leaderboard(state_manager)
+    startup_timer.mark('leaderboard')
 
-    # Step 3: Make a copy of the DataFrame to keep the original as 'previous_df'
-    previous_df = df.copy(deep=True)  # This captures the state before any comparisons
-    
     # Step 4: Run item comparisons (using StateManager to manage state)
-    df_new = run_iterations(df, state_manager)
+    from popup_architecture import run_iterations
+    from elo_scores import calculate_rank_and_elo_changes
+    startup_timer.mark('imports')
+    with profile_stage(state_manager, 'main: run comparisons'):
+        df_new = run_iterations(df, state_manager, leaderboard=leaderboard)
 
     # Step 5: Calculate rank and Elo changes only after all comparisons are done
-    df_new = calculate_rank_and_elo_changes(df_new, previous_df)
+    with profile_stage(state_manager, 'main: rank and Elo changes'):
+        df_new = calculate_rank_and_elo_changes(df_new, ratings=state_manager.ratings, leaderboard=leaderboard)
 
     # Step 6: Save the updated DataFrame and expected score matrix to CSV files
-    save_to_csv(df_new, state_manager, DIRECTORY)
-    
-    # Step 7: Plot the Elo rankings of items
-    plot_elo_rankings(df_new)
+    with profile_stage(state_manager, 'main: save'):
+        save_to_csv(df_new, state_manager, DIRECTORY)
+        state_manager.close_journal()
+
+    # Save the stage profile before plotting, since the plot window stays open for as long as the judge looks at it
+    if state_manager.profiler is not None:
+        state_manager.profiler.save(DIRECTORY)
+
+    # Step 7: Plot the Elo rankings of items, in a window or to chart files
+    if PLOT_OUTPUT == 'files':
+        from visualisation import render_rankings
+        render_rankings(df_new, DIRECTORY, ranking=state_manager.elo_index.ranking())
+    else:
+        from visualisation import plot_elo_rankings
+        plot_elo_rankings(df_new, ranking=state_manager.elo_index.ranking())
 
 if __name__ == "__main__":
     main()
-
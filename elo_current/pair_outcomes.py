@@ -0,0 +1,229 @@
+import os
+import numpy as np
+
+#########################################################################################################
+# Sparse pairwise outcome store
+#########################################################################################################
+# Records how often each pair of items has won, lost and drawn against each other. Only pairs that have
+# actually been compared take up space, so memory grows with the number of distinct pairs compared rather
+# than with the square of the number of items, unlike the expected score matrix.
+#
+# Counts live in growable NumPy arrays with one slot per compared pair (COO style). Two sorted indices are kept
+# over the slots: by pair, so a pair's slot is a binary search, and by item, so an item's row is a binary search
+# and one gather. Pairs compared for the first time go into a small unsorted tail (with a dictionary for
+# lookups) that is merged into the sorted indices once it grows past MERGE_FRACTION of the store, so single
+# comparisons never pay for a full re-sort.
+
+PAIR_OUTCOMES_FILE = 'pair_outcomes.npz'  # Single file written by older versions, before each snapshot had its own
+MERGE_FRACTION = 0.05  # Fraction of the stored pairs the unsorted tail can reach before it is merged
+
+def _pair_codes(lower, higher):
+    """
+    Packs (lower, higher) row positions into one int64 code per pair, which sorts by lower then higher.
+    """
+    return (np.asarray(lower, dtype=np.int64) << 32) | np.asarray(higher, dtype=np.int64)
+
+class PairOutcomeStore:
+    """
+    Win, loss and draw counts for every pair of items that has been compared, keyed by row position.
+    Counts are kept from the point of view of the pair's lower row position.
+    """
+    def __init__(self, capacity=1024):
+        """
+        :param capacity: Number of pairs the arrays have room for before they are grown.
+        """
+        self.num_pairs = 0
+        self.lower = np.empty(capacity, dtype=np.int64)
+        self.higher = np.empty(capacity, dtype=np.int64)
+        self.lower_wins = np.zeros(capacity, dtype=np.int64)
+        self.higher_wins = np.zeros(capacity, dtype=np.int64)
+        self.draws = np.zeros(capacity, dtype=np.int64)
+        self._merge()
+
+    def __len__(self):
+        return self.num_pairs
+
+    def _grow(self, min_capacity):
+        capacity = max(2 * len(self.lower), min_capacity)
+        for name in ('lower', 'higher', 'lower_wins', 'higher_wins', 'draws'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.num_pairs] = old[:self.num_pairs]
+            setattr(self, name, new)
+
+    def _merge(self):
+        """
+        Rebuilds the sorted pair and item indices over every slot, emptying the unsorted tail.
+        """
+        lower, higher = self.lower[:self.num_pairs], self.higher[:self.num_pairs]
+        codes = _pair_codes(lower, higher)
+        self.sorted_slots = np.argsort(codes, kind='stable')
+        self.sorted_codes = codes[self.sorted_slots]
+        # Each pair appears in the rows of both its items: entry k of the endpoints belongs to slot k % num_pairs
+        endpoints = np.concatenate([lower, higher])
+        endpoint_order = np.argsort(endpoints, kind='stable')
+        self.row_items = endpoints[endpoint_order]
+        self.row_slots = endpoint_order % max(self.num_pairs, 1)
+        self.num_merged = self.num_pairs
+        self.tail_slots = {}  # Pair code -> slot of pairs added since the last merge
+
+    def _find(self, code):
+        """
+        Returns the slot of a pair code, or None if the pair has not been compared.
+        """
+        slot = self.tail_slots.get(code)
+        if slot is None:
+            position = np.searchsorted(self.sorted_codes, code)
+            if position < len(self.sorted_codes) and self.sorted_codes[position] == code:
+                slot = int(self.sorted_slots[position])
+        return slot
+
+    def record(self, item_1_index, item_2_index, item_1_score):
+        """
+        Counts one comparison: a score above 0.5 is a win for item 1, below 0.5 a win for item 2, and 0.5 a draw.
+        """
+        item_1_index, item_2_index = int(item_1_index), int(item_2_index)
+        lower, higher = min(item_1_index, item_2_index), max(item_1_index, item_2_index)
+        code = (lower << 32) | higher
+        slot = self._find(code)
+        if slot is None:
+            if self.num_pairs == len(self.lower):
+                self._grow(self.num_pairs + 1)
+            slot = self.num_pairs
+            self.lower[slot], self.higher[slot] = lower, higher
+            self.tail_slots[code] = slot
+            self.num_pairs += 1
+            if len(self.tail_slots) > max(64, MERGE_FRACTION * self.num_pairs):
+                self._merge()
+
+        if item_1_score == 0.5:
+            self.draws[slot] += 1
+        elif (item_1_score > 0.5) == (item_1_index < item_2_index):
+            self.lower_wins[slot] += 1
+        else:
+            self.higher_wins[slot] += 1
+
+    def record_many(self, item_1_indices, item_2_indices, item_1_scores):
+        """
+        Counts many comparisons at once, adding up repeated pairs and finding their slots with NumPy.
+        """
+        item_1_indices = np.asarray(item_1_indices, dtype=np.int64)
+        item_2_indices = np.asarray(item_2_indices, dtype=np.int64)
+        item_1_scores = np.asarray(item_1_scores, dtype=np.float64)
+        if len(item_1_indices) == 0:
+            return
+        lower = np.minimum(item_1_indices, item_2_indices)
+        higher = np.maximum(item_1_indices, item_2_indices)
+        lower_scores = np.where(item_1_indices == lower, item_1_scores, 1 - item_1_scores)
+        pair_codes, pair_positions = np.unique(_pair_codes(lower, higher), return_inverse=True)
+
+        # Look every pair up in the sorted index, after merging the tail so it holds every slot
+        if self.tail_slots:
+            self._merge()
+        positions = np.minimum(np.searchsorted(self.sorted_codes, pair_codes), max(len(self.sorted_codes) - 1, 0))
+        found = (self.sorted_codes[positions] == pair_codes) if len(self.sorted_codes) else np.zeros(len(pair_codes), dtype=bool)
+        slots = np.empty(len(pair_codes), dtype=np.int64)
+        slots[found] = self.sorted_slots[positions[found]]
+
+        # Give the new pairs slots at the end, then sort them into the indices
+        num_new = int((~found).sum())
+        if num_new:
+            if self.num_pairs + num_new > len(self.lower):
+                self._grow(self.num_pairs + num_new)
+            slots[~found] = np.arange(self.num_pairs, self.num_pairs + num_new)
+            self.lower[slots[~found]] = pair_codes[~found] >> 32
+            self.higher[slots[~found]] = pair_codes[~found] & 0xFFFFFFFF
+            self.num_pairs += num_new
+            self._merge()
+
+        np.add.at(self.lower_wins, slots[pair_positions], lower_scores > 0.5)
+        np.add.at(self.higher_wins, slots[pair_positions], lower_scores < 0.5)
+        np.add.at(self.draws, slots[pair_positions], lower_scores == 0.5)
+
+    def pair(self, item_1_index, item_2_index):
+        """
+        Returns (item_1 wins, item_2 wins, draws) between two items.
+        """
+        slot = self._find((min(item_1_index, item_2_index) << 32) | max(item_1_index, item_2_index))
+        if slot is None:
+            return 0, 0, 0
+        wins = (int(self.lower_wins[slot]), int(self.higher_wins[slot]))
+        return (*(wins if item_1_index < item_2_index else wins[::-1]), int(self.draws[slot]))
+
+    def item_row(self, item_index):
+        """
+        Returns every opponent an item has been compared with, as arrays of
+        (opponent indices, wins, losses, draws) from the item's point of view.
+        """
+        start, stop = np.searchsorted(self.row_items, [item_index, item_index + 1])
+        slots = self.row_slots[start:stop]
+        if self.tail_slots:
+            tail = np.arange(self.num_merged, self.num_pairs)
+            slots = np.concatenate([slots, tail[(self.lower[tail] == item_index) | (self.higher[tail] == item_index)]])
+        is_lower = self.lower[slots] == item_index
+        opponents = np.where(is_lower, self.higher[slots], self.lower[slots])
+        wins = np.where(is_lower, self.lower_wins[slots], self.higher_wins[slots])
+        losses = np.where(is_lower, self.higher_wins[slots], self.lower_wins[slots])
+        return opponents, wins, losses, self.draws[slots]
+
+    def to_arrays(self):
+        """
+        Returns (lower, higher, lower_wins, higher_wins, draws) arrays with one entry per compared pair.
+        """
+        return (self.lower[:self.num_pairs], self.higher[:self.num_pairs], self.lower_wins[:self.num_pairs],
+                self.higher_wins[:self.num_pairs], self.draws[:self.num_pairs])
+
+    @classmethod
+    def from_arrays(cls, lower, higher, lower_wins, higher_wins, draws):
+        """
+        Builds a store from one entry per pair, with lower < higher for every pair.
+        """
+        store = cls(capacity=max(1024, len(lower)))
+        store.num_pairs = len(lower)
+        for name, values in (('lower', lower), ('higher', higher), ('lower_wins', lower_wins), ('higher_wins', higher_wins), ('draws', draws)):
+            getattr(store, name)[:len(values)] = values
+        store._merge()
+        return store
+
+    def save(self, file_path, order=None, num_items=None, snapshot=None):
+        """
+        Saves the counts to a .npz file, written to a temporary file first so a crash never leaves half a file.
+
+        :param order: Optional row positions giving the order of the items in the saved rankings, so the saved
+                      pairs refer to the saved CSV rows.
+        :param num_items: Number of items in the saved rankings, checked when the file is loaded.
+        :param snapshot: File name of the snapshot the counts belong to, checked when the file is loaded.
+        """
+        lower, higher, lower_wins, higher_wins, draws = self.to_arrays()
+        if order is not None:
+            # Map each row position to its position in the saved order, keeping lower < higher
+            saved_positions = np.empty(len(order), dtype=np.int64)
+            saved_positions[np.asarray(order)] = np.arange(len(order))
+            saved_lower, saved_higher = saved_positions[lower], saved_positions[higher]
+            swapped = saved_lower > saved_higher
+            lower, higher = np.where(swapped, saved_higher, saved_lower), np.where(swapped, saved_lower, saved_higher)
+            lower_wins, higher_wins = np.where(swapped, higher_wins, lower_wins), np.where(swapped, lower_wins, higher_wins)
+
+        temp_path = file_path + '.tmp.npz'
+        np.savez(temp_path, lower=lower, higher=higher, lower_wins=lower_wins, higher_wins=higher_wins, draws=draws,
+                 num_items=-1 if num_items is None else num_items, snapshot='' if snapshot is None else snapshot)
+        os.replace(temp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path, num_items=None, snapshot=None):
+        """
+        Loads counts saved with save.
+
+        :param num_items: Number of items in the loaded rankings. If the file was saved for a different number
+                          of items it cannot line up with the rows, so None is returned.
+        :param snapshot: File name of the loaded snapshot. If the file was saved with a different snapshot its
+                         pairs refer to other rows, so None is returned. Files from older versions record no
+                         snapshot and are only checked by their number of items.
+        """
+        with np.load(file_path) as saved:
+            if num_items is not None and int(saved['num_items']) not in (-1, num_items):
+                return None
+            saved_snapshot = str(saved['snapshot']) if 'snapshot' in saved.files else ''
+            if snapshot is not None and saved_snapshot not in ('', snapshot):
+                return None
+            return cls.from_arrays(saved['lower'], saved['higher'], saved['lower_wins'], saved['higher_wins'], saved['draws'])
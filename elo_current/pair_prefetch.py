@@ -0,0 +1,105 @@
+from concurrent.futures import ThreadPoolExecutor
+
+#########################################################################################################
+# Background pair prefetching
+#########################################################################################################
+# The next batch of closest pairs is selected on a worker thread while the judge is still deciding the last
+# pair of the current batch. Pair gaps only depend on the two items' Elo scores, so once that decision is
+# made, every prefetched pair that does not involve a decided item is still correct. The prefetch takes a
+# margin of extra pairs, so the batch can be patched by dropping pairs that involve decided items and adding
+# their new pairs that now fall inside the prefetched range. Only if too few pairs are left is the batch
+# selected again.
+
+class PairPrefetcher:
+    """
+    Selects the next batch of closest pairs in the background and brings it up to date with the comparisons
+    decided since, giving the same batch as calling closest_pairs on the current state.
+    """
+    def __init__(self, state_manager, batch_size=10, extra_pairs=None):
+        """
+        :param state_manager: Instance of StateManager, containing the sorted Elo index and the lock guarding it.
+        :param batch_size: Number of pairs in each batch.
+        :param extra_pairs: Pairs prefetched beyond batch_size to cover pairs dropped by patching (defaults to batch_size).
+        """
+        self.state_manager = state_manager
+        self.batch_size = batch_size
+        self.num_prefetched = batch_size + (batch_size if extra_pairs is None else extra_pairs)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pair-prefetch')
+        self.future = None
+        self.decided_items = set()
+        self.used_as_is = 0
+        self.patched = 0
+        self.reselected = 0
+
+    def _select(self):
+        """
+        Runs on the worker thread: returns the pair entries of the num_prefetched closest pairs.
+        """
+        with self.state_manager.lock:
+            elo_index = self.state_manager.elo_index
+            return [elo_index.pair_key(i, j) for i, j in elo_index.closest_pairs(self.num_prefetched)]
+
+    def prefetch(self):
+        """
+        Starts selecting the next batch on the worker thread from the current state.
+        """
+        if self.future is None:
+            self.decided_items = set()
+            self.future = self.executor.submit(self._select)
+
+    def record(self, item_1_index, item_2_index):
+        """
+        Notes a comparison decided after the prefetch started, so the batch can be patched for it.
+        """
+        if self.future is not None:
+            self.decided_items.update((item_1_index, item_2_index))
+
+    def next_batch(self):
+        """
+        Returns the next batch of (lower_index, higher_index) pairs, patching the prefetched batch for any
+        comparisons decided since it started, or selecting it now if nothing was prefetched.
+        """
+        elo_index = self.state_manager.elo_index
+        if self.future is None:
+            self.reselected += 1
+            with self.state_manager.lock:
+                return elo_index.closest_pairs(self.batch_size)
+
+        prefetched = self.future.result()
+        self.future = None
+        if not self.decided_items:
+            self.used_as_is += 1
+            return [(i, j) for _, i, j in prefetched[:self.batch_size]]
+
+        # Every pair up to the last prefetched one was prefetched, unless fewer pairs exist than were asked for
+        threshold = prefetched[-1] if len(prefetched) == self.num_prefetched else None
+        kept = {entry for entry in prefetched if entry[1] not in self.decided_items and entry[2] not in self.decided_items}
+        with self.state_manager.lock:
+            for item_index in self.decided_items:
+                max_gap = threshold[0] if threshold is not None else float('inf')
+                kept.update(entry for entry in elo_index.pairs_near(item_index, max_gap) if threshold is None or entry <= threshold)
+            candidates = sorted(kept)
+
+            # Pairs beyond the prefetched range might be needed, so select the batch again
+            if threshold is not None and len(candidates) < self.batch_size:
+                self.reselected += 1
+                return elo_index.closest_pairs(self.batch_size)
+
+        self.patched += 1
+        return [(i, j) for _, i, j in candidates[:self.batch_size]]
+
+    def discard(self):
+        """
+        Drops any prefetched batch, so the next batch is selected from the current state. Used when items
+        have been taken out of the sorted Elo index since the prefetch started.
+        """
+        if self.future is not None:
+            self.future.cancel()
+            self.future = None
+
+    def close(self):
+        """
+        Stops the worker thread.
+        """
+        self.future = None
+        self.executor.shutdown(wait=True)
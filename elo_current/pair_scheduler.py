@@ -0,0 +1,184 @@
+import heapq
+import itertools
+import random
+import time
+from collections import namedtuple
+import numpy as np
+from user_variables import *
+from popup_architecture import update_score
+
+#########################################################################################################
+# Disjoint pair scheduler for concurrent judges
+#########################################################################################################
+# When several judges work on one list at once, each judge is leased a pair, and no item is in two open leases.
+# Two judges can then never be deciding pairs that share an item, so every result is applied to ratings that
+# nobody else is about to change. Leases expire so an abandoned pair goes back into the pool.
+#
+# Fairness: each judge holds at most max_leases_per_judge open leases (asking again returns the open lease
+# instead of a new one), and among the closest fairness_window disjoint pairs the one whose least compared item
+# has the fewest comparisons is leased, so items near busy parts of the ranking are not starved.
+
+Lease = namedtuple('Lease', ['lease_id', 'judge_id', 'item_1', 'item_2', 'expires_at'])
+
+class PairScheduler:
+    """
+    Leases pairs to judges so that no item appears in two open leases, and applies the judged results.
+    All methods are thread-safe; they hold the StateManager's lock, which update_score also takes.
+    """
+    def __init__(self, df, state_manager, n=2, lease_seconds=PAIR_LEASE_SECONDS, max_leases_per_judge=1,
+                 fairness_window=4, clock=time.monotonic, seed=None):
+        """
+        :param df: DataFrame containing the item data, indexed by row position.
+        :param state_manager: Instance of StateManager with the loaded ratings and sorted Elo index.
+        :param n: Items with fewer than n comparisons are paired at random first, as in phase 1 of run_iterations.
+        :param lease_seconds: Seconds a judge has to return a result before the pair is leased to someone else.
+        :param max_leases_per_judge: Open leases each judge may hold at once.
+        :param fairness_window: Number of closest disjoint pairs the least compared pair is chosen from (1 for closest only).
+        :param clock: Function returning the current time in seconds, replaceable for testing.
+        """
+        self.df = df
+        self.names = df[NAME_COLUMN]
+        self.state_manager = state_manager
+        self.n = n
+        self.lease_seconds = lease_seconds
+        self.max_leases_per_judge = max_leases_per_judge
+        self.fairness_window = fairness_window
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self.lock = state_manager.lock
+        self.leases = {}  # lease_id -> Lease
+        self.leased_items = {}  # item index -> lease_id of the open lease holding it
+        self.leases_by_judge = {}  # judge_id -> set of open lease ids
+        self.expiry_heap = []  # (expires_at, lease_id) of leases that may still be open
+        self.lease_ids = itertools.count(1)
+        self.results_applied = 0
+        self.leases_expired = 0
+
+        # Build the sorted Elo index if it was not built when the data was loaded
+        if state_manager.elo_index is None:
+            state_manager.build_elo_index(state_manager.ratings.elo)
+
+    def _close_lease(self, lease_id):
+        """
+        Removes an open lease, freeing its items.
+        """
+        lease = self.leases.pop(lease_id)
+        for item in (lease.item_1, lease.item_2):
+            del self.leased_items[self.state_manager.name_index[item]]
+        judge_leases = self.leases_by_judge[lease.judge_id]
+        judge_leases.discard(lease_id)
+        if not judge_leases:
+            del self.leases_by_judge[lease.judge_id]
+        return lease
+
+    def expire_leases(self):
+        """
+        Closes every lease past its expiry time.
+
+        :return: The number of leases that expired.
+        """
+        with self.lock:
+            now = self.clock()
+            expired = 0
+            while self.expiry_heap and self.expiry_heap[0][0] <= now:
+                _, lease_id = heapq.heappop(self.expiry_heap)
+                if lease_id in self.leases:
+                    self._close_lease(lease_id)
+                    expired += 1
+            self.leases_expired += expired
+            return expired
+
+    def _free(self, pair):
+        return pair[0] not in self.leased_items and pair[1] not in self.leased_items
+
+    def _random_pair(self):
+        """
+        Picks a pair of free items, starting from the least compared free item, or None if fewer than two are free.
+        """
+        free = np.ones(len(self.names), dtype=bool)
+        free[list(self.leased_items)] = False
+        free_items = np.flatnonzero(free)
+        if len(free_items) < 2:
+            return None
+        free_comparisons = self.state_manager.ratings.comparisons[free_items]
+        least_compared = free_items[free_comparisons == free_comparisons.min()]
+        item_1 = int(least_compared[self.rng.randrange(len(least_compared))])
+        item_2 = item_1
+        while item_2 == item_1:
+            item_2 = int(free_items[self.rng.randrange(len(free_items))])
+        return (item_1, item_2)
+
+    def _closest_free_pair(self):
+        """
+        Picks among the closest pairs whose items are both free, applying the fairness window.
+        """
+        comparisons = self.state_manager.ratings.comparisons
+        # Stop looking once the close pairs are exhausted, which only happens when nearly every item is leased
+        max_pairs_read = 4 * len(self.names)
+        candidates = []
+        for pair in itertools.islice(self.state_manager.elo_index.iter_closest_pairs(), max_pairs_read):
+            if self._free(pair):
+                candidates.append(pair)
+                if len(candidates) == self.fairness_window:
+                    break
+        if not candidates:
+            return self._random_pair()
+        # Prefer the pair whose least compared item has the fewest comparisons, then the closest
+        return min(candidates, key=lambda pair: min(comparisons[pair[0]], comparisons[pair[1]]))
+
+    def lease(self, judge_id):
+        """
+        Leases a pair to a judge. A judge already holding max_leases_per_judge open leases gets their oldest one back.
+
+        :return: A Lease, or None if every item is already leased.
+        """
+        with self.lock:
+            self.expire_leases()
+            judge_leases = self.leases_by_judge.get(judge_id, set())
+            if len(judge_leases) >= self.max_leases_per_judge:
+                return self.leases[min(judge_leases)]
+
+            if self.state_manager.ratings.comparisons.min() < self.n:
+                pair = self._random_pair()
+            else:
+                pair = self._closest_free_pair()
+            if pair is None:
+                return None
+
+            lease_id = next(self.lease_ids)
+            lease = Lease(lease_id, judge_id, self.names.iloc[pair[0]], self.names.iloc[pair[1]], self.clock() + self.lease_seconds)
+            self.leases[lease_id] = lease
+            self.leased_items[pair[0]] = lease_id
+            self.leased_items[pair[1]] = lease_id
+            self.leases_by_judge.setdefault(judge_id, set()).add(lease_id)
+            heapq.heappush(self.expiry_heap, (lease.expires_at, lease_id))
+            return lease
+
+    def submit(self, lease_id, item_1_score):
+        """
+        Applies the result of a leased pair and closes the lease.
+
+        :param item_1_score: Score of the lease's item_1 (1, 0.5 or 0); item_2 scores 1 minus this.
+        :return: True if the result was applied, False if the lease is unknown, already used or expired.
+        """
+        with self.lock:
+            self.expire_leases()
+            if lease_id not in self.leases:
+                return False
+            lease = self._close_lease(lease_id)
+            update_score(lease.item_1, lease.item_2, item_1_score, 1 - item_1_score, None, self.df, self.state_manager)
+            self.state_manager.increment_comparison_count()
+            self.results_applied += 1
+            return True
+
+    def release(self, lease_id):
+        """
+        Gives a leased pair back without a result, such as when a judge skips it.
+
+        :return: True if the lease was open.
+        """
+        with self.lock:
+            if lease_id not in self.leases:
+                return False
+            self._close_lease(lease_id)
+            return True
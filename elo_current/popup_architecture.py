@@ -1,9 +1,18 @@
 import tkinter as tk
 from tkinter import font as tkFont
+from functools import lru_cache
 import random
+import time
+import numpy as np
 from elo_scores import *
 from user_variables import *
 from state_manager import StateManager
+from pair_prefetch import PairPrefetcher
+from information_gain import PAIRING_STRATEGIES, information_gain_pairs
+from top_k_focus import TopKFocus
+from leaderboard import Leaderboard
+from startup_timing import mark_startup, report_first_pair_shown
+from stage_profiler import profile_stage, record_stage
 
 #########################################################################################################
 # GUI wrapping handling
@@ -29,6 +38,13 @@ def wrap_title(title, max_chars_per_line,separator = "-"):
 
     return "\n".join(lines)
 
+@lru_cache(maxsize=4096)
+def cached_wrap_title(title, max_chars_per_line, separator="-"):
+    """
+    wrap_title with its results cached, as the same titles are wrapped again every time an item comes back.
+    """
+    return wrap_title(title, max_chars_per_line, separator)
+
 def calculate_max_chars(width, tk_font):
     """
     Calculates the maximum number of characters per line based on width and font metrics.
@@ -77,96 +93,94 @@ def calculate_window_height(title_lines, button_heights, title_font, base_height
 # GUI functionality 
 #########################################################################################################
 
-def update_expected_scores_matrix(item_1_index, item_2_index, df, expected_score_matrix):
+def update_expected_scores_matrix(item_1_index, item_2_index, elo_scores, expected_scores, columns=None):
     """
     Updates the expected scores for two items (item_1 and item_2) with respect to all other items 
     in the dataset after their Elo ratings have been updated.
     
     :param item_1_index: Index of the first item in the DataFrame.
     :param item_2_index: Index of the second item in the DataFrame.
-    :param df: The DataFrame containing the Elo ratings for all the items.
-    :param expected_score_matrix: The matrix that stores the expected scores between all items, 
-                                  which will be updated in this function.
+    :param elo_scores: The current Elo ratings for all the items, from the StateManager's rating store.
+    :param expected_scores: The expected score backend from the StateManager (a dense matrix, or Elo scores
+                            that expected scores are calculated from on demand), which will be updated in this function.
+    :param columns: Optional indices of the only items to update the expected scores against (the active items in top-K focus mode).
     """
-    # Retrieve the updated Elo ratings for both items after their latest comparison
-    item_1_elo = df.at[item_1_index, ELO_COLUMN]
-    item_2_elo = df.at[item_2_index, ELO_COLUMN]
-
-    # Loop through all items in the dataset and update the expected scores for item_1 and item_2
-    for other_item_index, other_item_elo in df[ELO_COLUMN].items():
-        
-        # Skip updating the score for item_1 against itself
-        if other_item_index != item_1_index:
-            # Calculate the expected score for item_1 vs another item
-            expected_item_1_vs_other, _ = expected_score(item_1_elo, other_item_elo)
-            
-            # Update the expected score matrix for item_1 vs the other item
-            expected_score_matrix[item_1_index, other_item_index] = expected_item_1_vs_other
-            
-            # Since the expected score is reciprocal, update the reverse (other item vs item_1)
-            expected_score_matrix[other_item_index, item_1_index] = 1 - expected_item_1_vs_other
-
-        # Skip updating the score for item_2 against itself
-        if other_item_index != item_2_index:
-            # Calculate the expected score for item_2 vs another item
-            expected_item_2_vs_other, _ = expected_score(item_2_elo, other_item_elo)
-            
-            # Update the expected score matrix for item_2 vs the other item
-            expected_score_matrix[item_2_index, other_item_index] = expected_item_2_vs_other
-            
-            # Since the expected score is reciprocal, update the reverse (other item vs item_2)
-            expected_score_matrix[other_item_index, item_2_index] = 1 - expected_item_2_vs_other
+    # Recalculate the expected scores of both items against every other item from their updated Elo ratings
+    expected_scores.update_items([item_1_index, item_2_index], elo_scores, columns)
 
 
 
 def update_score(item_1_name, item_2_name, item_1_score, item_2_score, root, df, state_manager):
     """
     Updates Elo scores after a comparison and recalculates expected scores with all other items.
+    The new values are written to the rating store in the StateManager rather than to the DataFrame.
+    The root window is None when the comparison was made without a popup, such as in a simulation.
     """
-    # Get the rows and their indices corresponding to both items using loc
-    item_1_row = df.loc[df[NAME_COLUMN] == item_1_name].squeeze()
-    item_2_row = df.loc[df[NAME_COLUMN] == item_2_name].squeeze()
+    start = time.perf_counter()
+    ratings = state_manager.ratings
 
-    # Get the index of both items (the same loc call provides this)
-    item_1_index = item_1_row.name  # This is the index of item_1_row
-    item_2_index = item_2_row.name  # This is the index of item_2_row
+    # Get the row positions of both items from the name index
+    item_1_index = state_manager.name_index[item_1_name]
+    item_2_index = state_manager.name_index[item_2_name]
 
     # Get the current Elo scores for both items
-    item_1_elo = item_1_row[ELO_COLUMN]
-    item_2_elo = item_2_row[ELO_COLUMN]
+    item_1_elo = float(ratings.elo[item_1_index])
+    item_2_elo = float(ratings.elo[item_2_index])
 
     # Retrieve the precomputed expected scores from the expected score matrix
-    expected_item_1_score = state_manager.expected_score_matrix[item_1_index, item_2_index]
+    expected_item_1_score = state_manager.expected_scores.score(item_1_index, item_2_index)
     expected_item_2_score = 1 - expected_item_1_score
 
     # Update Elo scores based on the actual scores (1, 0, or 0.5 for each item)
-    new_item_1_elo = update_individual_elo(item_1_elo, expected_item_1_score, item_1_score)
-    new_item_2_elo = update_individual_elo(item_2_elo, expected_item_2_score, item_2_score)
+    new_item_1_elo = update_individual_elo(item_1_elo, expected_item_1_score, item_1_score, state_manager.k_factor)
+    new_item_2_elo = update_individual_elo(item_2_elo, expected_item_2_score, item_2_score, state_manager.k_factor)
 
     # Calculate and store Elo change
     item_1_elo_change = new_item_1_elo - item_1_elo
     item_2_elo_change = new_item_2_elo - item_2_elo
 
-    # Update the Elo change in the DataFrame
-    df.loc[item_1_index, 'Elo Change'] = item_1_elo_change
-    df.loc[item_2_index, 'Elo Change'] = item_2_elo_change
+    # Append the comparison to the journal before applying it, so it can be replayed after a crash
+    if state_manager.journal is not None:
+        state_manager.journal.record(state_manager.comparison_count + 1, item_1_name, item_2_name, item_1_score, item_2_score,
+                                     (item_1_elo, item_2_elo), (new_item_1_elo, new_item_2_elo))
+
+    # Apply the comparison while holding the lock, so pairs being prefetched on another thread see a consistent state
+    with state_manager.lock:
+        # Update the Elo change in the rating store
+        ratings.elo_change[item_1_index] = item_1_elo_change
+        ratings.elo_change[item_2_index] = item_2_elo_change
+
+        # Update the new Elo scores in the rating store
+        ratings.elo[item_1_index] = new_item_1_elo
+        ratings.elo[item_2_index] = new_item_2_elo
 
-    # Update the new Elo scores in the DataFrame
-    df.loc[item_1_index, ELO_COLUMN] = new_item_1_elo
-    df.loc[item_2_index, ELO_COLUMN] = new_item_2_elo
+        # Move both items to their new positions in the sorted Elo index
+        if state_manager.elo_index is not None:
+            state_manager.elo_index.update(item_1_index, new_item_1_elo)
+            state_manager.elo_index.update(item_2_index, new_item_2_elo)
 
-    # Update the comparison count for both items
-    df.loc[item_1_index, COMPARISONS_COLUMN] += 1
-    df.loc[item_2_index, COMPARISONS_COLUMN] += 1
+        # Update the comparison count for both items
+        ratings.comparisons[item_1_index] += 1
+        ratings.comparisons[item_2_index] += 1
 
-    # Update the expected scores matrix for both items using the actual matrix from StateManager
-    update_expected_scores_matrix(item_1_index, item_2_index, df, state_manager.expected_score_matrix)
+        # Count the outcome for the pair, and remember when it was judged so information gain pairing does not repeat it straight away
+        state_manager.pair_outcomes.record(item_1_index, item_2_index, item_1_score)
+        state_manager.recent_pairs.append((state_manager.comparison_count, min(item_1_index, item_2_index), max(item_1_index, item_2_index)))
+
+        # Update the expected scores for both items using the expected score backend from StateManager, only against
+        # the items still in play when run_iterations is focusing on the top K
+        columns = None if state_manager.focus is None else state_manager.focus.expected_score_columns((item_1_index, item_2_index))
+        with profile_stage(state_manager, 'update_expected_scores_matrix'):
+            update_expected_scores_matrix(item_1_index, item_2_index, ratings.elo, state_manager.expected_scores, columns)
 
     # Simplified print statement
-    print(f"{item_1_name}: ({'+' if item_1_elo_change >= 0 else ''}{item_1_elo_change:.2f}), {item_2_name}: ({'+' if item_2_elo_change >= 0 else ''}{item_2_elo_change:.2f})")
+    if state_manager.verbose:
+        print(f"{item_1_name}: ({'+' if item_1_elo_change >= 0 else ''}{item_1_elo_change:.2f}), {item_2_name}: ({'+' if item_2_elo_change >= 0 else ''}{item_2_elo_change:.2f})")
+    record_stage(state_manager, 'update_score', start)
 
     # Close the Tkinter popup
-    root.destroy()
+    if root is not None:
+        root.destroy()
 
 
 
@@ -183,6 +197,7 @@ def create_popup(item_1, item_2, df, state_manager, window_width=700, title_font
     """
     Creates a Tkinter GUI for comparing two items and allowing the user to select a winner.
     """
+    start = time.perf_counter()
     root = tk.Tk()
 
     # Font definition (type and size)
@@ -230,36 +245,199 @@ def create_popup(item_1, item_2, df, state_manager, window_width=700, title_font
     label2 = tk.Label(root, text=f"Item 2: {wrapped_title2_window}", font=title_font, wraplength=window_width * 0.8, anchor="center")
     label2.grid(row=1, column=0, pady=10, sticky="n")
 
+    # Time building the window apart from the judge's decision, which starts once the pair is drawn
+    shown_at = []
+    def pair_shown():
+        shown_at.append(time.perf_counter())
+        record_stage(state_manager, 'create_popup', start, shown_at[0])
+        report_first_pair_shown(state_manager)
+
+    def decide(item_1_score, item_2_score):
+        if shown_at:
+            record_stage(state_manager, 'human decision', shown_at[0])
+        if item_1_score is None:
+            quit_iterations(root, state_manager)
+        else:
+            update_score(item_1, item_2, item_1_score, item_2_score, root, df, state_manager)
+
     # Add in item 1 button
     button1 = tk.Button(root, text=wrapped_title1_button, font=button_font, width=int(button_width / button_font_size), height=int(button1_height / 20), 
-                        command=lambda: update_score(item_1, item_2, 1, 0, root, df, state_manager))
+                        command=lambda: decide(1, 0))
     button1.grid(row=2, column=0, pady=10, sticky="n")
 
     #Add in item 2 button
     button2 = tk.Button(root, text=wrapped_title2_button, font=button_font, width=int(button_width / button_font_size), height=int(button2_height / 20), 
-                        command=lambda: update_score(item_2, item_1, 0, 1, root, df,state_manager))
+                        command=lambda: decide(0, 1))
     button2.grid(row=3, column=0, pady=10, sticky="n")
 
     #Add in draw button
     button_draw = tk.Button(root, text="Draw", font=button_font, width=int(button_width / button_font_size), height=2, 
-                            command=lambda: update_score(item_1, item_2, 0.5, 0.5, root, df,state_manager))
+                            command=lambda: decide(0.5, 0.5))
     button_draw.grid(row=4, column=0, pady=10, sticky="n")
 
     #Add in quit button
     button_quit = tk.Button(root, text="Quit", font=button_font, width=int(button_width / button_font_size), height=2, 
-                            command=lambda: quit_iterations(root, state_manager))
+                            command=lambda: decide(None, None))
     button_quit.grid(row=5, column=0, pady=10, sticky="n")
 
+    root.after_idle(pair_shown)
     root.mainloop()
 
-def generate_random_pairs(df):
+#########################################################################################################
+# Persistent comparison window
+#########################################################################################################
+
+ITEM_1_WINS, ITEM_2_WINS, DRAW, QUIT = 1, 2, 3, 4  # Decisions the comparison window can return
+
+class ComparisonWindow:
+    """
+    A single comparison window that stays open for the whole session. Each pair reconfigures the existing
+    labels and buttons in place rather than building a new Tk root, so fonts, font metrics and screen size
+    are only measured once. Pass it to run_iterations as the popup.
+
+    Keyboard shortcuts: 1 or Left for item 1, 2 or Right for item 2, D, Down or Space for a draw, Q or Escape to quit.
+    The time from each decision until the next pair is on screen is recorded in `time_to_next_pair`.
+    """
+    def __init__(self, window_width=700, title_font_size=14, button_font_size=12, button_width=300):
+        self.root = tk.Tk()
+        self.root.title("Elo comparison")
+        self.window_width = window_width
+        self.window_height = None
+
+        # Font definition (type and size), measured once for the whole session
+        self.title_font = tkFont.Font(family="Arial", size=title_font_size)
+        self.button_font = tkFont.Font(family="Arial", size=button_font_size)
+        self.max_chars_per_line_window = calculate_max_chars(window_width, self.title_font)
+        self.max_chars_per_line_button = calculate_max_chars(button_width, self.button_font)
+        self.title_line_height = self.title_font.metrics("linespace")
+        self.button_line_height = self.button_font.metrics("linespace")
+        self.screen_width = self.root.winfo_screenwidth()
+        self.screen_height = self.root.winfo_screenheight()
+
+        self.decision = tk.IntVar(self.root, value=0)
+        self.decided_at = None  # perf_counter time of the latest decision
+        self.shown_at = None  # perf_counter time the latest pair was drawn
+        self.time_to_next_pair = []  # Seconds from each decision until the next pair was shown
+
+        # Set up a grid layout for the window
+        self.root.grid_columnconfigure(0, weight=1)
+        for i in range(6):
+            self.root.grid_rowconfigure(i, weight=1)
+
+        # Add in both titles, filled in for each pair
+        self.label1 = tk.Label(self.root, font=self.title_font, wraplength=window_width * 0.8, anchor="center")
+        self.label1.grid(row=0, column=0, pady=10, sticky="n")
+        self.label2 = tk.Label(self.root, font=self.title_font, wraplength=window_width * 0.8, anchor="center")
+        self.label2.grid(row=1, column=0, pady=10, sticky="n")
+
+        # Add in the buttons, which record the decision rather than updating the scores themselves
+        button_chars = int(button_width / button_font_size)
+        self.button1 = tk.Button(self.root, font=self.button_font, width=button_chars, command=lambda: self.decide(ITEM_1_WINS))
+        self.button1.grid(row=2, column=0, pady=10, sticky="n")
+        self.button2 = tk.Button(self.root, font=self.button_font, width=button_chars, command=lambda: self.decide(ITEM_2_WINS))
+        self.button2.grid(row=3, column=0, pady=10, sticky="n")
+        button_draw = tk.Button(self.root, text="Draw", font=self.button_font, width=button_chars, height=2, command=lambda: self.decide(DRAW))
+        button_draw.grid(row=4, column=0, pady=10, sticky="n")
+        button_quit = tk.Button(self.root, text="Quit", font=self.button_font, width=button_chars, height=2, command=lambda: self.decide(QUIT))
+        button_quit.grid(row=5, column=0, pady=10, sticky="n")
+
+        # Keyboard shortcuts, and treat closing the window as quitting
+        for keys, decision in ((("1", "<Left>"), ITEM_1_WINS), (("2", "<Right>"), ITEM_2_WINS),
+                               (("d", "<Down>", "<space>"), DRAW), (("q", "<Escape>"), QUIT)):
+            for key in keys:
+                self.root.bind(key, lambda event, decision=decision: self.decide(decision))
+        self.root.protocol("WM_DELETE_WINDOW", lambda: self.decide(QUIT))
+
+    def decide(self, decision):
+        """
+        Records the judge's decision, which ends the wait in show_pair.
+        """
+        self.decision.set(decision)
+
+    def _button_height(self, wrapped_text, padding=2):
+        """
+        calculate_button_height using the cached line height of the button font.
+        """
+        return (wrapped_text.count('\n') + 1 + padding) * self.button_line_height
+
+    def show_pair(self, item_1, item_2, on_shown=None):
+        """
+        Shows a pair in the window and waits for the judge's decision.
+        on_shown is called once the pair has been drawn, before the wait.
+
+        :return: ITEM_1_WINS, ITEM_2_WINS, DRAW or QUIT.
+        """
+        # Generate strings split into lines according to the number of characters that fit
+        wrapped_title1_window = cached_wrap_title(item_1, self.max_chars_per_line_window)
+        wrapped_title2_window = cached_wrap_title(item_2, self.max_chars_per_line_window)
+        wrapped_title1_button = cached_wrap_title(f"{item_1} Wins", self.max_chars_per_line_button)
+        wrapped_title2_button = cached_wrap_title(f"{item_2} Wins", self.max_chars_per_line_button)
+        button1_height = self._button_height(wrapped_title1_button)
+        button2_height = self._button_height(wrapped_title2_button)
+
+        self.label1.config(text=f"Item 1: {wrapped_title1_window}")
+        self.label2.config(text=f"Item 2: {wrapped_title2_window}")
+        self.button1.config(text=wrapped_title1_button, height=int(button1_height / 20))
+        self.button2.config(text=wrapped_title2_button, height=int(button2_height / 20))
+
+        # Resize the window only when the titles need a different height (as in calculate_window_height)
+        title_lines = wrapped_title1_window.count('\n') + wrapped_title2_window.count('\n') + 2
+        window_height = 100 + title_lines * self.title_line_height + button1_height + button2_height + 40 + 40 + 3 * 10
+        if window_height != self.window_height:
+            self.window_height = window_height
+            top_left_x = int((self.screen_width / 2) - (self.window_width / 2))
+            top_left_y = int((self.screen_height / 2) - (window_height / 2))
+            self.root.geometry(f"{self.window_width}x{window_height}+{top_left_x}+{top_left_y}")
+
+        # Draw the new pair, then wait for a button or key press
+        self.decision.set(0)
+        self.root.update_idletasks()
+        self.shown_at = time.perf_counter()
+        if self.decided_at is not None:
+            self.time_to_next_pair.append(self.shown_at - self.decided_at)
+        if on_shown is not None:
+            on_shown()
+        self.root.focus_force()
+        self.root.wait_variable(self.decision)
+        self.decided_at = time.perf_counter()
+        return self.decision.get()
+
+    def __call__(self, item_1, item_2, df, state_manager):
+        """
+        Makes one comparison, with the same signature as create_popup.
+        """
+        start = time.perf_counter()
+        decision = self.show_pair(item_1, item_2, on_shown=lambda: report_first_pair_shown(state_manager))
+        record_stage(state_manager, 'show_pair', start, self.shown_at)
+        record_stage(state_manager, 'human decision', self.shown_at, self.decided_at)
+        if decision == QUIT:
+            state_manager.stop()
+        elif decision == ITEM_1_WINS:
+            update_score(item_1, item_2, 1, 0, None, df, state_manager)
+        elif decision == ITEM_2_WINS:
+            update_score(item_1, item_2, 0, 1, None, df, state_manager)
+        else:
+            update_score(item_1, item_2, 0.5, 0.5, None, df, state_manager)
+
+    def close(self):
+        """
+        Closes the window and prints how long the judge waited between pairs.
+        """
+        if self.time_to_next_pair:
+            waits = np.array(self.time_to_next_pair) * 1000
+            print(f"Time to next pair over {len(waits)} comparisons: median {np.median(waits):.1f} ms, "
+                  f"95th percentile {np.percentile(waits, 95):.1f} ms, max {waits.max():.1f} ms.")
+        self.root.destroy()
+
+def generate_random_pairs(df, item_indices=None):
     """
     Generates a list of random pairs from the DataFrame where each item is compared at least once.
     
     :param df: DataFrame containing the item data.
+    :param item_indices: Optional row positions of the only items to pair, such as the items still in play in top-K focus mode.
     :return: A list of (item_1, item_2) pairs for comparison.
     """
-    items = df[NAME_COLUMN].tolist()
+    items = df[NAME_COLUMN].tolist() if item_indices is None else df[NAME_COLUMN].iloc[item_indices].tolist()
     random.shuffle(items)
 
     # Create random pairs by shuffling the list and grouping into pairs
@@ -273,36 +451,47 @@ def generate_random_pairs(df):
 
 def select_closest_pairs(df, state_manager, batch_size=10):
     """
-    Selects the batch_size closest pairs of items for comparison based on the expected score matrix.
+    Selects the batch_size closest pairs of items for comparison based on the expected scores.
     Finds the batch_size pairs with expected scores closest to 0.5.
     
+    The expected score only depends on the gap between two Elo scores, so the pairs closest to 0.5 are the
+    pairs with the smallest Elo gaps. These are read from the sorted Elo index in the StateManager instead
+    of scanning the expected scores, so selecting a batch costs O(batch_size log n).
+    
     :param df: DataFrame containing the item data.
-    :param state_manager: Instance of StateManager, containing the expected score matrix.
+    :param state_manager: Instance of StateManager, containing the sorted Elo index.
     :param batch_size: The number of pairs to return in the batch for random sampling (default is 10).
     :return: List of (item_1, item_2) pairs for comparison.
     """
-    expected_scores = state_manager.expected_score_matrix
-    differences = []
-
-    # Iterate over the matrix and calculate the difference from 0.5
-    for i in range(len(expected_scores)):
-        for j in range(i + 1, len(expected_scores)):  # Only check the upper triangular part of the matrix
-            expected_score = expected_scores[i, j]
-            diff_from_0_5 = abs(expected_score - 0.5)
-            differences.append((diff_from_0_5, i, j))
-    
-    # Sort all pairs by their difference from 0.5 (smallest differences first)
-    differences.sort()
+    # Build the sorted Elo index on first use if it was not built when the data was loaded
+    if state_manager.elo_index is None:
+        state_manager.build_elo_index(state_manager.ratings.elo)
 
     # Get the top batch_size closest pairs
-    closest_pairs = differences[:batch_size]
+    with profile_stage(state_manager, 'select_closest_pairs'):
+        closest_pairs = state_manager.elo_index.closest_pairs(batch_size)
 
-    # Retrieve the item names using the DataFrame index for the closest pairs
-    item_pairs = [(df.iloc[pair[1]][NAME_COLUMN], df.iloc[pair[2]][NAME_COLUMN]) for pair in closest_pairs]
+    # Retrieve the item names using the DataFrame positions for the closest pairs
+    names = df[NAME_COLUMN]
+    item_pairs = [(names.iloc[i], names.iloc[j]) for i, j in closest_pairs]
 
     return item_pairs
 
-def run_iterations(df, state_manager, batch_size=10, n=2):
+def select_information_gain_pairs(df, state_manager, batch_size=10):
+    """
+    Selects the batch_size pairs of items whose comparison is expected to tell us the most about the rankings,
+    weighing how evenly matched each pair is, how uncertain each item's Elo score is and how recently the pair
+    was judged (see information_gain.py). No item is in two pairs of the batch.
+
+    :param df: DataFrame containing the item data.
+    :param state_manager: Instance of StateManager, containing the rating store.
+    :param batch_size: The number of pairs to return in the batch.
+    :return: List of (item_1, item_2) pairs for comparison.
+    """
+    names = df[NAME_COLUMN]
+    return [(names.iloc[i], names.iloc[j]) for i, j in information_gain_pairs(state_manager, batch_size)]
+
+def run_iterations(df, state_manager, batch_size=10, n=2, popup=None, pairing_strategy=PAIRING_STRATEGY, top_k=FOCUS_TOP_K, leaderboard=None):
     """
     Runs the item comparison process in two phases:
     1. Random Swiss-like pairings until every item has been compared 'n' times.
@@ -312,50 +501,118 @@ def run_iterations(df, state_manager, batch_size=10, n=2):
     :param state_manager: Instance of StateManager, managing the expected score matrix and state.
     :param batch_size: Size of the batch for intelligent pairing.
     :param n: The minimum number of comparisons each item must undergo in the initial phase.
+    :param popup: Function called with (item_1, item_2, df, state_manager) to make each comparison. By default a
+                  ComparisonWindow is opened for the session; simulation.py passes a synthetic judge instead.
+    :param pairing_strategy: 'closest' or 'information_gain', how the phase 2 batches are selected.
+    :param top_k: If given, items confidently outside the top_k are frozen after every round and batch, and
+                  only the items still in play are paired in either phase (see top_k_focus.py). The returned
+                  DataFrame then has a FROZEN_COLUMN marking the frozen items.
+    :param leaderboard: Leaderboard started before any comparisons, used for the rank and Elo changes. One is
+                        started here if none is given.
     """
-    # Take a snapshot of the current DataFrame to track Elo and rank changes
-    previous_df = df.copy()
+    if pairing_strategy not in PAIRING_STRATEGIES:
+        raise ValueError(f"Unknown pairing strategy '{pairing_strategy}', expected one of {list(PAIRING_STRATEGIES)}.")
+
+    # Open one comparison window for the whole session unless another way of judging pairs was given
+    window = None
+    if popup is None:
+        popup = window = ComparisonWindow()
+        mark_startup(state_manager, 'window setup')
+
+    # Remember every item's rank and Elo score to track Elo and rank changes, unless the caller already has
+    if leaderboard is None:
+        leaderboard = Leaderboard(state_manager)
 
     print("Starting item comparisons...")
 
+    # Start tracking the items still in play for the top k, freezing those already confidently outside it
+    focus = state_manager.focus = TopKFocus(state_manager, top_k) if top_k is not None else None
+    if focus is not None:
+        focus.update()
+        print(f"Focusing on the top {top_k}: {focus.num_frozen} items frozen, {len(focus.active_indices)} still in play.")
+
     # Phase 1: Swiss-like random pairings to ensure each item is compared at least 'n' times
-    while df[COMPARISONS_COLUMN].min() < n:
-        item_pairs = generate_random_pairs(df)
+    while not state_manager.is_stopped():
+        active_indices = None if focus is None else focus.active_indices
+        active_comparisons = state_manager.ratings.comparisons if focus is None else state_manager.ratings.comparisons[active_indices]
+        if active_comparisons.min() >= n or len(active_comparisons) < 2:
+            break
+        with profile_stage(state_manager, 'pair selection'):
+            item_pairs = generate_random_pairs(df, active_indices)
 
         for item_1, item_2 in item_pairs:
             if state_manager.is_stopped():
                 break
 
-            # Show the comparison popup
-            create_popup(item_1, item_2, df, state_manager)
-
-            # Update the comparison count for both items
-            df.loc[df[NAME_COLUMN] == item_1, COMPARISONS_COLUMN] += 1
-            df.loc[df[NAME_COLUMN] == item_2, COMPARISONS_COLUMN] += 1
+            # Show the comparison popup, whose update_score counts the comparison for both items as the journal replay does
+            popup(item_1, item_2, df, state_manager)
 
             state_manager.increment_comparison_count()
 
-    print(f"Phase 1 complete: Each item has been compared at least {n} times.")
+        if focus is not None:
+            focus.update()
+
+    if not state_manager.is_stopped():
+        print(f"Phase 1 complete: Each item {'still in play ' if focus is not None else ''}has been compared at least {n} times.")
 
     # Phase 2: Intelligent pairings based on the expected score matrix
+    if state_manager.elo_index is None:
+        state_manager.build_elo_index(state_manager.ratings.elo)
+    names = df[NAME_COLUMN]
+    prefetcher = PairPrefetcher(state_manager, batch_size) if pairing_strategy == 'closest' else None
     while not state_manager.is_stopped():
-        # Preselect the batch of item pairs based on the current expected scores
-        item_pairs = select_closest_pairs(df, state_manager, batch_size=batch_size)
-
-        for item_1, item_2 in item_pairs:
+        # Freeze the items now confidently outside the top k; a prefetched batch might include them, so drop it
+        if focus is not None and len(focus.update()) and prefetcher is not None:
+            prefetcher.discard()
+
+        with profile_stage(state_manager, 'pair selection'):
+            if prefetcher is not None:
+                # Take the batch of closest pairs, prefetched while the last pair of the previous batch was being judged
+                pair_indices = prefetcher.next_batch()
+            else:
+                # Information gain depends on every item's comparison count, so the batch is selected once the last one is judged
+                pair_indices = information_gain_pairs(state_manager, batch_size, item_indices=None if focus is None else focus.active_indices)
+
+        for position, (item_1_index, item_2_index) in enumerate(pair_indices):
             if state_manager.is_stopped():
                 break
 
+            # Start selecting the next batch in the background while the judge decides the last pair
+            if prefetcher is not None and position == len(pair_indices) - 1:
+                prefetcher.prefetch()
+
             # Show the comparison popup
-            create_popup(item_1, item_2, df, state_manager)
+            popup(names.iloc[item_1_index], names.iloc[item_2_index], df, state_manager)
+            if prefetcher is not None:
+                prefetcher.record(item_1_index, item_2_index)
 
             # Increment the comparison count after each comparison
             state_manager.increment_comparison_count()
 
+        if not pair_indices:
+            break  # Fewer than two items, so there is nothing to compare
     print("Item comparisons completed.")
-
-    # Call the function to calculate the rank and Elo changes based on the previous_df
-    df = calculate_rank_and_elo_changes(df, previous_df)
+    if prefetcher is not None:
+        prefetcher.close()
+        if state_manager.verbose:
+            print(f"Prefetched batches: {prefetcher.used_as_is} used as is, {prefetcher.patched} patched, {prefetcher.reselected} selected again.")
+    if window is not None:
+        window.close()
+
+    # Bring the frozen items' expected scores and Elo index entries back up to date before anything is saved
+    if focus is not None:
+        focus.close()
+        state_manager.focus = None
+        print(f"Top {top_k} focus: {focus.num_frozen} of {len(focus.frozen)} items frozen.")
+
+    # Call the function to calculate the rank and Elo changes since the start from the leaderboard, building the DataFrame from the rating store
+    df = calculate_rank_and_elo_changes(df, ratings=state_manager.ratings, leaderboard=leaderboard)
+
+    # Mark the frozen items in the saved rankings, dropping the marks of an earlier focused session if this one was not
+    if focus is not None:
+        df[FROZEN_COLUMN] = focus.frozen
+    else:
+        df = df.drop(columns=[FROZEN_COLUMN], errors='ignore')
 
     return df
 
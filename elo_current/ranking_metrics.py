@@ -0,0 +1,47 @@
+import numpy as np
+
+#########################################################################################################
+# Ranking accuracy metrics
+#########################################################################################################
+# Used to score a ranking against known true strengths, such as in simulations with a synthetic judge.
+
+def kendall_tau(scores_a, scores_b, block_size=1024):
+    """
+    Calculates Kendall's tau-b rank correlation between two sets of scores for the same items:
+    1 if both put the items in the same order, -1 if the orders are reversed, and around 0 if unrelated.
+    Pairs are compared a block of rows at a time, so memory stays at block_size x n.
+
+    :param scores_a: Scores of each item under the first ranking.
+    :param scores_b: Scores of each item under the second ranking, in the same item order.
+    :return: Kendall's tau-b, or NaN if either ranking gives every item the same score.
+    """
+    scores_a = np.asarray(scores_a, dtype=np.float64)
+    scores_b = np.asarray(scores_b, dtype=np.float64)
+    num_items = len(scores_a)
+
+    net_concordant = 0
+    ties_a = 0
+    ties_b = 0
+    for start in range(0, num_items, block_size):
+        stop = min(start + block_size, num_items)
+        signs_a = np.sign(scores_a[start:stop, np.newaxis] - scores_a[np.newaxis, :])
+        signs_b = np.sign(scores_b[start:stop, np.newaxis] - scores_b[np.newaxis, :])
+        net_concordant += (signs_a * signs_b).sum()
+        ties_a += np.count_nonzero(signs_a == 0) - (stop - start)  # Leave out each item paired with itself
+        ties_b += np.count_nonzero(signs_b == 0) - (stop - start)
+
+    # Every pair was counted twice, once from each item's row
+    num_pairs = num_items * (num_items - 1) / 2
+    denominator = np.sqrt((num_pairs - ties_a / 2) * (num_pairs - ties_b / 2))
+    if denominator == 0:
+        return float('nan')
+    return float(net_concordant / 2 / denominator)
+
+def top_k_precision(estimated_scores, true_scores, k):
+    """
+    Returns the fraction of the true top k items that are also in the estimated top k.
+    """
+    k = min(k, len(true_scores))
+    estimated_top = np.argsort(-np.asarray(estimated_scores), kind='stable')[:k]
+    true_top = np.argsort(-np.asarray(true_scores), kind='stable')[:k]
+    return len(np.intersect1d(estimated_top, true_top)) / k
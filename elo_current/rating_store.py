@@ -0,0 +1,61 @@
+import numpy as np
+from user_variables import *
+
+#########################################################################################################
+# In-session rating store
+#########################################################################################################
+
+class RatingStore:
+    """
+    Holds the values that change during a session as contiguous NumPy arrays indexed by row position:
+    - `elo`: Current Elo score of each item.
+    - `comparisons`: Number of comparisons each item has been in.
+    - `elo_change`: Elo change from each item's latest comparison (NaN until it is compared).
+    Comparisons write single array elements here instead of DataFrame cells, and a DataFrame is only
+    rebuilt from the arrays when rankings are calculated, saved or plotted.
+    """
+    __slots__ = ('elo', 'comparisons', 'elo_change')
+
+    def __init__(self, elo, comparisons, elo_change=None):
+        """
+        :param elo: Elo scores of all items, in DataFrame row order.
+        :param comparisons: Comparison counts of all items.
+        :param elo_change: Latest Elo change of each item, or None if no item has been compared yet.
+        """
+        self.elo = np.array(elo, dtype=np.float64)
+        self.comparisons = np.array(comparisons, dtype=np.int64)
+        self.elo_change = np.full(len(self.elo), np.nan) if elo_change is None else np.array(elo_change, dtype=np.float64)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """
+        Builds the store from the Elo, comparisons and (if present) Elo change columns of a DataFrame.
+        """
+        elo_change = df[ELO_CHANGE_COLUMN].to_numpy() if ELO_CHANGE_COLUMN in df.columns else None
+        return cls(df[ELO_COLUMN].to_numpy(), df[COMPARISONS_COLUMN].to_numpy(), elo_change)
+
+    def __len__(self):
+        return len(self.elo)
+
+    def add_items(self, num_items, elo=STANDARD_ELO, comparisons=0):
+        """
+        Appends new items with the given Elo scores and comparison counts (one value for all of them, or one per item).
+        """
+        self.elo = np.append(self.elo, np.full(num_items, elo, dtype=np.float64))
+        self.comparisons = np.append(self.comparisons, np.full(num_items, comparisons, dtype=np.int64))
+        self.elo_change = np.append(self.elo_change, np.full(num_items, np.nan))
+
+    def to_dataframe(self, df, include_elo_change=True):
+        """
+        Returns a copy of the DataFrame with the Elo, comparisons and Elo change columns replaced by the stored values.
+        The Elo change column is only added once at least one item has been compared.
+
+        :param include_elo_change: If False, the DataFrame's own Elo change column (such as the session-wide
+                                   changes from calculate_rank_and_elo_changes) is left as it is.
+        """
+        df = df.copy()
+        df[ELO_COLUMN] = self.elo
+        df[COMPARISONS_COLUMN] = self.comparisons
+        if include_elo_change and (ELO_CHANGE_COLUMN in df.columns or not np.isnan(self.elo_change).all()):
+            df[ELO_CHANGE_COLUMN] = self.elo_change
+        return df
@@ -0,0 +1,220 @@
+import argparse
+import contextlib
+import io
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from user_variables import *
+from state_manager import StateManager
+from file_handling import initialise_item_state
+from popup_architecture import run_iterations, update_score
+from ranking_metrics import kendall_tau, top_k_precision
+
+#########################################################################################################
+# Parameter sweep simulator
+#########################################################################################################
+# Runs the real comparison loop (run_iterations) with the popup replaced by a synthetic judge that decides
+# each comparison from hidden true strengths. Every combination of K-factor, batch_size and phase 1 n is run
+# for several replicates across a process pool, and the final rankings are scored against the true strengths.
+#
+# Seeding is deterministic per task rather than per worker process: replicate r always uses the same hidden
+# strengths for every parameter combination, and the judge's random draws come from a seed made from
+# (seed, replicate, combination). The results do not depend on the number of processes or the task order.
+
+def make_simulated_items(num_items, rng, strength_spread=200):
+    """
+    Creates a DataFrame of unrated items at the standard Elo score, along with their hidden true strengths.
+
+    :param num_items: Number of items to create.
+    :param rng: NumPy random Generator used to draw the true strengths.
+    :param strength_spread: Standard deviation of the true strengths, on the Elo scale.
+    :return: The DataFrame and an array of true strengths in row order.
+    """
+    true_strengths = rng.normal(STANDARD_ELO, strength_spread, num_items)
+    df = pd.DataFrame({
+        NAME_COLUMN: [f"Item {i}" for i in range(num_items)],
+        ELO_COLUMN: float(STANDARD_ELO),
+        COMPARISONS_COLUMN: 0,
+    })
+    return df, true_strengths
+
+class SimulatedJudge:
+    """
+    Stands in for create_popup: decides each comparison from the items' true strengths with the Elo win
+    probability, applies it with update_score, and stops the session once max_comparisons have been made.
+    """
+    def __init__(self, true_strengths, rng, max_comparisons, draw_probability=0.0, noise_sd=0.0, checkpoint_every=None, top_k=10):
+        """
+        :param true_strengths: Array of hidden true strengths in DataFrame row order.
+        :param rng: NumPy random Generator for the judge's decisions.
+        :param max_comparisons: Number of comparisons after which the session is stopped.
+        :param draw_probability: Probability that any comparison is judged a draw.
+        :param noise_sd: Standard deviation of the judge's error in perceiving each strength gap, on the Elo scale.
+        :param checkpoint_every: Record the ranking accuracy every this many comparisons (None to only score the end).
+        :param top_k: k used for the top-k precision recorded at each checkpoint.
+        """
+        self.true_strengths = true_strengths
+        self.rng = rng
+        self.max_comparisons = max_comparisons
+        self.draw_probability = draw_probability
+        self.noise_sd = noise_sd
+        self.checkpoint_every = checkpoint_every
+        self.top_k = top_k
+        self.checkpoints = []  # (comparisons used, Kendall's tau, top-k precision) entries
+
+    def __call__(self, item_1, item_2, df, state_manager):
+        item_1_index = state_manager.name_index[item_1]
+        item_2_index = state_manager.name_index[item_2]
+
+        # Item 1 wins with the Elo probability implied by the true strengths, as the judge perceives them
+        if self.rng.random() < self.draw_probability:
+            item_1_score = 0.5
+        else:
+            strength_gap = self.true_strengths[item_1_index] - self.true_strengths[item_2_index]
+            if self.noise_sd:
+                strength_gap += self.rng.normal(0, self.noise_sd)
+            win_probability = 1 / (1 + 10 ** (-strength_gap / 400))
+            item_1_score = 1 if self.rng.random() < win_probability else 0
+        update_score(item_1, item_2, item_1_score, 1 - item_1_score, None, df, state_manager)
+
+        # run_iterations counts the comparison once this returns
+        comparisons_used = state_manager.comparison_count + 1
+        if self.checkpoint_every and comparisons_used % self.checkpoint_every == 0:
+            elo_scores = state_manager.ratings.elo
+            self.checkpoints.append((comparisons_used, kendall_tau(elo_scores, self.true_strengths),
+                                     top_k_precision(elo_scores, self.true_strengths, self.top_k)))
+        if comparisons_used >= self.max_comparisons:
+            state_manager.stop()
+
+def run_simulation(task):
+    """
+    Runs one simulated session and scores the final ranking against the hidden true strengths.
+
+    :param task: Dictionary of the session settings, as built by run_sweep.
+    :return: Dictionary of the settings, the accuracy metrics and the accuracy checkpoints.
+    """
+    start = time.perf_counter()
+    item_rng = np.random.default_rng(np.random.SeedSequence(task['seed'], spawn_key=(task['replicate'],)))
+    judge_seed = np.random.SeedSequence(task['seed'], spawn_key=(task['replicate'], task['combination']))
+    judge_rng = np.random.default_rng(judge_seed)
+    random.seed(int(judge_seed.generate_state(1)[0]))  # Phase 1 pairings use the random module
+
+    df, true_strengths = make_simulated_items(task['num_items'], item_rng, task['strength_spread'])
+    judge = SimulatedJudge(true_strengths, judge_rng, task['max_comparisons'], task['draw_probability'], task['noise_sd'],
+                           task['checkpoint_every'], task['top_k'])
+
+    state_manager = StateManager(expected_score_backend='implicit', k_factor=task['k_factor'], verbose=False)
+    initialise_item_state(df, state_manager)
+    state_manager.set_expected_scores_from_elo(state_manager.ratings.elo)
+
+    # Silence the loop's progress messages so parallel workers do not interleave their output
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_iterations(df, state_manager, batch_size=task['batch_size'], n=task['n'], popup=judge, pairing_strategy=task['pairing_strategy'],
+                       top_k=task['focus_top_k'])
+
+    final_elo = state_manager.ratings.elo
+    return {
+        'k_factor': task['k_factor'],
+        'batch_size': task['batch_size'],
+        'n': task['n'],
+        'combination': task['combination'],
+        'replicate': task['replicate'],
+        'comparisons': state_manager.comparison_count,
+        'kendall_tau': kendall_tau(final_elo, true_strengths),
+        'top_k_precision': top_k_precision(final_elo, true_strengths, task['top_k']),
+        'seconds': time.perf_counter() - start,
+        'checkpoints': judge.checkpoints,
+    }
+
+def run_sweep(k_factors, batch_sizes, ns, num_replicates=8, num_items=100, max_comparisons=1000, seed=0,
+              draw_probability=0.0, noise_sd=0.0, strength_spread=200, checkpoint_every=None, top_k=10, processes=None,
+              pairing_strategy=PAIRING_STRATEGY, focus=False):
+    """
+    Runs every combination of K-factor, batch_size and phase 1 n for num_replicates simulated sessions
+    across a pool of processes.
+
+    :param processes: Number of worker processes (defaults to every core).
+    :param pairing_strategy: How run_iterations selects the phase 2 pairs in every session.
+    :param focus: Run every session in top-K focus mode with k = top_k.
+    :return: A DataFrame with one row per session, and a DataFrame of the accuracy checkpoints.
+    """
+    combinations = list(itertools.product(k_factors, batch_sizes, ns))
+    tasks = [{'k_factor': k_factor, 'batch_size': batch_size, 'n': n, 'replicate': replicate, 'combination': combination,
+              'num_items': num_items, 'max_comparisons': max_comparisons, 'seed': seed, 'draw_probability': draw_probability, 'noise_sd': noise_sd,
+              'strength_spread': strength_spread, 'checkpoint_every': checkpoint_every, 'top_k': top_k, 'pairing_strategy': pairing_strategy,
+              'focus_top_k': top_k if focus else None}
+             for combination, (k_factor, batch_size, n) in enumerate(combinations)
+             for replicate in range(num_replicates)]
+
+    print(f"Running {len(tasks)} simulations ({len(combinations)} combinations x {num_replicates} replicates)...")
+    return run_simulations(tasks, processes)
+
+def run_simulations(tasks, processes=None):
+    """
+    Runs simulated sessions across a pool of processes, in task order.
+
+    :param processes: Number of worker processes (defaults to every core).
+    :return: A DataFrame with one row per session, and a DataFrame of the accuracy checkpoints.
+    """
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        results = list(pool.map(run_simulation, tasks, chunksize=max(1, len(tasks) // (4 * processes))))
+
+    checkpoints = pd.DataFrame(
+        [(result['k_factor'], result['batch_size'], result['n'], result['combination'], result['replicate'], *checkpoint)
+         for result in results for checkpoint in result.pop('checkpoints')],
+        columns=['k_factor', 'batch_size', 'n', 'combination', 'replicate', 'comparisons', 'kendall_tau', 'top_k_precision'])
+    return pd.DataFrame(results), checkpoints
+
+def summarise_sweep(results):
+    """
+    Averages the accuracy of each parameter combination over its replicates, best Kendall's tau first.
+    """
+    summary = results.groupby(['k_factor', 'batch_size', 'n']).agg(
+        comparisons=('comparisons', 'mean'),
+        kendall_tau=('kendall_tau', 'mean'),
+        kendall_tau_std=('kendall_tau', 'std'),
+        top_k_precision=('top_k_precision', 'mean'),
+        seconds=('seconds', 'mean'),
+    )
+    return summary.sort_values('kendall_tau', ascending=False).reset_index()
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate comparison sessions with a synthetic judge to tune K_FACTOR, batch_size and n.")
+    parser.add_argument('--k-factors', type=float, nargs='+', default=[16, 24, 32, 48, 64], help="K-factors to try.")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 5, 10, 20], help="Phase 2 batch sizes to try.")
+    parser.add_argument('--ns', type=int, nargs='+', default=[1, 2, 4], help="Phase 1 minimum comparisons per item to try.")
+    parser.add_argument('--replicates', type=int, default=8, help="Simulated sessions per combination.")
+    parser.add_argument('--items', type=int, default=100, help="Number of items in each simulated catalogue.")
+    parser.add_argument('--comparisons', type=int, default=1000, help="Comparisons made in each simulated session.")
+    parser.add_argument('--draw-probability', type=float, default=0.0, help="Probability that the judge calls a draw.")
+    parser.add_argument('--noise-sd', type=float, default=0.0, help="Standard deviation of the judge's error in perceiving strength gaps.")
+    parser.add_argument('--strength-spread', type=float, default=200, help="Standard deviation of the hidden true strengths.")
+    parser.add_argument('--checkpoint-every', type=int, default=None, help="Record accuracy every this many comparisons.")
+    parser.add_argument('--top-k', type=int, default=10, help="k used for top-k precision.")
+    parser.add_argument('--pairing-strategy', default=PAIRING_STRATEGY, choices=['closest', 'information_gain'], help="How phase 2 pairs are selected.")
+    parser.add_argument('--focus', action='store_true', help="Run every session in top-K focus mode with k = --top-k.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed all simulations are derived from.")
+    parser.add_argument('--processes', type=int, default=None, help="Worker processes (defaults to every core).")
+    parser.add_argument('--output', default=None, help="CSV file to save the per-session results to.")
+    parser.add_argument('--checkpoint-output', default=None, help="CSV file to save the accuracy checkpoints to.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results, checkpoints = run_sweep(args.k_factors, args.batch_sizes, args.ns, args.replicates, args.items, args.comparisons, args.seed,
+                                     args.draw_probability, args.noise_sd, args.strength_spread, args.checkpoint_every, args.top_k, args.processes,
+                                     args.pairing_strategy, args.focus)
+    print(f"Finished in {time.perf_counter() - start:.1f}s.\n")
+    print(summarise_sweep(results).to_string(index=False, float_format='{:.3f}'.format))
+
+    if args.output:
+        results.to_csv(args.output, index=False)
+    if args.checkpoint_output:
+        checkpoints.to_csv(args.checkpoint_output, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import contextlib
+import csv
+import json
+import os
+import time
+import numpy as np
+from user_variables import *
+
+#########################################################################################################
+# Stage profiler
+#########################################################################################################
+# Opt-in timings of the stages a session goes through (main() steps, pair selection, update_score,
+# update_expected_scores_matrix, select_closest_pairs and drawing each pair), used to tell whether a slow
+# session is the judge thinking or the code working. Every time is taken with time.perf_counter, which is
+# monotonic. The time from a pair being on screen to the judge's decision is recorded as its own 'human
+# decision' stage and never counted as system time, so the report can split the comparison loop's wall time
+# into human decision time and system overhead.
+#
+# Each stage keeps its latest PROFILE_BUFFER_SIZE durations in a preallocated NumPy ring buffer, so recording
+# is one array write and memory stays fixed however long the session runs; counts, totals and maxima cover
+# every call. Percentiles and latency histograms are calculated from the buffers only when the report is
+# written. When profiling is off (state_manager.profiler is None) each stage costs one attribute check.
+
+PROFILE_JSON_FILE = 'stage_profile.json'
+PROFILE_CSV_FILE = 'stage_profile.csv'
+HUMAN_STAGES = ('human decision',)  # Stages timing the judge rather than the code
+SESSION_STAGE = 'main: run comparisons'  # Stage whose wall time is split into human decision time and system overhead
+HISTOGRAM_EDGES_MS = np.logspace(-3, 5, 17)  # Latency histogram bin edges, from 1 microsecond to 100 seconds, two bins per decade
+
+class RingBuffer:
+    """
+    The latest `capacity` durations of one stage, with the count, total and maximum of every duration recorded.
+    """
+    def __init__(self, capacity=PROFILE_BUFFER_SIZE):
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.values[self.count % len(self.values)] = seconds
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def recent(self):
+        """
+        Returns the durations still held, oldest first.
+        """
+        if self.count <= len(self.values):
+            return self.values[:self.count]
+        start = self.count % len(self.values)
+        return np.concatenate([self.values[start:], self.values[:start]])
+
+class _StageTimer:
+    """
+    Context manager recording the time spent inside it against a stage.
+    """
+    __slots__ = ('buffer', 'start')
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.buffer.add(time.perf_counter() - self.start)
+        return False
+
+class StageProfiler:
+    """
+    Records how long each named stage takes. Attach one to state_manager.profiler to profile a session.
+    """
+    def __init__(self, capacity=PROFILE_BUFFER_SIZE):
+        """
+        :param capacity: Number of the latest durations each stage keeps for percentiles and histograms.
+        """
+        self.capacity = capacity
+        self.stages = {}  # Stage name -> RingBuffer, in the order the stages were first recorded
+
+    def buffer(self, stage):
+        buffer = self.stages.get(stage)
+        if buffer is None:
+            buffer = self.stages[stage] = RingBuffer(self.capacity)
+        return buffer
+
+    def record(self, stage, seconds):
+        self.buffer(stage).add(seconds)
+
+    def stage(self, stage):
+        """
+        Returns a context manager that records the time spent inside it against a stage.
+        """
+        return _StageTimer(self.buffer(stage))
+
+    def summary(self):
+        """
+        Returns one dictionary per stage with its count, total, mean, maximum, percentiles and latency
+        histogram. Percentiles and histograms cover the durations still held in the ring buffer.
+        """
+        rows = []
+        for stage, buffer in self.stages.items():
+            recent_ms = buffer.recent() * 1000
+            p50, p90, p99 = np.percentile(recent_ms, [50, 90, 99]) if len(recent_ms) else (np.nan, np.nan, np.nan)
+            counts, _ = np.histogram(np.clip(recent_ms, HISTOGRAM_EDGES_MS[0], HISTOGRAM_EDGES_MS[-1]), bins=HISTOGRAM_EDGES_MS)
+            rows.append({'stage': stage, 'kind': 'human' if stage in HUMAN_STAGES else 'system', 'count': buffer.count,
+                         'total_s': buffer.total, 'mean_ms': 1000 * buffer.total / buffer.count if buffer.count else np.nan,
+                         'p50_ms': float(p50), 'p90_ms': float(p90), 'p99_ms': float(p99), 'max_ms': 1000 * buffer.max,
+                         'samples': len(recent_ms), 'histogram_counts': counts.tolist()})
+        return rows
+
+    def session_split(self):
+        """
+        Splits the comparison loop's wall time into the judge's decision time and everything else.
+
+        :return: Dictionary of wall_s, human_decision_s, system_overhead_s and the number of decisions, or None
+                 if the loop was not timed.
+        """
+        if SESSION_STAGE not in self.stages:
+            return None
+        wall = self.stages[SESSION_STAGE].total
+        human = sum(self.stages[stage].total for stage in HUMAN_STAGES if stage in self.stages)
+        return {'wall_s': wall, 'human_decision_s': human, 'system_overhead_s': wall - human,
+                'decisions': self.stages['human decision'].count if 'human decision' in self.stages else 0}
+
+    def save(self, directory):
+        """
+        Writes the report to PROFILE_JSON_FILE (every stage's summary and histogram, and the session split) and
+        PROFILE_CSV_FILE (one row per stage) in a directory, and prints the session split.
+
+        :return: The paths of both files.
+        """
+        rows = self.summary()
+        session = self.session_split()
+        json_path = os.path.join(directory, PROFILE_JSON_FILE)
+        csv_path = os.path.join(directory, PROFILE_CSV_FILE)
+        with open(json_path, 'w') as file:
+            json.dump({'session': session, 'histogram_edges_ms': HISTOGRAM_EDGES_MS.tolist(), 'stages': rows}, file, indent=2)
+        with open(csv_path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=[key for key in rows[0] if key != 'histogram_counts'] if rows else ['stage'],
+                                    extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+
+        if session is not None and session['decisions']:
+            print(f"Session of {session['wall_s']:.1f}s: {session['human_decision_s']:.1f}s deciding, "
+                  f"{session['system_overhead_s']:.2f}s system overhead "
+                  f"({1000 * session['system_overhead_s'] / session['decisions']:.1f} ms per decision).")
+        print(f"Saved stage profile to {json_path} and {csv_path}.")
+        return json_path, csv_path
+
+_NOT_PROFILED = contextlib.nullcontext()
+
+def profile_stage(state_manager, stage):
+    """
+    Returns a context manager timing a stage on the StateManager's profiler, which does nothing if it has none.
+    """
+    profiler = state_manager.profiler
+    return _NOT_PROFILED if profiler is None else profiler.stage(stage)
+
+def record_stage(state_manager, stage, start, end=None):
+    """
+    Records the time from start to end (defaults to now), both time.perf_counter values, against a stage on
+    the StateManager's profiler, if it has one.
+    """
+    profiler = state_manager.profiler
+    if profiler is not None:
+        profiler.record(stage, (time.perf_counter() if end is None else end) - start)
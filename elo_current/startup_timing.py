@@ -0,0 +1,59 @@
+import time
+
+#########################################################################################################
+# Startup timing
+#########################################################################################################
+# Measures how long main.py takes to get the first pair on screen, split into the stages it passes through.
+# Each mark adds the time since the previous mark to a stage, so a stage marked more than once (such as the
+# imports, which are spread over the stages that need them) is reported as one total. Times use
+# time.perf_counter and start when main.py is first imported, so they leave out the Python interpreter's own
+# startup.
+
+class StartupTimer:
+    """
+    Adds up the time spent in each named startup stage, in the order the stages were first marked.
+    """
+    def __init__(self, start=None):
+        """
+        :param start: time.perf_counter value the startup began at (defaults to now).
+        """
+        self.start = time.perf_counter() if start is None else start
+        self.last_mark = self.start
+        self.stages = {}  # Stage name -> seconds spent in it
+        self.reported = False
+
+    def mark(self, stage):
+        """
+        Adds the time since the previous mark to a stage.
+        """
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last_mark
+        self.last_mark = now
+
+    def report(self):
+        """
+        Prints the time spent in each stage and the total time since the start, once.
+        """
+        if self.reported:
+            return
+        self.reported = True
+        total = self.last_mark - self.start
+        print(f"Startup took {total:.2f}s to the first pair on screen:")
+        for stage, seconds in self.stages.items():
+            print(f"  {stage}: {seconds:.3f}s ({100 * seconds / total if total else 0:.0f}%)")
+
+def mark_startup(state_manager, stage):
+    """
+    Marks a startup stage on the StateManager's startup timer, if it has one.
+    """
+    if state_manager.startup_timer is not None:
+        state_manager.startup_timer.mark(stage)
+
+def report_first_pair_shown(state_manager):
+    """
+    Marks the first pair as on screen and prints the startup report, then stops timing the startup.
+    """
+    if state_manager.startup_timer is not None:
+        state_manager.startup_timer.mark('first pair on screen')
+        state_manager.startup_timer.report()
+        state_manager.startup_timer = None
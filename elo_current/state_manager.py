@@ -1,4 +1,10 @@
+import threading
+from collections import deque
 import numpy as np
+from user_variables import EXPECTED_SCORE_BACKEND, K_FACTOR, PAIR_RECENCY_HALF_LIFE
+from expected_scores import DenseExpectedScores, EXPECTED_SCORE_BACKENDS
+from elo_index import SortedEloIndex
+from pair_outcomes import PairOutcomeStore
 
 class StateManager:
     """
@@ -7,8 +13,9 @@ class StateManager:
     This class encapsulates two key state variables: 
     - `comparison_count`: Tracks how many comparisons have been made.
     - `stop_flag`: Controls when to stop the comparison loop.
+    It also holds the expected scores between items, either as a dense matrix or calculated on demand.
     """
-    def __init__(self):
+    def __init__(self, expected_score_backend=EXPECTED_SCORE_BACKEND, k_factor=K_FACTOR, verbose=True):
         """
         Initializes the StateManager class.
         
@@ -17,12 +24,108 @@ class StateManager:
           Initialized to 0.
         - `stop_flag` (bool): A flag to indicate whether the comparison process should stop.
           Initialized to False, meaning the process will continue running until explicitly stopped.
+
+        :param expected_score_backend: 'dense' to store the full expected score matrix, or 'implicit' to
+                                       calculate expected scores on demand from the Elo scores.
+        :param k_factor: The K-factor used for every Elo update made in this session.
+        :param verbose: Print the Elo changes of every comparison (turned off for simulations).
         """
         self.comparison_count = 0
         self.stop_flag = False
+        self.k_factor = k_factor
+        self.verbose = verbose
+
+        if expected_score_backend not in EXPECTED_SCORE_BACKENDS:
+            raise ValueError(f"Unknown expected score backend '{expected_score_backend}', expected one of {list(EXPECTED_SCORE_BACKENDS)}.")
+        self.expected_score_backend = expected_score_backend
+        self.expected_scores = None  # Initialise this later
+        self.elo_index = None  # Items sorted by Elo score, built once the Elo scores are known
+        self.name_index = {}  # Maps each item name to its row position in the DataFrame
+        self.ratings = None  # In-session Elo scores and comparison counts, built from the DataFrame when it is loaded
+        self.journal = None  # Append-only record of every comparison, opened when the data is loaded
+        self.lock = threading.RLock()  # Held while ratings change, so pairs selected on another thread see a consistent state
+        self.pair_outcomes = PairOutcomeStore()  # Wins, losses and draws of every pair compared, saved with each snapshot
+        self.recent_pairs = deque(maxlen=8 * PAIR_RECENCY_HALF_LIFE)  # (comparison_count, lower_index, higher_index) of recent comparisons
+        self.focus = None  # TopKFocus tracking the items still in play while run_iterations focuses on the top K
+        self.startup_timer = None  # StartupTimer timing main.py until the first pair is on screen
+        self.profiler = None  # StageProfiler timing each stage of the session when PROFILE_STAGES is on
+
+    @property
+    def expected_score_matrix(self):
+        """
+        The expected score matrix as a NumPy array. The implicit backend builds it on request.
+        """
+        return None if self.expected_scores is None else self.expected_scores.to_array()
+
+    @expected_score_matrix.setter
+    def expected_score_matrix(self, matrix):
+        self.expected_scores = DenseExpectedScores(matrix)
 
-        self.expected_score_matrix = None  # Initialise this later
+    def set_expected_scores_from_elo(self, elo_scores):
+        """
+        Initializes the expected scores from a vector of Elo scores using the configured backend.
+        :param elo_scores: Elo scores of all items, in DataFrame row order.
+        """
+        self.expected_scores = EXPECTED_SCORE_BACKENDS[self.expected_score_backend].from_elo(elo_scores)
     
+    def build_name_index(self, names):
+        """
+        Builds the name to row position dictionary used for all item lookups during comparisons.
+        :param names: Item names, in DataFrame row order.
+        :raises ValueError: If any name appears more than once, since lookups by name would be ambiguous.
+        """
+        name_index = {}
+        duplicates = []
+        for position, name in enumerate(names):
+            if name in name_index:
+                duplicates.append(name)
+            name_index[name] = position
+        if duplicates:
+            raise ValueError(f"Item names must be unique, found duplicates: {sorted(set(map(str, duplicates)))}")
+        self.name_index = name_index
+
+    def add_item_names(self, names):
+        """
+        Adds new items to the end of the name index, keeping it valid when items are appended to the DataFrame.
+        :param names: Names of the new items, in the order they are appended.
+        :return: The row positions assigned to the new items.
+        :raises ValueError: If a name is already in use or repeated in the new names.
+        """
+        names = list(names)
+        duplicates = [name for name in names if name in self.name_index]
+        if duplicates or len(set(names)) != len(names):
+            raise ValueError(f"Item names must be unique, cannot add: {sorted(set(map(str, duplicates or names)))}")
+        start = len(self.name_index)
+        for offset, name in enumerate(names):
+            self.name_index[name] = start + offset
+        return list(range(start, start + len(names)))
+
+    def build_elo_index(self, elo_scores):
+        """
+        Builds the sorted Elo index used to find the closest pairs without scanning the expected scores.
+        :param elo_scores: Elo scores of all items, in DataFrame row order.
+        """
+        self.elo_index = SortedEloIndex(elo_scores)
+    
+    def refresh_items(self, item_indices, rebuild_fraction=0.25):
+        """
+        Brings the expected scores and sorted Elo index up to date after the Elo scores of several items
+        have changed in the rating store. If most items changed it is cheaper to rebuild both from scratch.
+        :param item_indices: Row positions of the items whose Elo scores changed.
+        :param rebuild_fraction: Fraction of all items above which everything is rebuilt.
+        """
+        item_indices = np.unique(np.asarray(list(item_indices), dtype=np.int64))
+        if len(item_indices) == 0:
+            return
+        if len(item_indices) > rebuild_fraction * len(self.ratings):
+            self.set_expected_scores_from_elo(self.ratings.elo)
+            self.build_elo_index(self.ratings.elo)
+            return
+        self.expected_scores.update_items(item_indices, self.ratings.elo)
+        if self.elo_index is not None:
+            for item_index in item_indices.tolist():
+                self.elo_index.update(item_index, self.ratings.elo[item_index])
+
     def set_expected_score_matrix(self, num_items):
         """
         Initializes the expected score matrix with default values once the number of items is known.
@@ -32,15 +135,24 @@ class StateManager:
     
     def load_expected_score_matrix(self, file_path):
         """
-        Load the expected score matrix from a CSV file.
+        Load the expected score matrix from a memory-mapped .npy file (or a legacy CSV file).
         """
-        self.expected_score_matrix = np.loadtxt(file_path, delimiter=',')
+        self.expected_scores = DenseExpectedScores.load(file_path)
     
-    def save_expected_score_matrix(self, file_path):
+    def save_expected_score_matrix(self, file_path, order=None):
+        """
+        Save the expected score matrix to a .npy file (the implicit backend has nothing to save).
+        :param order: Optional row positions giving the order the items are saved in.
+        """
+        self.expected_scores.save(file_path, order)
+
+    def close_journal(self):
         """
-        Save the expected score matrix to a CSV file.
+        Syncs and closes the comparison journal if one is open.
         """
-        np.savetxt(file_path, self.expected_score_matrix, delimiter=',')
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
 
     def increment_comparison_count(self):
         """
@@ -0,0 +1,121 @@
+import argparse
+import random
+import threading
+import time
+import numpy as np
+from user_variables import *
+from state_manager import StateManager
+from file_handling import initialise_item_state
+from simulation import make_simulated_items
+from popup_architecture import update_score
+from pair_scheduler import PairScheduler
+
+#########################################################################################################
+# Pair scheduler stress test
+#########################################################################################################
+# Many judge threads lease pairs, think for a random time and then submit a result, give the pair back, or
+# abandon it so the lease expires. After every lease the open leases are checked to never share an item.
+# Once the judges finish, the results that were accepted are replayed one at a time on a fresh copy of the
+# catalogue: if any concurrent update had been lost or applied to stale ratings, the Elo scores would differ.
+
+def build_state(num_items, seed):
+    """
+    Builds a StateManager for a synthetic catalogue.
+    """
+    df, _ = make_simulated_items(num_items, np.random.default_rng(seed))
+    state_manager = StateManager(expected_score_backend='implicit', verbose=False)
+    initialise_item_state(df, state_manager)
+    state_manager.set_expected_scores_from_elo(state_manager.ratings.elo)
+    return df, state_manager
+
+def check_disjoint(scheduler):
+    """
+    Raises an AssertionError if an item is in two open leases.
+    """
+    with scheduler.lock:
+        items = [item for lease in scheduler.leases.values() for item in (lease.item_1, lease.item_2)]
+        assert len(items) == len(set(items)), "an item is in two open leases"
+
+def judge(scheduler, judge_id, num_leases, max_think_seconds, accepted, counts, seed):
+    """
+    Runs one judge thread: leases pairs and submits, releases or abandons each one.
+    """
+    rng = random.Random(seed)
+    for _ in range(num_leases):
+        lease = scheduler.lease(judge_id)
+        if lease is None:
+            with scheduler.lock:
+                counts['unavailable'] += 1
+            continue
+        check_disjoint(scheduler)
+        time.sleep(rng.uniform(0, max_think_seconds))
+
+        action = rng.random()
+        if action < 0.8:
+            item_1_score = rng.choice([1, 0, 0.5])
+            # Hold the scheduler's lock so the accepted results are recorded in the order they were applied
+            with scheduler.lock:
+                if scheduler.submit(lease.lease_id, item_1_score):
+                    accepted.append((lease.item_1, lease.item_2, item_1_score))
+                else:
+                    counts['rejected'] += 1
+        elif action < 0.9:
+            scheduler.release(lease.lease_id)
+        # Otherwise the judge abandons the pair and the lease expires
+
+def run_stress(num_items, num_judges, leases_per_judge, lease_seconds, max_think_seconds, n, seed):
+    """
+    Runs the judges concurrently, then checks that every accepted result was applied exactly once.
+
+    :return: A dictionary of counts and the largest Elo difference from the sequential replay.
+    """
+    df, state_manager = build_state(num_items, seed)
+    scheduler = PairScheduler(df, state_manager, n=n, lease_seconds=lease_seconds, seed=seed)
+    initial_elo_sum = float(state_manager.ratings.elo.sum())
+    accepted = []
+    counts = {'unavailable': 0, 'rejected': 0}
+
+    threads = [threading.Thread(target=judge, args=(scheduler, judge_id, leases_per_judge, max_think_seconds, accepted, counts, seed + judge_id))
+               for judge_id in range(num_judges)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    ratings = state_manager.ratings
+    assert scheduler.results_applied == len(accepted) == state_manager.comparison_count, "a submitted result was lost"
+    assert ratings.comparisons.sum() - df[COMPARISONS_COLUMN].sum() == 2 * len(accepted), "comparison counts do not match the results"
+    assert np.isclose(ratings.elo.sum(), initial_elo_sum), "Elo updates were not zero-sum"
+    assert all(state_manager.elo_index.elo_by_item[i] == elo for i, elo in enumerate(ratings.elo)), "the sorted Elo index is out of date"
+
+    # Replay the accepted results one at a time on a fresh copy of the catalogue
+    replay_df, replay_state = build_state(num_items, seed)
+    for item_1, item_2, item_1_score in accepted:
+        update_score(item_1, item_2, item_1_score, 1 - item_1_score, None, replay_df, replay_state)
+    max_difference = float(np.abs(replay_state.ratings.elo - ratings.elo).max())
+    assert max_difference == 0, "the concurrent results differ from applying them one at a time"
+
+    return {'results_applied': scheduler.results_applied, 'rejected_late': counts['rejected'], 'unavailable': counts['unavailable'],
+            'leases_expired': scheduler.leases_expired, 'open_leases': len(scheduler.leases), 'seconds': elapsed,
+            'max_elo_difference': max_difference}
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test the pair scheduler with many concurrent judge threads.")
+    parser.add_argument('--items', type=int, default=200, help="Number of items in the synthetic catalogue.")
+    parser.add_argument('--judges', type=int, default=64, help="Number of concurrent judge threads.")
+    parser.add_argument('--leases', type=int, default=200, help="Pairs each judge leases.")
+    parser.add_argument('--lease-seconds', type=float, default=0.008, help="Seconds before an unanswered lease expires.")
+    parser.add_argument('--think-seconds', type=float, default=0.005, help="Longest time a judge takes to answer.")
+    parser.add_argument('--n', type=int, default=2, help="Minimum comparisons per item from random pairs first.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the catalogue and the judges.")
+    args = parser.parse_args()
+
+    result = run_stress(args.items, args.judges, args.leases, args.lease_seconds, args.think_seconds, args.n, args.seed)
+    print(f"{args.judges} judges applied {result['results_applied']} results in {result['seconds']:.1f}s with no lost updates "
+          f"({result['rejected_late']} late results rejected, {result['leases_expired']} leases expired, "
+          f"{result['unavailable']} requests found no free pair).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import numpy as np
+from user_variables import *
+from information_gain import item_variances, ELO_SCALE
+
+#########################################################################################################
+# Top-K focus mode
+#########################################################################################################
+# When only the head of the ranking matters, items that are confidently outside the top K are frozen: they
+# are no longer paired, they are taken out of the sorted Elo index so closest pair selection only walks the
+# items still in play, and their expected scores are no longer kept up to date. An item is frozen once its
+# Elo score is more than FOCUS_CONFIDENCE_Z standard deviations of the gap below the K-th highest active item.
+# Each item's variance is the information gain pairing variance, which shrinks with every comparison, plus
+# the K / (2q) noise an Elo score updated with a fixed K-factor keeps however often it is compared; without
+# that floor, items in pairs compared over and over look far more certain than they are. Frozen items never
+# come back during the session, so each check only looks at the items still active.
+#
+# While items are frozen, each comparison only recalculates the expected scores of the two items against the
+# active items, so upkeep scales with the active block rather than the whole catalogue. The rows left out of
+# date are recalculated once when the focus ends.
+
+class TopKFocus:
+    """
+    Tracks which items are still in play for the top k during one run of the comparison loop.
+
+    - `frozen`: Boolean array, True for items frozen outside the top k.
+    - `active_indices`: Sorted row positions of the items still in play.
+    - `stale_items`: Items whose expected scores against frozen items have not been updated.
+    """
+    def __init__(self, state_manager, k, z=FOCUS_CONFIDENCE_Z, prior_sd=ELO_PRIOR_SD):
+        """
+        :param state_manager: Instance of StateManager, containing the rating store and sorted Elo index.
+        :param k: Number of items at the top of the ranking that matter.
+        :param z: Standard deviations of the Elo gap to the k-th item beyond which an item is frozen.
+        :param prior_sd: Uncertainty of an uncompared item's Elo score.
+        """
+        if k < 1:
+            raise ValueError(f"The focus needs at least one item at the top of the ranking, got k={k}.")
+        self.state_manager = state_manager
+        self.k = k
+        self.z = z
+        self.prior_sd = prior_sd
+        num_items = len(state_manager.ratings)
+        self.frozen = np.zeros(num_items, dtype=bool)
+        self.active_indices = np.arange(num_items)
+        self.stale_items = set()
+
+    @property
+    def num_frozen(self):
+        return len(self.frozen) - len(self.active_indices)
+
+    def update(self):
+        """
+        Freezes every active item whose Elo score is confidently below the k-th highest active item, and
+        removes them from the sorted Elo index.
+
+        :return: Row positions of the newly frozen items.
+        """
+        state_manager = self.state_manager
+        ratings = state_manager.ratings
+        with state_manager.lock:
+            active = self.active_indices
+            if len(active) <= self.k:
+                return active[:0]
+
+            # Compare each active item with the k-th highest, in standard deviations of the gap between them
+            elo = ratings.elo[active]
+            variances = item_variances(ratings.comparisons[active], self.prior_sd) + state_manager.k_factor / (2 * ELO_SCALE)
+            kth = np.argpartition(-elo, self.k - 1)[self.k - 1]
+            margins = (elo[kth] - elo) / np.sqrt(variances + variances[kth])
+            newly_frozen = active[margins > self.z]
+
+            if len(newly_frozen):
+                self.frozen[newly_frozen] = True
+                self.active_indices = active[margins <= self.z]
+                if state_manager.elo_index is not None:
+                    for item_index in newly_frozen.tolist():
+                        state_manager.elo_index.remove(item_index)
+        return newly_frozen
+
+    def expected_score_columns(self, item_indices):
+        """
+        Returns the items whose expected scores against the given items need recalculating after a
+        comparison: the active items, or None for every item while at least half the items are active (a
+        full row is cheaper to write than a scattered one). The given items are remembered as stale so their
+        remaining expected scores are recalculated when the focus ends.
+        """
+        if 2 * len(self.active_indices) >= len(self.frozen):
+            return None
+        self.stale_items.update(item_indices)
+        return self.active_indices
+
+    def close(self):
+        """
+        Ends the focus: puts the frozen items back in the sorted Elo index and recalculates the expected
+        scores left out of date, so the saved state covers every item.
+        """
+        state_manager = self.state_manager
+        with state_manager.lock:
+            if state_manager.elo_index is not None:
+                for item_index in np.flatnonzero(self.frozen).tolist():
+                    if item_index not in state_manager.elo_index:
+                        state_manager.elo_index.insert(item_index, state_manager.ratings.elo[item_index])
+            state_manager.refresh_items(self.stale_items)
+            self.stale_items = set()
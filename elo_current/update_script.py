@@ -1,6 +1,7 @@
 import pandas as pd
 import os
 import numpy as np
+from elo_scores import build_expected_score_matrix
 
 # Define expected columns
 EXPECTED_COLUMNS = {
@@ -16,7 +17,7 @@ DEFAULT_COMPARISONS = 0  # Default number of comparisons if missing
 # Paths and files
 OLD_CSV_FILE = 'film_scores_768.csv'  # Path to the old file
 UPDATED_CSV_FILE = 'updated_film_scores.csv'  # Output updated CSV file
-EXPECTED_SCORE_MATRIX_FILE = 'expected_score_matrix.csv'  # Expected score matrix file
+EXPECTED_SCORE_MATRIX_FILE = 'expected_score_matrix.npy'  # Expected score matrix file
 
 def load_and_update_old_csv(old_csv_file, expected_columns):
     """
@@ -50,17 +51,11 @@ def calculate_expected_scores(elo_scores):
     Calculate the expected score matrix based on Elo scores.
     Uses the Elo formula for expected outcomes.
     """
-    n = len(elo_scores)
-    expected_scores = np.zeros((n, n))
-    for i in range(n):
-        for j in range(n):
-            if i != j:
-                expected_scores[i, j] = 1 / (1 + 10 ** ((elo_scores[j] - elo_scores[i]) / 400))
-    return expected_scores
+    return build_expected_score_matrix(elo_scores)
 
 def save_expected_scores(expected_scores, output_file):
-    """Saves the expected scores matrix to a CSV file."""
-    pd.DataFrame(expected_scores).to_csv(output_file, index=False)
+    """Saves the expected scores matrix to a binary .npy file."""
+    np.save(output_file, expected_scores)
     print(f"Expected score matrix saved to {output_file}.")
 
 def main():
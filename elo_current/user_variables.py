@@ -1,6 +1,7 @@
 #File variables
 DIRECTORY = r"C:\Users\marcu\OneDrive\.EDUCATION MARCUS\Elo test"
 INITIAL_CSV_FILE = 'top_100_clean.csv'#Initial file with items to be sorted
+ADD_NEW_ITEMS = False  # Append items found in INITIAL_CSV_FILE but not in the latest saved rankings when the data is loaded
 
 #Specify any colummns 
 KEEP_COLUMNS = []  # Add the column names of any additional columns you want to keep here, or leave it empty for none
@@ -19,5 +20,43 @@ ELO_CHANGE_COLUMN = 'Elo Change'
 K_FACTOR = 32  # The K-factor to control the magnitude of Elo change
 STANDARD_ELO = 1000  # Standard starting Elo score for items with no initial rating
 
+#Expected score matrix variables
+EXPECTED_SCORE_BACKEND = 'dense'  # 'dense' stores the full n x n matrix, 'implicit' only keeps Elo scores and calculates expected scores on demand
+EXPECTED_SCORE_DTYPE = 'float64'  # Use 'float32' to halve the memory used by the expected score matrix
+EXPECTED_SCORE_BLOCK_SIZE = 1024  # Number of matrix rows calculated at once when building the expected score matrix
+EXPECTED_SCORE_MMAP_MODE = 'c'  # How the saved matrix is memory-mapped when loaded ('c' reads rows from disk on demand, None loads it all)
 
+#Pairing variables
+PAIRING_STRATEGY = 'closest'  # 'closest' picks the pairs with expected scores nearest 0.5, 'information_gain' also weighs how uncertain each item is and how recently the pair was judged
+INFORMATION_GAIN_WINDOW = 8  # Elo neighbours on each side of an item considered as its candidate pairs
+ELO_PRIOR_SD = 350  # Uncertainty of an uncompared item's Elo score, shrinking with every comparison
+PAIR_RECENCY_HALF_LIFE = 50  # Comparisons after which a judged pair recovers half its information gain
 
+#Top-K focus variables
+FOCUS_TOP_K = None  # Stop comparing items confidently outside the top FOCUS_TOP_K, or None to keep comparing every item
+FOCUS_CONFIDENCE_Z = 2.5  # Standard deviations of the Elo gap to the K-th item beyond which an item is frozen
+FROZEN_COLUMN = 'Frozen'  # Column marking the items frozen outside the top K in the saved rankings
+
+#Bradley-Terry refit variables
+BRADLEY_TERRY_PRIOR_GAMES = 1.0  # Virtual drawn games each item plays against an average item, keeping unbeaten and winless items finite
+BRADLEY_TERRY_MAX_ITERATIONS = 50  # Largest number of Newton iterations when refitting
+BRADLEY_TERRY_TOLERANCE = 0.01  # Stop refitting once a Newton step moves no Elo score by more than this
+
+#Plot variables
+PLOT_OUTPUT = 'window'  # 'window' shows a bar chart of every item after a session, 'files' writes the top items, Elo distribution and rank movement charts to DIRECTORY with no display needed
+PLOT_TOP_N = 50  # Items in the top items chart, and risers plus fallers in the rank movement chart
+PLOT_HISTOGRAM_BINS = 60  # Bins in the Elo distribution chart
+
+#Profiling variables
+PROFILE_STAGES = False  # Time each stage of a session and save stage_profile.json and stage_profile.csv to DIRECTORY when it ends
+PROFILE_BUFFER_SIZE = 4096  # Latest durations each stage keeps for the percentiles and latency histograms of the profile
+
+#Journal variables
+JOURNAL_FSYNC_EVERY = 10  # Number of comparisons written to the journal between forced writes to disk
+
+#Snapshot variables
+SNAPSHOT_RETENTION = None  # Number of film_scores_N.csv snapshots to keep in DIRECTORY, or None to keep them all
+SNAPSHOT_RETENTION_MODE = 'archive'  # 'archive' moves older snapshots into film_scores_archive.zip, 'delete' removes them
+
+#Concurrent judging variables
+PAIR_LEASE_SECONDS = 300  # Seconds a judge has to answer a leased pair before it is offered to another judge
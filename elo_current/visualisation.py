@@ -1,14 +1,33 @@
-import matplotlib.pyplot as plt
-from user_variables import NAME_COLUMN,ELO_COLUMN
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+from user_variables import *
 
-def plot_elo_rankings(df, max_title_length=20):
+def shorten_title(title, max_title_length=20):
+    """
+    Cuts a title down to max_title_length characters, ending in '...' if it was cut.
+    """
+    title = str(title)
+    return title if len(title) <= max_title_length else title[:max_title_length-3] + '...'
+
+def plot_elo_rankings(df, max_title_length=20, ratings=None, ranking=None):
     """
     Plots the Elo rankings of items in a horizontal bar chart.
+    If the in-session rating store is given, the Elo scores are taken from it.
+    If a ranking is given (row positions, highest Elo score first, such as state_manager.elo_index.ranking()),
+    it is used instead of sorting the DataFrame.
     """
+    import matplotlib.pyplot as plt  # Only the interactive window needs pyplot and a display
+
     print("Displaying Elo rankings plot: ")
-    df = df.dropna(subset=[NAME_COLUMN])
-    sorted_df = df.sort_values(by=ELO_COLUMN, ascending=False)
-    titles = sorted_df[NAME_COLUMN].apply(lambda x: x if len(x) <= max_title_length else x[:max_title_length-3] + '...')
+    if ratings is not None:
+        df = ratings.to_dataframe(df)
+    sorted_df = df.take(ranking) if ranking is not None else df.sort_values(by=ELO_COLUMN, ascending=False)
+    sorted_df = sorted_df.dropna(subset=[NAME_COLUMN])
+    titles = sorted_df[NAME_COLUMN].apply(lambda x: shorten_title(x, max_title_length))
     plt.figure(figsize=(12, 12))
     plt.barh(titles, sorted_df[ELO_COLUMN], color='skyblue')
     plt.xlabel('Elo Score', fontsize=12)
@@ -17,3 +36,140 @@ def plot_elo_rankings(df, max_title_length=20):
     plt.gca().invert_yaxis()
     plt.tight_layout()
     plt.show()
+
+#########################################################################################################
+# Headless chart files
+#########################################################################################################
+# One bar per item stops being readable (and takes tens of seconds to draw) long before a catalogue reaches
+# thousands of items. These charts are drawn on matplotlib Figure objects, which render with the
+# non-interactive Agg backend straight to PNG files, so no display or pyplot window is needed. Each chart
+# draws a fixed number of artists whatever the number of items: the top N bars, a histogram with
+# PLOT_HISTOGRAM_BINS bins, and the N/2 biggest risers and fallers. The only work that grows with the
+# catalogue is NumPy selection and binning.
+
+TOP_ITEMS_PLOT_FILE = 'elo_top_items.png'
+DISTRIBUTION_PLOT_FILE = 'elo_distribution.png'
+RANK_MOVEMENT_PLOT_FILE = 'elo_rank_movement.png'
+
+def top_item_positions(elo_scores, top_n, ranking=None):
+    """
+    Returns the row positions of the top_n highest Elo scores, highest first, using the first top_n entries
+    of ranking if it is given and a partial sort of the scores otherwise.
+    """
+    if ranking is not None:
+        return np.asarray(ranking[:top_n], dtype=np.int64)
+    elo_scores = np.asarray(elo_scores, dtype=np.float64)
+    if top_n >= len(elo_scores):
+        return np.argsort(-elo_scores, kind='stable')
+    top = np.argpartition(-elo_scores, top_n - 1)[:top_n]
+    return top[np.argsort(-elo_scores[top], kind='stable')]
+
+def plot_top_items(df, file_path, top_n=PLOT_TOP_N, ranking=None, max_title_length=30):
+    """
+    Writes a horizontal bar chart of the top_n items by Elo score to a PNG file.
+
+    :param df: DataFrame containing the item data, indexed by row position.
+    :param ranking: Optional row positions, highest Elo score first, used instead of selecting the top items.
+    """
+    top = top_item_positions(df[ELO_COLUMN].to_numpy(), top_n, ranking)
+    titles = [shorten_title(name, max_title_length) for name in df[NAME_COLUMN].to_numpy()[top]]
+    elo_scores = df[ELO_COLUMN].to_numpy()[top]
+
+    figure = Figure(figsize=(10, max(3, 0.22 * len(top) + 1.5)))
+    ax = figure.subplots()
+    ax.barh(np.arange(len(top)), elo_scores, color='skyblue')
+    ax.set_yticks(np.arange(len(top)), titles, fontsize=8)
+    ax.invert_yaxis()
+    if len(elo_scores):
+        margin = max(10.0, 0.05 * (elo_scores.max() - elo_scores.min()))
+        ax.set_xlim(elo_scores.min() - margin, elo_scores.max() + margin)  # Bars from zero would hide the gaps between items
+    ax.set_xlabel('Elo Score')
+    ax.set_title(f'Top {len(top)} of {len(df)} items by Elo score')
+    figure.tight_layout()
+    figure.savefig(file_path, dpi=100)
+
+def plot_rating_distribution(df, file_path, bins=PLOT_HISTOGRAM_BINS, top_n=PLOT_TOP_N):
+    """
+    Writes a histogram of every item's Elo score to a PNG file, marking the Elo score needed for the top_n.
+    """
+    elo_scores = df[ELO_COLUMN].to_numpy(dtype=np.float64)
+    counts, edges = np.histogram(elo_scores, bins=bins)
+
+    figure = Figure(figsize=(10, 5))
+    ax = figure.subplots()
+    ax.stairs(counts, edges, fill=True, color='skyblue')
+    if 0 < top_n < len(elo_scores):
+        cutoff = np.partition(elo_scores, len(elo_scores) - top_n)[len(elo_scores) - top_n]
+        ax.axvline(cutoff, color='darkorange', linestyle='--', label=f'Top {top_n} cutoff ({cutoff:.0f})')
+        ax.legend()
+    ax.set_xlabel('Elo Score')
+    ax.set_ylabel('Items')
+    ax.set_title(f'Elo scores of {len(elo_scores)} items (mean {elo_scores.mean():.0f}, sd {elo_scores.std():.0f})')
+    figure.tight_layout()
+    figure.savefig(file_path, dpi=100)
+
+def plot_rank_movement(df, file_path, top_n=PLOT_TOP_N, max_title_length=30):
+    """
+    Writes a chart of the top_n // 2 items that rose the most places and the top_n // 2 that fell the most,
+    read from RANK_CHANGE_COLUMN, to a PNG file. Items without a rank change (such as new items) are skipped.
+    """
+    rank_changes = pd.to_numeric(df[RANK_CHANGE_COLUMN], errors='coerce').to_numpy(dtype=np.float64) if RANK_CHANGE_COLUMN in df.columns \
+        else np.full(len(df), np.nan)
+    moved = np.flatnonzero(np.nan_to_num(rank_changes) != 0)
+    num_each = max(top_n // 2, 1)
+    order = np.argsort(-rank_changes[moved], kind='stable')
+    risers = moved[order[:num_each]]
+    fallers = moved[order[::-1][:num_each]]
+    shown = np.concatenate([risers[rank_changes[risers] > 0], fallers[rank_changes[fallers] < 0][::-1]])
+
+    figure = Figure(figsize=(10, max(3, 0.22 * len(shown) + 1.5)))
+    ax = figure.subplots()
+    changes = rank_changes[shown]
+    ax.barh(np.arange(len(shown)), changes, color=np.where(changes > 0, 'seagreen', 'indianred'))
+    ax.set_yticks(np.arange(len(shown)), [shorten_title(name, max_title_length) for name in df[NAME_COLUMN].to_numpy()[shown]], fontsize=8)
+    ax.invert_yaxis()
+    ax.axvline(0, color='black', linewidth=0.8)
+    ax.set_xlabel('Places moved up since the session started')
+    ax.set_title(f'Biggest rank movements ({len(moved)} of {len(df)} items moved)')
+    figure.tight_layout()
+    figure.savefig(file_path, dpi=100)
+
+def render_rankings(df, directory, ranking=None, ratings=None, top_n=PLOT_TOP_N, bins=PLOT_HISTOGRAM_BINS):
+    """
+    Writes the top items, Elo distribution and rank movement charts to PNG files in a directory.
+
+    :param df: DataFrame containing the item data, indexed by row position.
+    :param ranking: Optional row positions, highest Elo score first, such as state_manager.elo_index.ranking().
+    :param ratings: Optional in-session rating store to take the Elo scores from.
+    :return: The paths of the files written.
+    """
+    start = time.perf_counter()
+    if ratings is not None:
+        df = ratings.to_dataframe(df)
+    os.makedirs(directory, exist_ok=True)
+    file_paths = [os.path.join(directory, file_name) for file_name in (TOP_ITEMS_PLOT_FILE, DISTRIBUTION_PLOT_FILE, RANK_MOVEMENT_PLOT_FILE)]
+    plot_top_items(df, file_paths[0], top_n, ranking)
+    plot_rating_distribution(df, file_paths[1], bins, top_n)
+    plot_rank_movement(df, file_paths[2], top_n)
+    print(f"Saved ranking charts of {len(df)} items to {directory} in {time.perf_counter() - start:.2f}s.")
+    return file_paths
+
+def main():
+    from file_handling import read_manifest, list_snapshot_files
+
+    parser = argparse.ArgumentParser(description="Draw the latest saved rankings to PNG files without a display.")
+    parser.add_argument('--directory', default=DIRECTORY, help="Directory holding the saved rankings.")
+    parser.add_argument('--output-directory', default=None, help="Directory to write the charts to (defaults to --directory).")
+    parser.add_argument('--top-n', type=int, default=PLOT_TOP_N, help="Items in the top items chart, and risers plus fallers in the rank movement chart.")
+    parser.add_argument('--bins', type=int, default=PLOT_HISTOGRAM_BINS, help="Bins in the Elo score histogram.")
+    args = parser.parse_args()
+
+    manifest = read_manifest(args.directory)
+    snapshots = [manifest['latest_snapshot']] if manifest is not None else list_snapshot_files(args.directory)
+    if not snapshots:
+        raise SystemExit(f"No saved rankings found in {args.directory}.")
+    df = pd.read_csv(os.path.join(args.directory, snapshots[-1]))
+    render_rankings(df, args.output_directory or args.directory, top_n=args.top_n, bins=args.bins)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit, parse_qs
+from user_variables import *
+from state_manager import StateManager
+from file_handling import load_or_initialise_data, save_to_csv
+from elo_scores import calculate_rank_and_elo_changes
+from pair_scheduler import PairScheduler
+from leaderboard import Leaderboard
+
+#########################################################################################################
+# Local web judging server
+#########################################################################################################
+# Lets several people judge the same rankings at once from a browser, using only the standard library.
+# All judges share one StateManager. Pairs are leased to judges by a PairScheduler, so no item is in two pairs
+# being judged at once, and results are applied with update_score one at a time under a write lock. Pairs follow
+# the same two phases as run_iterations: random pairs until every item has n comparisons, then the closest pairs.
+
+JUDGE_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Elo comparison</title>
+<style>body{font-family:Arial;text-align:center;margin-top:40px}button{font-size:16px;margin:8px;padding:12px 24px;min-width:300px}</style>
+</head><body>
+<h2 id="item_1"></h2><h2 id="item_2"></h2>
+<button onclick="judge('item_1')" id="button_1"></button><br>
+<button onclick="judge('item_2')" id="button_2"></button><br>
+<button onclick="judge('draw')">Draw</button>
+<p id="status">Keys: 1 or Left, 2 or Right, D or Down for a draw.</p>
+<script>
+let pair = null;
+const judge_id = localStorage.judge_id || (localStorage.judge_id = Math.random().toString(36).slice(2));
+async function nextPair() {
+  const response = await fetch('/pair?judge=' + judge_id);
+  if (response.status !== 200) {
+    document.getElementById('status').textContent = 'Every item is being judged by someone else, trying again...';
+    setTimeout(nextPair, 1000);
+    return;
+  }
+  pair = await response.json();
+  document.getElementById('item_1').textContent = 'Item 1: ' + pair.item_1;
+  document.getElementById('item_2').textContent = 'Item 2: ' + pair.item_2;
+  document.getElementById('button_1').textContent = pair.item_1 + ' Wins';
+  document.getElementById('button_2').textContent = pair.item_2 + ' Wins';
+}
+async function judge(winner) {
+  if (!pair) return;
+  const current = pair; pair = null;
+  await fetch('/result', {method: 'POST', body: JSON.stringify({pair_id: current.pair_id, winner: winner})});
+  await nextPair();
+}
+document.addEventListener('keydown', e => {
+  if (e.key === '1' || e.key === 'ArrowLeft') judge('item_1');
+  if (e.key === '2' || e.key === 'ArrowRight') judge('item_2');
+  if (e.key === 'd' || e.key === 'ArrowDown') judge('draw');
+});
+nextPair();
+</script></body></html>
+"""
+WINNER_SCORES = {'item_1': (1, 0), 'item_2': (0, 1), 'draw': (0.5, 0.5)}
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict', 500: 'Internal Server Error',
+               503: 'Service Unavailable'}
+
+class JudgingServer:
+    """
+    Hands out pairs to any number of judges and applies their results to one StateManager.
+    """
+    def __init__(self, df, state_manager, directory=DIRECTORY, n=2, lease_seconds=PAIR_LEASE_SECONDS):
+        """
+        :param df: DataFrame containing the item data, indexed by row position.
+        :param state_manager: Instance of StateManager with the loaded ratings.
+        :param directory: Directory snapshots are saved to.
+        :param n: The minimum number of comparisons each item gets from random pairs first.
+        :param lease_seconds: Seconds a judge has to answer a pair before it is offered to another judge.
+        """
+        self.df = df
+        self.state_manager = state_manager
+        self.directory = directory
+        self.scheduler = PairScheduler(df, state_manager, n=n, lease_seconds=lease_seconds)
+        self.leaderboard = Leaderboard(state_manager)  # Ranks at the latest save, to calculate rank changes from
+        self.write_lock = asyncio.Lock()
+        self.started = time.perf_counter()
+
+    @property
+    def results_applied(self):
+        return self.scheduler.results_applied
+
+    def next_pair(self, judge_id):
+        """
+        Leases the next pair to a judge, with an id to send back with the result.
+
+        :return: (status, response) where status is an HTTP status code.
+        """
+        lease = self.scheduler.lease(judge_id)
+        if lease is None:
+            return 503, {'error': "every item is already being judged, try again shortly"}
+        return 200, {'pair_id': lease.lease_id, 'item_1': lease.item_1, 'item_2': lease.item_2, 'expires_in': self.scheduler.lease_seconds}
+
+    async def submit_result(self, pair_id, winner):
+        """
+        Applies a judged pair with update_score. Results are applied one at a time under the write lock.
+
+        :return: (status, response) where status is an HTTP status code.
+        """
+        if not isinstance(winner, str) or winner not in WINNER_SCORES:
+            return 400, {'error': f"winner must be one of {list(WINNER_SCORES)}"}
+        async with self.write_lock:
+            if not self.scheduler.submit(pair_id, WINNER_SCORES[winner][0]):
+                return 409, {'error': f"pair {pair_id} was not handed out, has expired or has already been judged"}
+        return 200, {'applied': True, 'comparison_count': self.state_manager.comparison_count}
+
+    async def save(self):
+        """
+        Saves a snapshot on a worker thread, holding the write lock so no results are applied mid-save.
+        Pairs are still handed out while the snapshot is written.
+        """
+        async with self.write_lock:
+            ratings_df = calculate_rank_and_elo_changes(self.df, ratings=self.state_manager.ratings, leaderboard=self.leaderboard)
+            await asyncio.get_running_loop().run_in_executor(None, save_to_csv, ratings_df, self.state_manager, self.directory)
+            self.leaderboard = Leaderboard(self.state_manager)
+        return {'saved': True, 'comparison_count': self.state_manager.comparison_count}
+
+    def save_on_exit(self):
+        """
+        Saves everything judged this session once the server has stopped, as main.py does after the popups.
+        """
+        print(f"Applied {self.results_applied} results.")
+        ratings_df = calculate_rank_and_elo_changes(self.df, ratings=self.state_manager.ratings, leaderboard=self.leaderboard)
+        save_to_csv(ratings_df, self.state_manager, self.directory)
+        self.state_manager.close_journal()
+
+    def top_items(self, limit=20):
+        """
+        Returns the top items by Elo score, with their places moved since the latest save, read from the sorted Elo index.
+        """
+        names = self.df[NAME_COLUMN]
+        ratings = self.state_manager.ratings
+        with self.state_manager.lock:
+            return [{'name': names.iloc[item_index], 'rank': rank, 'rank_change': rank_change, 'elo': round(float(ratings.elo[item_index]), 2),
+                     'comparisons': int(ratings.comparisons[item_index])}
+                    for item_index, rank, rank_change in self.leaderboard.top(limit)]
+
+    def stats(self):
+        """
+        Returns the results applied, pairs out with judges and the average results per second.
+        """
+        elapsed = time.perf_counter() - self.started
+        return {'results_applied': self.results_applied, 'outstanding_pairs': len(self.scheduler.leases), 'leases_expired': self.scheduler.leases_expired,
+                'comparison_count': self.state_manager.comparison_count, 'results_per_second': self.results_applied / max(elapsed, 1e-9)}
+
+    async def route(self, method, target, body):
+        """
+        Handles one request.
+
+        :return: (status, content_type, body bytes).
+        """
+        url = urlsplit(target)
+        if url.path == '/' and method == 'GET':
+            return 200, 'text/html; charset=utf-8', JUDGE_PAGE.encode()
+        if url.path == '/pair' and method == 'GET':
+            judge_id = parse_qs(url.query).get('judge', [None])[0]
+            if judge_id is None:
+                return _json_response(400, {'error': "expected a judge query parameter identifying the judge"})
+            return _json_response(*self.next_pair(judge_id))
+        if url.path == '/result' and method == 'POST':
+            try:
+                request = json.loads(body or b'{}')
+                pair_id = int(request['pair_id'])
+            except (ValueError, KeyError, TypeError):
+                return _json_response(400, {'error': "expected a JSON body with pair_id and winner"})
+            return _json_response(*await self.submit_result(pair_id, request.get('winner')))
+        if url.path == '/leaderboard' and method == 'GET':
+            try:
+                limit = int(parse_qs(url.query).get('limit', ['20'])[0])
+                if limit < 0:
+                    raise ValueError
+            except ValueError:
+                return _json_response(400, {'error': "expected limit to be a whole number of items, 0 or more"})
+            return _json_response(200, self.top_items(limit))
+        if url.path == '/stats' and method == 'GET':
+            return _json_response(200, self.stats())
+        if url.path == '/save' and method == 'POST':
+            return _json_response(200, await self.save())
+        if url.path in ('/', '/pair', '/result', '/leaderboard', '/stats', '/save'):
+            return _json_response(405, {'error': f"{method} is not supported for {url.path}"})
+        return _json_response(404, {'error': f"no such path {url.path}"})
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serves HTTP/1.1 requests on one connection, keeping it open between requests unless asked not to.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                try:
+                    status, content_type, response_body = await self.route(method, target, body)
+                except Exception as error:  # A bug handling one request should not drop the judge's connection
+                    print(f"Error handling {method} {target}: {error!r}")
+                    status, content_type, response_body = _json_response(500, {'error': "the server could not handle this request"})
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: {content_type}\r\n"
+                             f"Content-Length: {len(response_body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                             + response_body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # A judge closed the page or sent something that is not HTTP
+        finally:
+            writer.close()
+
+def _json_response(status, payload):
+    return status, 'application/json', json.dumps(payload).encode()
+
+async def serve(server, host='127.0.0.1', port=8000):
+    """
+    Runs the judging server until it is cancelled.
+    """
+    http_server = await asyncio.start_server(server.handle_connection, host, port)
+    print(f"Judging server running on http://{host}:{port}/ (Ctrl+C to save and stop).")
+    async with http_server:
+        await http_server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve comparisons to several judges at once from a local web page.")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on (localhost by default).")
+    parser.add_argument('--port', type=int, default=8000, help="Port to listen on.")
+    parser.add_argument('--lease-seconds', type=float, default=PAIR_LEASE_SECONDS, help="Seconds a judge has to answer a pair.")
+    parser.add_argument('--n', type=int, default=2, help="Minimum comparisons per item from random pairs first.")
+    parser.add_argument('--directory', default=DIRECTORY, help="Directory holding the saved rankings.")
+    parser.add_argument('--verbose', action='store_true', help="Print the Elo changes of every result.")
+    args = parser.parse_args()
+
+    state_manager = StateManager(verbose=args.verbose)
+    df = load_or_initialise_data(args.directory, state_manager, INITIAL_CSV_FILE)
+    server = JudgingServer(df, state_manager, args.directory, args.n, args.lease_seconds)
+
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    server.save_on_exit()
+
+if __name__ == "__main__":
+    main()